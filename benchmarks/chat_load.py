@@ -0,0 +1,287 @@
+"""
+End-to-end load test of the chat pipeline.
+
+Simulates many concurrent virtual users, each registering via ``/user``,
+sending a few ``/chat`` turns and reading ``/chat/history/{user_id}``, and
+reports latency percentiles, throughput, DB queries per request and event
+loop lag. Results are saved as JSON tagged with the git commit, and can be
+compared against a previous run to catch regressions before deploy.
+
+By default the app runs in this process with the local stub AI provider
+(``AI_PROVIDER=stub``) and rate limiting off, so only PostgreSQL is
+needed::
+
+    python -m benchmarks.chat_load --users 1000 --turns 3 \\
+        --output bench.json --compare baseline.json
+
+With ``--url`` a running server is load tested instead; DB query counts and
+event loop lag are then only available for the in-process app.
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from contextlib import AsyncExitStack
+
+import httpx
+
+# Counter of DB queries of the request being sent
+_request_queries = contextvars.ContextVar('request_queries', default=None)
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+def summarize_latencies(values: list) -> dict:
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 50) * 1000, 2),
+        'p95_ms': round(percentile(values, 95) * 1000, 2),
+        'p99_ms': round(percentile(values, 99) * 1000, 2),
+        'mean_ms': round(statistics.fmean(values) * 1000, 2) if values else 0,
+        'max_ms': round(max(values) * 1000, 2) if values else 0,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], text=True,
+            stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+class LoopLagMonitor:
+    def __init__(self, interval: float = 0.01):
+        """Measures how late the event loop wakes up a sleeping task."""
+        self.interval = interval
+        self.lags = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - started - self.interval))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+    def summary(self) -> dict:
+        return summarize_latencies(self.lags)
+
+
+class Benchmark:
+    def __init__(self, client: httpx.AsyncClient, args):
+        self.client = client
+        self.args = args
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.queries = defaultdict(list)
+
+    async def request(self, name: str, method: str, url: str, **kwargs):
+        counter = [0]
+        token = _request_queries.set(counter)
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.errors[name] += 1
+            return None
+        finally:
+            _request_queries.reset(token)
+        self.latencies[name].append(time.perf_counter() - started)
+        self.queries[name].append(counter[0])
+        if response.status_code >= 400:
+            self.errors[name] += 1
+            return None
+        return response.json()
+
+    async def virtual_user(self, number: int):
+        rnd = random.Random(number)
+        await asyncio.sleep(rnd.uniform(0, self.args.ramp_up))
+        user = await self.request('POST /user', 'POST', '/user', json={
+            'name': f'bench-{number}',
+            'age': rnd.randint(16, 70),
+            'gender': rnd.choice(('male', 'female')),
+            'external_id': f'bench-{self.args.run_id}-{number}',
+        })
+        if not user:
+            return
+        session_id = 0
+        for turn in range(self.args.turns):
+            answer = await self.request('POST /chat', 'POST', '/chat', json={
+                'user_id': user['id'],
+                'session_id': session_id,
+                'message': f'Сообщение {turn}: мне трудно уснуть, что делать?',
+            })
+            if answer:
+                session_id = answer['session_id']
+            await asyncio.sleep(rnd.uniform(0, self.args.think_time))
+        await self.request(
+            'GET /chat/history/{user_id}', 'GET', f'/chat/history/{user["id"]}'
+        )
+
+    async def run(self) -> dict:
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            self.virtual_user(number) for number in range(self.args.users)
+        ))
+        elapsed = time.perf_counter() - started
+        total = sum(len(v) for v in self.latencies.values())
+        return {
+            'elapsed_s': round(elapsed, 3),
+            'requests': total,
+            'throughput_rps': round(total / elapsed, 2) if elapsed else 0,
+            'endpoints': {
+                name: {
+                    **summarize_latencies(values),
+                    'errors': self.errors[name],
+                    'db_queries_per_request': (
+                        round(statistics.fmean(self.queries[name]), 2)
+                        if self.queries[name] else 0
+                    ),
+                }
+                for name, values in sorted(self.latencies.items())
+            },
+        }
+
+
+def _count_query(*_):
+    counter = _request_queries.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+async def run_benchmark(args) -> dict:
+    async with AsyncExitStack() as stack:
+        monitor = LoopLagMonitor()
+        if args.url:
+            transport = httpx.AsyncHTTPTransport(
+                limits=httpx.Limits(max_connections=args.connections)
+            )
+            base_url = args.url
+        else:
+            os.environ.setdefault('AI_PROVIDER', 'stub')
+            # Measures the pipeline itself, not the limiter
+            os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+            from sqlalchemy import event
+
+            from src import app
+            from src.api_versions.v1 import routes
+
+            await stack.enter_async_context(app.router.lifespan_context(app))
+            event.listen(
+                routes.db.engine.sync_engine, 'before_cursor_execute',
+                _count_query
+            )
+            stack.callback(
+                event.remove, routes.db.engine.sync_engine,
+                'before_cursor_execute', _count_query
+            )
+            transport = httpx.ASGITransport(app=app)
+            base_url = 'http://bench/api/v1'
+
+        client = await stack.enter_async_context(httpx.AsyncClient(
+            transport=transport, base_url=base_url, timeout=args.timeout
+        ))
+        monitor.start()
+        try:
+            results = await Benchmark(client, args).run()
+        finally:
+            await monitor.stop()
+
+    results['event_loop_lag'] = monitor.summary()
+    results['commit'] = git_commit()
+    results['mode'] = 'remote' if args.url else 'in-process'
+    results['config'] = {
+        'users': args.users,
+        'turns': args.turns,
+        'think_time': args.think_time,
+        'ramp_up': args.ramp_up,
+        'ai_provider': os.getenv('AI_PROVIDER', 'deepseek'),
+    }
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Returns regressions of p95/p99 latency and DB queries per request."""
+    regressions = []
+    for name, current in results['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(name)
+        if not previous:
+            continue
+        for metric in ('p95_ms', 'p99_ms', 'db_queries_per_request'):
+            before, after = previous.get(metric, 0), current[metric]
+            if before and after > before * (1 + threshold):
+                regressions.append(
+                    f'{name} {metric}: {before} -> {after} '
+                    f'(+{(after / before - 1) * 100:.1f}%)'
+                )
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=100,
+                        help='number of concurrent virtual users')
+    parser.add_argument('--turns', type=int, default=3,
+                        help='chat turns per virtual user')
+    parser.add_argument('--think-time', type=float, default=0.5,
+                        help='max pause between turns of a user, seconds')
+    parser.add_argument('--ramp-up', type=float, default=1.0,
+                        help='users start spread over this many seconds')
+    parser.add_argument('--url', default=None,
+                        help='base URL of a running API, e.g. '
+                             'http://localhost:8000/api/v1')
+    parser.add_argument('--connections', type=int, default=1000,
+                        help='max HTTP connections for --url mode')
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--run-id', default=str(int(time.time())),
+                        help='makes registered users unique per run')
+    parser.add_argument('--output', default=None,
+                        help='file to save JSON results to')
+    parser.add_argument('--compare', default=None,
+                        help='JSON results of a previous run to compare to')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='allowed relative slowdown for --compare')
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    results = asyncio.run(run_benchmark(args))
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
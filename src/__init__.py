@@ -7,6 +7,9 @@ __all__ = [
     'API_VERSIONS',
     'Logger',
     'app',
+    'cache',
     'constants',
+    'metrics',
     'misc',
+    'tracing',
 ]
@@ -2,10 +2,30 @@
 This module contains implementation for various AI APIs.
 """
 
-from .base import APIError
+from .base import AIProvider, APIError
 from .deepseek import DeepSeekAPI
+from .factory import PROVIDERS, create_provider
+from .openai_compatible import OpenAICompatibleAPI
+from .resilient import (
+    CircuitBreaker,
+    CircuitOpen,
+    DeadlineExceeded,
+    ResilientProvider,
+    create_resilient_provider,
+)
+from .stub import StubAPI
 
 __all__ = [
+    'AIProvider',
     'APIError',
+    'CircuitBreaker',
+    'CircuitOpen',
+    'DeadlineExceeded',
     'DeepSeekAPI',
+    'OpenAICompatibleAPI',
+    'PROVIDERS',
+    'ResilientProvider',
+    'StubAPI',
+    'create_provider',
+    'create_resilient_provider',
 ]
@@ -1,5 +1,146 @@
+"""
+This module contains the interface every AI provider implements, with the
+prompt building they share.
+"""
+
+from abc import ABC, abstractmethod
+from typing import AsyncIterator
+
+from .context import build_context, estimate_tokens
+from ..constants import AI_CONTEXT_TOKEN_BUDGET
+
 __all__ = [
-    'APIError'
+    'AIProvider',
+    'APIError',
 ]
 
-APIError = Exception
+
+# Statuses of overloaded or failing providers, worth a retry
+_TRANSIENT_STATUSES = frozenset((408, 409, 425, 429, 500, 502, 503, 504))
+
+
+class APIError(Exception):
+    def __init__(self, message: str = '', status_code: int = None,
+                 transient: bool = None):
+        """
+        Error of a call to an AI provider. ``status_code`` is the HTTP status
+        the provider answered with, if it answered at all. ``transient`` is
+        whether a retry may succeed: by default, if the provider answered
+        that it is overloaded or failing; providers pass ``True`` for
+        connection errors and timeouts.
+        """
+        super().__init__(message)
+        self.status_code = status_code
+        if transient is None:
+            transient = status_code in _TRANSIENT_STATUSES
+        self.transient = transient
+
+
+class AIProvider(ABC):
+    name = 'base'
+
+    def __init__(self, context_token_budget: int = AI_CONTEXT_TOKEN_BUDGET):
+        self.context_token_budget = context_token_budget
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}()'
+
+    def build_messages(self, user_info: dict, history: list,
+                       user_message: str, summary: str = None,
+                       memories: list = None) -> list:
+        """
+        Builds the prompt: system prompt, the running summary of the older
+        part of the session (if any), snippets of earlier sessions relevant
+        to the message (``memories``, if any), then as many of the latest
+        ``history`` messages as fit into the context token budget, then the
+        user message.
+        """
+        system_prompt = (
+            f"Ты — ИИ-психолог NeuroMentor. "
+            f"Твой собеседник: {user_info.get('name', 'Пользователь')}. "
+            f"Пол: {user_info.get('gender', 'не указан')}, "
+            f"возраст: {user_info.get('age', 'не указан')}. "
+            f"Общайся дружелюбно, учитывая эти данные. "
+            f"ВАЖНО: Отвечай строго на том языке, на котором к тебе "
+            f"обратился пользователь. "
+            f"ЗАПРЕТ: Не используй Markdown-разметку (никаких **, ##, "
+            f"списков через - или курсива). "
+            f"Пиши обычным текстом, разделяя мысли переносом строки."
+        )
+
+        messages = [{"role": "system", "content": system_prompt}]
+
+        history_budget = (
+            self.context_token_budget
+            - estimate_tokens(system_prompt)
+            - estimate_tokens(user_message)
+        )
+        if summary:
+            summary_prompt = (
+                f"Краткое содержание предыдущей части разговора:\n{summary}"
+            )
+            messages.append({"role": "system", "content": summary_prompt})
+            history_budget -= estimate_tokens(summary_prompt)
+        if memories:
+            memory_prompt = (
+                "Из прошлых разговоров с пользователем:\n"
+                + "\n".join(f"- {memory}" for memory in memories)
+            )
+            messages.append({"role": "system", "content": memory_prompt})
+            history_budget -= estimate_tokens(memory_prompt)
+        messages.extend(build_context(history, history_budget))
+
+        messages.append({"role": "user", "content": user_message})
+
+        return messages
+
+    @staticmethod
+    def build_summary_messages(summary: str, history: list) -> list:
+        """Builds the prompt that folds ``history`` into ``summary``."""
+        dialogue = "\n".join(
+            f"{'Пользователь' if msg['role'] == 'user' else 'Психолог'}: "
+            f"{msg['content']}"
+            for msg in history
+        )
+        prompt = (
+            f"Текущее краткое содержание разговора:\n"
+            f"{summary or 'пока пусто'}\n\n"
+            f"Новые сообщения:\n{dialogue}"
+        )
+        return [
+            {"role": "system", "content": (
+                "Ты ведешь краткое содержание разговора психолога с "
+                "пользователем. "
+                "Дополни текущее краткое содержание новыми сообщениями. "
+                "Сохрани факты о пользователе, его проблемы, цели и данные "
+                "ему советы. "
+                "Пиши сжато, обычным текстом, не длиннее 250 слов."
+            )},
+            {"role": "user", "content": prompt}
+        ]
+
+    @abstractmethod
+    async def get_chat_response(self, user_info: dict, history: list,
+                                user_message: str, summary: str = None,
+                                memories: list = None) -> dict:
+        """Returns ``{"text": ..., "tokens": ...}`` of the model answer."""
+
+    @abstractmethod
+    def stream_chat_response(self, user_info: dict, history: list,
+                             user_message: str, summary: str = None,
+                             memories: list = None) -> AsyncIterator[dict]:
+        """
+        Yields ``{"text": ..., "tokens": None}`` for every content delta as
+        it arrives, and one last ``{"text": "", "tokens": ...}`` item with
+        the token usage.
+        """
+
+    @abstractmethod
+    async def summarize(self, summary: str, history: list) -> str:
+        """
+        Returns ``summary`` extended with the ``history`` messages, which
+        are folded into it.
+        """
+
+    async def aclose(self):
+        """Releases connections held by the provider."""
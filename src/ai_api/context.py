@@ -0,0 +1,62 @@
+"""
+This module contains the prompt context builder, which packs as much of the
+latest chat history as fits into a token budget.
+"""
+
+import math
+import re
+
+__all__ = [
+    'MESSAGE_OVERHEAD_TOKENS',
+    'build_context',
+    'estimate_tokens',
+]
+
+# Role markers and separators the chat template adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_PIECE_RE = re.compile(r'[^\W\d_]+|\d+|[^\w\s]', re.UNICODE)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Local estimate of the number of tokens in ``text``, without a model
+    tokenizer. BPE vocabularies keep about four latin characters per token
+    and noticeably fewer for cyrillic, digits are split into groups of up
+    to three, and every punctuation mark is a token of its own.
+    """
+    if not text:
+        return 0
+
+    tokens = 0
+    for piece in _PIECE_RE.findall(text):
+        if piece.isdigit():
+            tokens += math.ceil(len(piece) / 3)
+        elif piece.isascii():
+            tokens += math.ceil(len(piece) / 4) if piece.isalpha() else 1
+        else:
+            tokens += math.ceil(len(piece) / 2.5)
+    return tokens
+
+
+def build_context(history: list, budget: int) -> list:
+    """
+    Returns the newest messages of ``history`` (oldest first, as the model
+    expects them) whose total size fits into ``budget`` tokens. Every item
+    is a ``{"role", "content"}`` dict which may carry a precomputed
+    ``"tokens"`` count; it is estimated here when missing.
+    """
+    context = []
+    used = 0
+    for msg in reversed(history):
+        tokens = msg.get("tokens")
+        if tokens is None:
+            tokens = estimate_tokens(msg["content"])
+        tokens += MESSAGE_OVERHEAD_TOKENS
+        if used + tokens > budget:
+            break
+        used += tokens
+        context.append({"role": msg["role"], "content": msg["content"]})
+
+    context.reverse()
+    return context
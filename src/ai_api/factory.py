@@ -0,0 +1,24 @@
+from .base import AIProvider, APIError
+from .deepseek import DeepSeekAPI
+from .openai_compatible import OpenAICompatibleAPI
+from .stub import StubAPI
+from ..constants import AI_PROVIDER
+
+__all__ = ['PROVIDERS', 'create_provider']
+
+PROVIDERS = {
+    provider.name: provider
+    for provider in (DeepSeekAPI, OpenAICompatibleAPI, StubAPI)
+}
+
+
+def create_provider(name: str = AI_PROVIDER, **kwargs) -> AIProvider:
+    """Creates the AI provider registered under ``name``."""
+    try:
+        provider = PROVIDERS[name]
+    except KeyError:
+        raise APIError(
+            f"Unknown AI provider {name!r}, "
+            f"available: {', '.join(sorted(PROVIDERS))}"
+        )
+    return provider(**kwargs)
@@ -0,0 +1,152 @@
+import httpx
+import openai
+from .base import AIProvider, APIError
+from ..constants import (
+    AI_API_KEY,
+    AI_BASE_URL,
+    AI_CONNECT_TIMEOUT,
+    AI_CONTEXT_TOKEN_BUDGET,
+    AI_KEEPALIVE_EXPIRY,
+    AI_MAX_CONNECTIONS,
+    AI_MAX_KEEPALIVE_CONNECTIONS,
+    AI_MODEL,
+    AI_TIMEOUT,
+)
+
+__all__ = ['OpenAICompatibleAPI']
+
+
+class OpenAICompatibleAPI(AIProvider):
+    name = 'openai'
+
+    def __init__(
+            self,
+            api_key: str = AI_API_KEY,
+            base_url: str = AI_BASE_URL,
+            model: str = AI_MODEL,
+            max_connections: int = AI_MAX_CONNECTIONS,
+            max_keepalive_connections: int = AI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry: float = AI_KEEPALIVE_EXPIRY,
+            timeout: float = AI_TIMEOUT,
+            connect_timeout: float = AI_CONNECT_TIMEOUT,
+            context_token_budget: int = AI_CONTEXT_TOKEN_BUDGET,
+            max_retries: int = 0
+    ):
+        """
+        Any chat completions API compatible with OpenAI. Creates an async
+        client on top of one pooled HTTP client, so concurrent chats share
+        keep-alive connections instead of blocking the event loop one
+        completion at a time. The SDK does not retry by default
+        (``max_retries``): ``ResilientProvider`` does, within a deadline.
+        """
+        super().__init__(context_token_budget)
+        self.api_key = api_key
+        if not self.api_key:
+            raise APIError(
+                f"{self.__class__.__name__} API Key not found in "
+                f"environment variables"
+            )
+
+        self.model = model or "gpt-4o-mini"
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.http_client = openai.DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry
+            ),
+            timeout=self.timeout
+        )
+        self.client = openai.AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=base_url or None,
+            timeout=self.timeout,
+            max_retries=max_retries,
+            http_client=self.http_client
+        )
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(model={self.model!r})'
+
+    async def aclose(self):
+        """Closes the pooled HTTP client and all its connections."""
+        await self.client.close()
+
+    def _error(self, e: Exception) -> APIError:
+        """
+        Wraps an error of the SDK. Failing to reach the provider
+        (``APIConnectionError``, ``APITimeoutError`` included) is transient;
+        other errors are if their status is.
+        """
+        return APIError(
+            f"{self.__class__.__name__} Error: {str(e)}",
+            status_code=getattr(e, 'status_code', None),
+            transient=(
+                True if isinstance(e, openai.APIConnectionError) else None
+            )
+        )
+
+    async def get_chat_response(self, user_info: dict, history: list,
+                                user_message: str, summary: str = None,
+                                memories: list = None):
+        try:
+            messages = self.build_messages(
+                user_info, history, user_message, summary, memories
+            )
+
+            response = await self.client.chat.completions.create(  # noqa
+                model=self.model,
+                messages=messages,
+                stream=False
+            )
+
+            return {
+                "text": response.choices[0].message.content,
+                "tokens": response.usage.total_tokens
+            }
+
+        except Exception as e:
+            raise self._error(e)
+
+    async def stream_chat_response(self, user_info: dict, history: list,
+                                   user_message: str, summary: str = None,
+                                   memories: list = None):
+        try:
+            messages = self.build_messages(
+                user_info, history, user_message, summary, memories
+            )
+
+            stream = await self.client.chat.completions.create(  # noqa
+                model=self.model,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+
+            tokens = 0
+            async for chunk in stream:
+                if chunk.usage:
+                    tokens = chunk.usage.total_tokens
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield {
+                        "text": chunk.choices[0].delta.content,
+                        "tokens": None
+                    }
+
+            yield {"text": "", "tokens": tokens}
+
+        except Exception as e:
+            raise self._error(e)
+
+    async def summarize(self, summary: str, history: list) -> str:
+        try:
+            response = await self.client.chat.completions.create(  # noqa
+                model=self.model,
+                messages=self.build_summary_messages(summary, history),
+                stream=False
+            )
+
+            return response.choices[0].message.content
+
+        except Exception as e:
+            raise self._error(e)
@@ -0,0 +1,363 @@
+"""
+Resilience of the calls to an AI provider: a deadline per call, retries
+of transient errors with jittered backoff, hedged chat requests and a
+circuit breaker with an optional fallback provider.
+"""
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Optional
+
+from .base import AIProvider, APIError
+from .factory import create_provider
+from ..constants import (
+    AI_BREAKER_FAILURES,
+    AI_BREAKER_RESET,
+    AI_DEADLINE,
+    AI_FALLBACK_PROVIDER,
+    AI_HEDGE_PERCENTILE,
+    AI_PROVIDER,
+    AI_RETRIES,
+    AI_RETRY_DELAY,
+    AI_RETRY_MAX_DELAY,
+)
+from ..metrics import AI_BREAKER_OPEN, AI_CALL_ATTEMPTS
+
+__all__ = [
+    'CircuitBreaker',
+    'CircuitOpen',
+    'DeadlineExceeded',
+    'ResilientProvider',
+    'create_resilient_provider',
+]
+
+# Latencies of recent successful chat calls the hedging percentile is
+# taken from, and how many are needed before hedging starts
+_LATENCY_WINDOW = 200
+_LATENCY_MIN_SAMPLES = 20
+
+
+class CircuitOpen(APIError):
+    def __init__(self, provider: str, retry_after: float):
+        """The provider is considered down; ``retry_after`` is in seconds."""
+        super().__init__(
+            f"{provider} is unavailable, retry in {retry_after:.0f} s",
+            status_code=503
+        )
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(APIError):
+    def __init__(self, provider: str, deadline: float):
+        super().__init__(
+            f"{provider} did not answer in {deadline:g} s", status_code=504
+        )
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failures: int = AI_BREAKER_FAILURES,
+                 reset: float = AI_BREAKER_RESET):
+        """
+        Opens after ``failures`` failed requests in a row (0 never opens)
+        and rejects requests for ``reset`` seconds; then lets one trial
+        request through, which closes it again or reopens it.
+        """
+        self.name = name
+        self.failures = failures
+        self.reset = reset
+        self._failed = 0
+        self._opened_at: Optional[float] = None
+        self._trial = False
+
+    @property
+    def closed(self) -> bool:
+        return self._opened_at is None
+
+    @property
+    def retry_after(self) -> float:
+        if self._opened_at is None:
+            return 0
+        return max(0.0, self._opened_at + self.reset - time.monotonic())
+
+    def allow(self) -> bool:
+        """Whether a request may be sent now."""
+        if self._opened_at is None:
+            return True
+        if self._trial or self.retry_after > 0:
+            return False
+        self._trial = True
+        return True
+
+    def success(self):
+        self._failed = 0
+        self._trial = False
+        if self._opened_at is not None:
+            self._opened_at = None
+            AI_BREAKER_OPEN.labels(self.name).set(0)
+
+    def failure(self):
+        self._failed += 1
+        if self._trial or (self.failures and self._failed >= self.failures):
+            self._trial = False
+            self._opened_at = time.monotonic()
+            AI_BREAKER_OPEN.labels(self.name).set(1)
+
+    def abandon(self):
+        """The request was cancelled before it ended either way."""
+        self._trial = False
+
+
+class ResilientProvider(AIProvider):
+    def __init__(
+            self,
+            provider: AIProvider,
+            fallback: AIProvider = None,
+            deadline: float = AI_DEADLINE,
+            retries: int = AI_RETRIES,
+            retry_delay: float = AI_RETRY_DELAY,
+            retry_max_delay: float = AI_RETRY_MAX_DELAY,
+            hedge_percentile: float = AI_HEDGE_PERCENTILE,
+            breaker_failures: int = AI_BREAKER_FAILURES,
+            breaker_reset: float = AI_BREAKER_RESET
+    ):
+        """
+        Wraps ``provider`` so that a call takes at most ``deadline`` seconds
+        (0 means no deadline) and fails with ``DeadlineExceeded`` after
+        that. Transient errors are retried up to ``retries`` times with
+        full jitter backoff, from ``retry_delay`` up to ``retry_max_delay``
+        seconds. Streams are retried only until the first chunk arrives.
+
+        With ``hedge_percentile`` set, a chat call slower than that
+        percentile of recent ones sends a second request, and the first
+        answer wins.
+
+        While the circuit breaker is open calls go to ``fallback`` or,
+        without one, fail at once with ``CircuitOpen``.
+        """
+        super().__init__(provider.context_token_budget)
+        self.provider = provider
+        self.fallback = fallback
+        self.deadline = deadline
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.retry_max_delay = retry_max_delay
+        self.hedge_percentile = hedge_percentile
+        self.breaker = CircuitBreaker(
+            provider.name, breaker_failures, breaker_reset
+        )
+        self._latencies = deque(maxlen=_LATENCY_WINDOW)
+
+    def __repr__(self):
+        return (
+            f'ResilientProvider({self.provider!r}, '
+            f'fallback={self.fallback!r})'
+        )
+
+    @property
+    def name(self) -> str:
+        return self.provider.name
+
+    @property
+    def model(self) -> Optional[str]:
+        return getattr(self.provider, 'model', None)
+
+    def build_messages(self, *args, **kwargs) -> list:
+        return self.provider.build_messages(*args, **kwargs)
+
+    async def aclose(self):
+        await self.provider.aclose()
+        if self.fallback is not None:
+            await self.fallback.aclose()
+
+    def _backoff(self, attempt: int) -> float:
+        delay = self.retry_delay * 2 ** attempt
+        return random.uniform(0, min(self.retry_max_delay, delay))
+
+    def _hedge_delay(self) -> Optional[float]:
+        if not self.hedge_percentile or not self.breaker.closed:
+            return None
+        if len(self._latencies) < _LATENCY_MIN_SAMPLES:
+            return None
+        latencies = sorted(self._latencies)
+        index = min(
+            len(latencies) - 1,
+            int(len(latencies) * self.hedge_percentile / 100)
+        )
+        return latencies[index]
+
+    def _rejected(self) -> CircuitOpen:
+        return CircuitOpen(self.name, self.breaker.retry_after)
+
+    def _observe(self, e: BaseException):
+        """Reports the outcome of a failed request to the breaker."""
+        if isinstance(e, APIError) and e.transient:
+            self.breaker.failure()
+        elif isinstance(e, Exception):
+            # The provider answered, it is up
+            self.breaker.success()
+        else:
+            self.breaker.abandon()
+
+    async def _request(self, method: str, args: tuple):
+        try:
+            result = await getattr(self.provider, method)(*args)
+        except BaseException as e:
+            self._observe(e)
+            raise
+        self.breaker.success()
+        return result
+
+    async def _hedged(self, method: str, args: tuple):
+        delay = self._hedge_delay()
+        if delay is None:
+            return await self._request(method, args)
+
+        # The requests go to the provider directly: the breaker counts the
+        # call once, not each request of it
+        request = getattr(self.provider, method)
+        first = asyncio.ensure_future(request(*args))
+        pending = {first}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                AI_CALL_ATTEMPTS.labels(self.name, 'hedge').inc()
+                pending.add(asyncio.ensure_future(request(*args)))
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        self.breaker.success()
+                        return task.result()
+                    error = task.exception()
+            self._observe(error)
+            raise error
+        except asyncio.CancelledError:
+            self.breaker.abandon()
+            raise
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _retried(self, method: str, args: tuple):
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self._backoff(attempt - 1))
+                if not self.breaker.allow():
+                    raise self._rejected()
+                AI_CALL_ATTEMPTS.labels(self.name, 'retry').inc()
+            try:
+                if method == 'get_chat_response':
+                    started = time.perf_counter()
+                    result = await self._hedged(method, args)
+                    self._latencies.append(time.perf_counter() - started)
+                    return result
+                return await self._request(method, args)
+            except APIError as e:
+                if not e.transient or attempt == self.retries:
+                    raise
+
+    async def _within_deadline(self, awaitable, deadline: float):
+        try:
+            return await asyncio.wait_for(awaitable, deadline or None)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(self.name, self.deadline)
+
+    async def _call(self, method: str, *args):
+        if not self.breaker.allow():
+            if self.fallback is None:
+                raise self._rejected()
+            AI_CALL_ATTEMPTS.labels(self.name, 'fallback').inc()
+            return await self._within_deadline(
+                getattr(self.fallback, method)(*args), self.deadline
+            )
+        try:
+            return await self._within_deadline(
+                self._retried(method, args), self.deadline
+            )
+        except DeadlineExceeded:
+            # The request cut short was too slow, which counts as a failure
+            self.breaker.failure()
+            raise
+
+    async def get_chat_response(self, user_info: dict, history: list,
+                                user_message: str, summary: str = None,
+                                memories: list = None):
+        return await self._call(
+            'get_chat_response',
+            user_info, history, user_message, summary, memories
+        )
+
+    async def summarize(self, summary: str, history: list) -> str:
+        return await self._call('summarize', summary, history)
+
+    async def stream_chat_response(self, user_info: dict, history: list,
+                                   user_message: str, summary: str = None,
+                                   memories: list = None):
+        args = (user_info, history, user_message, summary, memories)
+        if not self.breaker.allow():
+            if self.fallback is None:
+                raise self._rejected()
+            AI_CALL_ATTEMPTS.labels(self.name, 'fallback').inc()
+            async for chunk in self.fallback.stream_chat_response(*args):
+                yield chunk
+            return
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        attempt = 0
+        while True:
+            stream = self.provider.stream_chat_response(*args)
+            try:
+                # The deadline bounds the wait for the first chunk only
+                remaining = deadline - loop.time() if self.deadline else 0
+                chunk = await self._within_deadline(anext(stream), remaining)
+                break
+            except StopAsyncIteration:
+                self.breaker.success()
+                return
+            except BaseException as e:
+                await stream.aclose()
+                if isinstance(e, DeadlineExceeded):
+                    self.breaker.abandon()
+                    self.breaker.failure()
+                    raise
+                self._observe(e)
+                transient = isinstance(e, APIError) and e.transient
+                if not transient or attempt == self.retries:
+                    raise
+            delay = self._backoff(attempt)
+            if self.deadline and loop.time() + delay >= deadline:
+                raise DeadlineExceeded(self.name, self.deadline)
+            await asyncio.sleep(delay)
+            if not self.breaker.allow():
+                raise self._rejected()
+            attempt += 1
+            AI_CALL_ATTEMPTS.labels(self.name, 'retry').inc()
+
+        self.breaker.success()
+        try:
+            yield chunk
+            async for chunk in stream:
+                yield chunk
+        except Exception as e:
+            self._observe(e)
+            raise
+        finally:
+            await stream.aclose()
+
+
+def create_resilient_provider(
+        name: str = AI_PROVIDER, fallback: str = AI_FALLBACK_PROVIDER
+) -> ResilientProvider:
+    """
+    Creates the ``name`` provider wrapped into ``ResilientProvider``, with
+    the ``fallback`` provider, if any, used while it is down.
+    """
+    return ResilientProvider(
+        create_provider(name),
+        fallback=create_provider(fallback) if fallback else None
+    )
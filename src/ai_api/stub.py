@@ -0,0 +1,103 @@
+import asyncio
+import random
+import zlib
+
+from .base import AIProvider, APIError
+from .context import estimate_tokens
+from ..constants import (
+    AI_CONTEXT_TOKEN_BUDGET,
+    AI_STUB_ERROR_RATE,
+    AI_STUB_LATENCY,
+    AI_STUB_SEED,
+    AI_STUB_TOKEN_DELAY,
+    AI_STUB_TOKENS,
+)
+
+__all__ = ['StubAPI']
+
+_WORDS = (
+    'понимаю', 'это', 'важно', 'давай', 'попробуем', 'вместе', 'разобраться',
+    'что', 'ты', 'чувствуешь', 'сейчас', 'и', 'почему', 'спокойно', 'шаг',
+    'за', 'шагом', 'сон', 'отдых', 'дыхание', 'мысли', 'время', 'себя',
+)
+
+
+class StubAPI(AIProvider):
+    name = 'stub'
+
+    def __init__(
+            self,
+            latency: float = AI_STUB_LATENCY,
+            token_delay: float = AI_STUB_TOKEN_DELAY,
+            tokens: int = AI_STUB_TOKENS,
+            error_rate: float = AI_STUB_ERROR_RATE,
+            seed: int = AI_STUB_SEED,
+            context_token_budget: int = AI_CONTEXT_TOKEN_BUDGET
+    ):
+        """
+        Local provider for load tests and CI, no network involved. Answers
+        are deterministic for a given user message: ``tokens`` words after
+        ``latency`` seconds, streamed ``token_delay`` seconds apart. A
+        ``error_rate`` share of calls fails with ``APIError``; which ones is
+        decided by a generator seeded with ``seed``.
+        """
+        super().__init__(context_token_budget)
+        self.latency = latency
+        self.token_delay = token_delay
+        self.tokens = tokens
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+
+    def __repr__(self):
+        return (f'StubAPI(latency={self.latency}, '
+                f'token_delay={self.token_delay}, tokens={self.tokens}, '
+                f'error_rate={self.error_rate})')
+
+    def _answer(self, user_message: str) -> list:
+        words = random.Random(zlib.crc32(user_message.encode('utf-8')))
+        return [
+            words.choice(_WORDS) + ('' if i == self.tokens - 1 else ' ')
+            for i in range(self.tokens)
+        ]
+
+    def _maybe_fail(self):
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise APIError("StubAPI Error: simulated failure", status_code=503)
+
+    def _usage(self, messages: list, answer: str) -> int:
+        return sum(estimate_tokens(msg["content"]) for msg in messages) \
+            + estimate_tokens(answer)
+
+    async def get_chat_response(self, user_info: dict, history: list,
+                                user_message: str, summary: str = None,
+                                memories: list = None):
+        messages = self.build_messages(
+            user_info, history, user_message, summary, memories
+        )
+        await asyncio.sleep(self.latency + self.token_delay * self.tokens)
+        self._maybe_fail()
+        answer = ''.join(self._answer(user_message))
+        return {"text": answer, "tokens": self._usage(messages, answer)}
+
+    async def stream_chat_response(self, user_info: dict, history: list,
+                                   user_message: str, summary: str = None,
+                                   memories: list = None):
+        messages = self.build_messages(
+            user_info, history, user_message, summary, memories
+        )
+        await asyncio.sleep(self.latency)
+        self._maybe_fail()
+        parts = self._answer(user_message)
+        for part in parts:
+            yield {"text": part, "tokens": None}
+            await asyncio.sleep(self.token_delay)
+        yield {"text": "", "tokens": self._usage(messages, ''.join(parts))}
+
+    async def summarize(self, summary: str, history: list) -> str:
+        await asyncio.sleep(self.latency)
+        self._maybe_fail()
+        lines = [summary] if summary else []
+        lines.extend(
+            msg["content"][:80] for msg in history if msg["role"] == "user"
+        )
+        return "\n".join(lines)[-2000:]
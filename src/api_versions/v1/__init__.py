@@ -1,4 +1,4 @@
-from .routes import main_router
+from .routes import main_router, shutdown, startup
 from .version_constants import API_VERSION
 
-__all__ = ['API_VERSION', 'main_router']
+__all__ = ['API_VERSION', 'main_router', 'shutdown', 'startup']
@@ -1,20 +1,51 @@
+import asyncio
 import logging
-from typing import Union, Optional
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Optional, Tuple, Union
+from sqlalchemy import (
+    bindparam,
+    delete,
+    exists,
+    func,
+    insert,
+    literal,
+    or_,
+    select,
+    true,
+    tuple_,
+    create_engine,
+    union_all,
+    update,
+)
+from sqlalchemy.dialects.postgresql import JSON, aggregate_order_by
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine, AsyncSession, async_sessionmaker
+)
 from sqlalchemy.orm import Session, sessionmaker
 
-from . import schemas, version_constants
+from . import partitions, schemas, version_constants
+from ...ai_api.context import estimate_tokens
+from ...cache import TTLCache
+from ...metrics import instrument_db, observe_pool
 
-__all__ = ['DatabaseManager']
+__all__ = ['AsyncDatabaseManager', 'DatabaseManager']
 
 from .schemas import User
 
 logger = logging.getLogger(version_constants.API_NAME)
 
+# Lower bound of the created_at of messages when nothing better is known
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
 
 class DatabaseManager:
     def __init__(self):
         self._engine = schemas.get_engine()
+        self._session_factory = sessionmaker(
+            bind=self._engine, autoflush=False
+        )
 
     @property
     def engine(self) -> Engine:
@@ -25,9 +56,9 @@ class DatabaseManager:
             return db.query(schemas.User).filter_by(id=user_id).first()
 
     def create_session(self, engine: Engine = None) -> Session:
-        return sessionmaker(
-            bind=engine if engine else self.engine, autoflush=False
-        )()
+        if engine:
+            return sessionmaker(bind=engine, autoflush=False)()
+        return self._session_factory()
 
     def create_user_from_front(self, name, gender, age):
         with self.create_session() as db_session:
@@ -53,7 +84,8 @@ class DatabaseManager:
                     session_id=session_id,
                     sender=sender,  # 'user' или 'ai'
                     message_text=text,
-                    token_usage=tokens
+                    token_usage=tokens,
+                    token_count=estimate_tokens(text)
                 )
                 db.add(new_msg)
                 db.commit()
@@ -63,17 +95,25 @@ class DatabaseManager:
                 raise e
 
     def get_session_history(self, session_id: int, limit: int = 10):
+        """Last ``limit`` messages of the session, oldest first."""
         with self.create_session() as db:
             messages = db.query(schemas.Message) \
                 .filter_by(session_id=session_id) \
-                .order_by(schemas.Message.created_at.asc()) \
+                .order_by(
+                    schemas.Message.created_at.desc(),
+                    schemas.Message.id.desc()
+                ) \
                 .limit(limit) \
                 .all()
 
             history = []
-            for msg in messages:
+            for msg in reversed(messages):
                 role = "user" if msg.sender == "user" else "assistant"
-                history.append({"role": role, "content": msg.message_text})
+                history.append({
+                    "role": role,
+                    "content": msg.message_text,
+                    "tokens": msg.token_count
+                })
             return history
 
     def get_user_by_id(self, user_id: int, session: Session = None) -> Union[schemas.User, None]:
@@ -117,4 +157,982 @@ class DatabaseManager:
                 .filter_by(session_id=session_id) \
                 .order_by(schemas.Message.created_at.asc()) \
                 .limit(limit) \
-                .all()
\ No newline at end of file
+                .all()
+
+
+@instrument_db
+class AsyncDatabaseManager:
+    """
+    Awaitable equivalent of ``DatabaseManager`` on top of one async engine
+    and one session factory, so queries never block the event loop.
+    """
+
+    def __init__(self):
+        self._engine = schemas.get_async_engine()
+        self._session_factory = async_sessionmaker(
+            bind=self._engine, autoflush=False, expire_on_commit=False
+        )
+        # Single-statement operations run outside of an explicit
+        # transaction, so they cost exactly one round trip
+        self._autocommit_engine = self._engine.execution_options(
+            isolation_level='AUTOCOMMIT'
+        )
+        # user_id -> user_info dict, user_id -> latest session id and
+        # (user_id, session_id) -> True for sessions of the user
+        self._users = TTLCache(
+            version_constants.CACHE_MAX_SIZE, version_constants.CACHE_TTL
+        )
+        self._active_sessions = TTLCache(
+            version_constants.CACHE_MAX_SIZE, version_constants.CACHE_TTL
+        )
+        self._sessions = TTLCache(
+            version_constants.CACHE_MAX_SIZE, version_constants.CACHE_TTL
+        )
+
+    @property
+    def engine(self) -> AsyncEngine:
+        return self._engine
+
+    async def init(self):
+        """Creates the database schema. Called once on application start."""
+        await schemas.init_models(self.engine)
+        await self.ensure_partitions()
+        observe_pool(
+            self.engine.sync_engine.pool,
+            version_constants.DB_POOL_SIZE + version_constants.DB_MAX_OVERFLOW
+        )
+
+    async def ensure_partitions(self) -> list:
+        """Creates the missing partitions ahead, returns their names."""
+        async with self.engine.begin() as conn:
+            return await conn.run_sync(partitions.ensure_partitions)
+
+    async def archive_partitions(self, retention_months: int) -> list:
+        """
+        Archives and drops the partitions older than ``retention_months``
+        months, returns their names. Runs in a thread on a psycopg2 engine,
+        so writing the files does not block the event loop.
+        """
+        url = self.engine.url.set(drivername='postgresql+psycopg2')
+
+        def archive() -> list:
+            engine = create_engine(url)
+            try:
+                with engine.connect() as conn:
+                    return partitions.archive_expired(conn, retention_months)
+            finally:
+                engine.dispose()
+
+        return await asyncio.to_thread(archive)
+
+    async def dispose(self):
+        """Closes every pooled connection."""
+        await self.engine.dispose()
+
+    def cache_stats(self) -> dict:
+        return {
+            "users": self._users.stats(),
+            "active_sessions": self._active_sessions.stats(),
+            "sessions": self._sessions.stats(),
+        }
+
+    async def get_user_info(self, user_id: int) -> Optional[dict]:
+        """Cached ``user_info`` dict (name, age, gender) of the user."""
+        user_info = self._users.get(user_id)
+        if user_info is None:
+            user = await self.get_user(user_id)
+            if user is None:
+                return None
+            user_info = {
+                "name": user.first_name,
+                "age": user.age,
+                "gender": user.gender
+            }
+            self._users.set(user_id, user_info)
+        return dict(user_info)
+
+    def create_session(self) -> AsyncSession:
+        return self._session_factory()
+
+    async def get_user(self, user_id: int) -> Optional[schemas.User]:
+        async with self.create_session() as db:
+            return await db.get(schemas.User, user_id)
+
+    async def create_user_from_front(self, name, gender, age,
+                                     external_id: str = None,
+                                     telegram_id: int = None):
+        return (await self.upsert_users([{
+            "first_name": name,
+            "gender": gender,
+            "age": age,
+            "external_id": external_id,
+            "telegram_id": telegram_id,
+        }]))[0]
+
+    async def upsert_users(self, rows: list) -> list:
+        """
+        Registers users with ``INSERT ... ON CONFLICT ... RETURNING``: one
+        statement per key (``external_id``, else ``telegram_id``), plus one
+        plain insert for rows without a key. Registering the same key again
+        updates the given fields and returns the same user. Rows of one
+        person in a batch (sharing an ``external_id``, or a
+        ``telegram_id`` given with it) get one user with the fields of all
+        of them, the later rows winning. A ``telegram_id`` that belongs to
+        a user with another ``external_id`` stays with that user. Returns
+        users in the order of ``rows``.
+        """
+        users = schemas.User.__table__
+        rows = [dict(row) for row in rows]
+        async with self.create_session() as db:
+            await self._drop_taken_telegram_ids(db, rows)
+            by_key, keyless = self._merge_user_rows(rows)
+
+            result = [None] * len(rows)
+            for key, keyed in by_key.items():
+                if not keyed:
+                    continue
+                stmt = pg_insert(schemas.User).values(
+                    [row for _, row in keyed.values()]
+                )
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[key],
+                    set_={
+                        column: func.coalesce(
+                            stmt.excluded[column], users.c[column]
+                        )
+                        for column in (
+                            "first_name", "gender", "age", "telegram_id"
+                        )
+                    }
+                ).returning(schemas.User)
+                created = await db.scalars(
+                    stmt, execution_options={"populate_existing": True}
+                )
+                for user in created:
+                    for position in keyed[getattr(user, key)][0]:
+                        result[position] = user
+            if keyless:
+                created = await db.scalars(
+                    insert(schemas.User).returning(
+                        schemas.User, sort_by_parameter_order=True
+                    ),
+                    [row for _, row in keyless]
+                )
+                for (position, _), user in zip(keyless, created):
+                    result[position] = user
+            await db.commit()
+
+        for user in result:
+            self._users.pop(user.id)
+        return result
+
+    @staticmethod
+    def _merge_user_rows(rows: list) -> tuple:
+        """
+        Groups the rows of one person: by ``external_id``, and rows with
+        just a ``telegram_id`` with the ``external_id`` row that has it.
+        Returns key -> value -> (positions, merged row) for the upserts by
+        each key, and the ``(position, row)`` pairs without a key.
+        """
+        by_key = {"external_id": {}, "telegram_id": {}}
+        keyless = []
+        owners = {
+            row["telegram_id"]: row["external_id"] for row in rows
+            if row.get("external_id") is not None
+            and row.get("telegram_id") is not None
+        }
+        for position, row in enumerate(rows):
+            if row.get("external_id") is not None:
+                key, value = "external_id", row["external_id"]
+            elif row.get("telegram_id") in owners:
+                key, value = "external_id", owners[row["telegram_id"]]
+            elif row.get("telegram_id") is not None:
+                key, value = "telegram_id", row["telegram_id"]
+            else:
+                keyless.append((position, row))
+                continue
+            positions, merged = by_key[key].setdefault(value, ([], {}))
+            positions.append(position)
+            for column, column_value in row.items():
+                if column_value is not None or column not in merged:
+                    merged[column] = column_value
+            merged[key] = value
+        return by_key, keyless
+
+    @staticmethod
+    async def _drop_taken_telegram_ids(db: AsyncSession, rows: list):
+        """
+        Clears the ``telegram_id`` of rows registered by ``external_id``
+        when it belongs to a user with another ``external_id`` already, in
+        the database or earlier in the batch, so the insert does not break
+        its uniqueness.
+        """
+        both = [
+            row for row in rows
+            if row.get("external_id") is not None
+            and row.get("telegram_id") is not None
+        ]
+        if not both:
+            return
+        owners = dict((await db.execute(
+            select(schemas.User.telegram_id, schemas.User.external_id).where(
+                schemas.User.telegram_id.in_(
+                    {row["telegram_id"] for row in both}
+                )
+            )
+        )).all())
+        for row in both:
+            owner = owners.setdefault(row["telegram_id"], row["external_id"])
+            if owner != row["external_id"]:
+                row["telegram_id"] = None
+
+    async def save_message(self, session_id: int, sender: str, text: str,
+                           tokens: int = 0):
+        async with self.create_session() as db:
+            try:
+                new_msg = schemas.Message(
+                    session_id=session_id,
+                    sender=sender,  # 'user' или 'ai'
+                    message_text=text,
+                    token_usage=tokens,
+                    token_count=estimate_tokens(text)
+                )
+                db.add(new_msg)
+                await db.commit()
+                return new_msg
+            except Exception as e:
+                await db.rollback()
+                raise e
+
+    async def get_session_history(self, session_id: int, limit: int = 10):
+        """Last ``limit`` messages of the session, oldest first."""
+        async with self.create_session() as db:
+            messages = await db.execute(
+                select(
+                    schemas.Message.sender,
+                    schemas.Message.message_text,
+                    schemas.Message.token_count
+                )
+                .filter_by(session_id=session_id)
+                .order_by(
+                    schemas.Message.created_at.desc(),
+                    schemas.Message.id.desc()
+                )
+                .limit(limit)
+            )
+
+            history = []
+            for msg in reversed(messages.all()):
+                role = "user" if msg.sender == "user" else "assistant"
+                history.append({
+                    "role": role,
+                    "content": msg.message_text,
+                    "tokens": msg.token_count
+                })
+            return history
+
+    async def get_user_by_id(
+            self, user_id: int, session: AsyncSession = None
+    ) -> Union[schemas.User, None]:
+        sess = session if session else self.create_session()
+        async with sess as db:
+            return await db.get(schemas.User, user_id)
+
+    async def get_or_create_session(self, session_id: int,
+                                    user_id: int) -> int:
+        async with self.create_session() as db:
+            session = await db.get(schemas.ChatSession, session_id)
+            if not session:
+                new_session = schemas.ChatSession(
+                    id=session_id,
+                    user_id=user_id,
+                    is_active=True
+                )
+                db.add(new_session)
+                await db.commit()
+                self._active_sessions.pop(user_id)
+                return new_session.id
+            return session.id
+
+    async def get_user_last_session(self, user_id: int) -> Optional[int]:
+        session_id = self._active_sessions.get(user_id)
+        if session_id is not None:
+            return session_id
+        async with self.create_session() as db:
+            session_id = await db.scalar(
+                select(schemas.ChatSession.id)
+                .filter_by(user_id=user_id)
+                .order_by(schemas.ChatSession.id.desc())
+                .limit(1)
+            )
+        if session_id is not None:
+            self._active_sessions.set(user_id, session_id)
+        return session_id
+
+    async def create_new_session(self, user_id: int) -> int:
+        async with self.create_session() as db:
+            new_session = schemas.ChatSession(user_id=user_id, is_active=True)
+            db.add(new_session)
+            await db.commit()
+            self._active_sessions.pop(user_id)
+            return new_session.id
+
+    async def get_messages_by_session(self, session_id: int, limit: int = 50):
+        async with self.create_session() as db:
+            messages = await db.scalars(
+                select(schemas.Message)
+                .filter_by(session_id=session_id)
+                .order_by(schemas.Message.created_at.asc())
+                .limit(limit)
+            )
+            return messages.all()
+
+    @staticmethod
+    def _history_statement(user_id: int, session_id: Optional[int],
+                           after: Optional[Tuple[datetime, int]] = None,
+                           before: Optional[Tuple[datetime, int]] = None):
+        """
+        Messages of the session (or of every session of the user if
+        ``session_id`` is ``None``) after or before the ``(created_at, id)``
+        keyset position, in chronological order (reversed with ``before``).
+        Only the columns of the history are read.
+        """
+        messages = schemas.Message.__table__
+        sessions = schemas.ChatSession.__table__
+        position = tuple_(messages.c.created_at, messages.c.id)
+        stmt = select(
+            messages.c.id, messages.c.session_id, messages.c.sender,
+            messages.c.message_text, messages.c.created_at
+        ).join(
+            sessions, sessions.c.id == messages.c.session_id
+        ).where(sessions.c.user_id == user_id)
+        if session_id is not None:
+            stmt = stmt.where(messages.c.session_id == session_id)
+        # The created_at bounds alone prune the partitions of messages
+        if after is not None:
+            stmt = stmt.where(
+                messages.c.created_at >= after[0], position > tuple_(*after)
+            )
+        if before is not None:
+            return stmt.where(
+                messages.c.created_at <= before[0], position < tuple_(*before)
+            ).order_by(messages.c.created_at.desc(), messages.c.id.desc())
+        return stmt.order_by(messages.c.created_at.asc(), messages.c.id.asc())
+
+    async def get_history_page(
+            self,
+            user_id: int,
+            session_id: Optional[int],
+            limit: int,
+            after: Optional[Tuple[datetime, int]] = None,
+            before: Optional[Tuple[datetime, int]] = None
+    ) -> Tuple[list, bool]:
+        """
+        Up to ``limit`` messages of the history after (or before) a keyset
+        position as dicts, oldest first, and whether there are more in that
+        direction.
+        """
+        stmt = self._history_statement(
+            user_id, session_id, after, before
+        ).limit(limit + 1)
+        async with self._autocommit_engine.connect() as conn:
+            rows = [row._asdict() for row in await conn.execute(stmt)]
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if before is not None:
+            rows.reverse()
+        return rows, has_more
+
+    async def stream_history(self, user_id: int, session_id: Optional[int],
+                             after: Optional[Tuple[datetime, int]] = None,
+                             batch_size: int = 500) -> AsyncIterator[dict]:
+        """
+        Yields every message of the history after a keyset position, oldest
+        first, read through a server-side cursor ``batch_size`` rows at a
+        time, so memory does not grow with the history.
+        """
+        stmt = self._history_statement(user_id, session_id, after) \
+            .execution_options(yield_per=batch_size)
+        # Server-side cursors need a transaction
+        async with self._engine.connect() as conn:
+            result = await conn.stream(stmt)
+            async for row in result:
+                yield row._asdict()
+
+    async def search_messages(
+            self, user_id: int, query: str, limit: int,
+            session_id: Optional[int] = None,
+            after: Optional[Tuple[float, datetime, int]] = None
+    ) -> Tuple[list, bool]:
+        """
+        Up to ``limit`` messages of the user (or of one session) matching
+        the web search style ``query``, most relevant first, after the
+        ``(rank, created_at, id)`` keyset position, and whether there are
+        more. Each row has its ``rank`` and a ``snippet`` with the matched
+        words in ``<b>`` tags.
+        """
+        messages = schemas.Message.__table__
+        sessions = schemas.ChatSession.__table__
+        tsquery = schemas.search_query(query)
+        vector = messages.c.search_vector
+        rank = func.ts_rank(vector, tsquery)
+        matches = select(
+            messages.c.id, messages.c.session_id, messages.c.sender,
+            messages.c.message_text, messages.c.created_at, rank.label('rank')
+        ).join(
+            sessions, sessions.c.id == messages.c.session_id
+        ).where(sessions.c.user_id == user_id, vector.op('@@')(tsquery))
+        if session_id is not None:
+            matches = matches.where(messages.c.session_id == session_id)
+        matches = matches.subquery()
+
+        position = tuple_(matches.c.rank, matches.c.created_at, matches.c.id)
+        page = select(matches)
+        if after is not None:
+            page = page.where(position < tuple_(*after))
+        page = page.order_by(
+            matches.c.rank.desc(), matches.c.created_at.desc(),
+            matches.c.id.desc()
+        ).limit(limit + 1).subquery()
+        # Headlines are slow to build, so only the rows of the page get one
+        snippet = schemas.search_headline(page.c.message_text, tsquery)
+        stmt = select(
+            page.c.id, page.c.session_id, page.c.sender, page.c.created_at,
+            page.c.rank, snippet.label('snippet')
+        ).order_by(
+            page.c.rank.desc(), page.c.created_at.desc(), page.c.id.desc()
+        )
+        async with self._autocommit_engine.connect() as conn:
+            rows = [row._asdict() for row in await conn.execute(stmt)]
+        return rows[:limit], len(rows) > limit
+
+    async def get_memory_items(self, user_id: int, limit: int) -> list:
+        """
+        The summaries of the sessions of the user and their latest ``limit``
+        messages, as ``{"session_id", "text", "summary"}`` dicts, oldest
+        first.
+        """
+        messages = schemas.Message.__table__
+        sessions = schemas.ChatSession.__table__
+        summaries_stmt = select(sessions.c.id, sessions.c.summary).where(
+            sessions.c.user_id == user_id, sessions.c.summary.is_not(None)
+        ).order_by(sessions.c.id.desc()).limit(limit)
+        messages_stmt = select(
+            messages.c.session_id, messages.c.message_text
+        ).join(
+            sessions, sessions.c.id == messages.c.session_id
+        ).where(
+            sessions.c.user_id == user_id, messages.c.sender == "user"
+        ).order_by(
+            messages.c.created_at.desc(), messages.c.id.desc()
+        ).limit(limit)
+        async with self._autocommit_engine.connect() as conn:
+            summaries = (await conn.execute(summaries_stmt)).all()
+            rows = (await conn.execute(messages_stmt)).all()
+        items = [
+            {"session_id": row.id, "text": row.summary, "summary": True}
+            for row in reversed(summaries)
+        ]
+        items.extend(
+            {"session_id": row.session_id, "text": row.message_text,
+             "summary": False}
+            for row in reversed(rows)
+        )
+        return items[-limit:]
+
+    @staticmethod
+    def _prepare_turn_statement(user_id: int, session_id: int, text: str,
+                                history_limit: int,
+                                known_session: bool = False,
+                                count_limit: Optional[int] = None):
+        """
+        Builds one statement that checks the user, resolves (or creates) the
+        chat session, inserts the user message and collects the session
+        summary with the last ``history_limit`` messages of the session
+        before that one that are not in the summary yet, and their number
+        counted up to ``count_limit`` (``history_limit`` by default). With
+        ``known_session`` the user and the session are known to exist, so
+        those checks are left out.
+        """
+        users = schemas.User.__table__
+        sessions = schemas.ChatSession.__table__
+        messages = schemas.Message.__table__
+
+        if known_session:
+            user_columns = ()
+            turn_session = select(literal(session_id).label('id')) \
+                .cte('turn_session')
+        else:
+            user = select(
+                users.c.id, users.c.first_name, users.c.age, users.c.gender
+            ).where(users.c.id == user_id).cte('turn_user')
+            user_columns = (
+                user.c.id, user.c.first_name, user.c.age, user.c.gender
+            )
+
+            existing = select(sessions.c.id, sessions.c.user_id) \
+                .where(exists(select(user.c.id)))
+            if session_id:
+                existing = existing.where(sessions.c.id == session_id) \
+                    .cte('turn_existing_session')
+                new_session = pg_insert(sessions).from_select(
+                    ['id', 'user_id', 'is_active'],
+                    select(literal(session_id), user.c.id, true())
+                    .where(~exists(select(existing.c.id)))
+                ).on_conflict_do_nothing()
+            else:
+                existing = existing.where(sessions.c.user_id == user_id) \
+                    .order_by(sessions.c.id.desc()) \
+                    .limit(1) \
+                    .cte('turn_existing_session')
+                new_session = insert(sessions).from_select(
+                    ['user_id', 'is_active'],
+                    select(user.c.id, true())
+                    .where(~exists(select(existing.c.id)))
+                )
+            new_session = new_session.returning(
+                sessions.c.id, sessions.c.user_id
+            ).cte('turn_new_session')
+            owned_session = union_all(
+                select(existing.c.id, existing.c.user_id),
+                select(new_session.c.id, new_session.c.user_id)
+            ).cte('turn_owned_session')
+            # A session of another user gets no message and shows no history
+            turn_session = select(owned_session.c.id) \
+                .where(owned_session.c.user_id == user_id) \
+                .cte('turn_session')
+            # Owner of the session, which is cached for that user only
+            user_columns += (
+                select(owned_session.c.user_id).limit(1).scalar_subquery()
+                .label('session_user_id'),
+            )
+        turn_session_id = select(turn_session.c.id).limit(1).scalar_subquery()
+        session_state = select(
+            sessions.c.summary, sessions.c.summary_message_id,
+            sessions.c.started_at
+        ).where(sessions.c.id == turn_session_id).cte('turn_session_state')
+        summary_message_id = func.coalesce(
+            select(session_state.c.summary_message_id).scalar_subquery(), 0
+        )
+
+        user_message = insert(messages).from_select(
+            ['session_id', 'sender', 'message_text', 'token_usage',
+             'token_count'],
+            select(
+                turn_session.c.id, literal('user'), literal(text), literal(0),
+                literal(estimate_tokens(text))
+            )
+        ).returning(messages.c.id).cte('turn_message')
+
+        after_summary = (
+            messages.c.session_id == turn_session_id,
+            messages.c.id > summary_message_id,
+            # Skips the partitions from before the session at execution time
+            messages.c.created_at >= func.coalesce(
+                select(session_state.c.started_at).scalar_subquery(), _EPOCH
+            )
+        )
+        history = select(
+            messages.c.id, messages.c.sender, messages.c.message_text,
+            messages.c.token_count, messages.c.created_at
+        ).where(*after_summary) \
+            .order_by(messages.c.created_at.desc(), messages.c.id.desc()) \
+            .limit(history_limit) \
+            .cte('turn_history')
+        unsummarized = select(messages.c.id).where(*after_summary) \
+            .limit(history_limit if count_limit is None else count_limit) \
+            .cte('turn_unsummarized')
+        history_json = select(func.json_agg(aggregate_order_by(
+            func.json_build_object(
+                'id', history.c.id,
+                'sender', history.c.sender,
+                'text', history.c.message_text,
+                'tokens', history.c.token_count
+            ),
+            history.c.created_at.asc(),
+            history.c.id.asc()
+        ), type_=JSON)).scalar_subquery()
+
+        return select(
+            *user_columns,
+            turn_session_id.label('session_id'),
+            select(session_state.c.summary).scalar_subquery().label('summary'),
+            select(user_message.c.id).scalar_subquery().label('message_id'),
+            history_json.label('history'),
+            select(func.count()).select_from(unsummarized)
+            .scalar_subquery().label('unsummarized'),
+        )
+
+    async def _save_token_counts(self, session_id: int, counts: dict):
+        """Stores the ``{message_id: tokens}`` estimates of the session."""
+        messages = schemas.Message.__table__
+        stmt = update(messages).where(
+            messages.c.session_id == session_id,
+            messages.c.id == bindparam('message_id'),
+            messages.c.token_count.is_(None)
+        ).values(token_count=bindparam('tokens'))
+        try:
+            async with self._autocommit_engine.connect() as conn:
+                await conn.execute(stmt, [
+                    {"message_id": message_id, "tokens": tokens}
+                    for message_id, tokens in counts.items()
+                ])
+        except Exception as e:
+            # Only an optimization, estimated again the next time
+            logger.warning(f"Failed to save token counts: {e}")
+
+    async def prepare_turn(
+            self,
+            user_id: int,
+            session_id: int,
+            text: str,
+            history_limit: int = 10,
+            count_limit: Optional[int] = None
+    ) -> Optional[dict]:
+        """
+        Everything ``/chat`` needs before the model call, in one statement:
+        validates the user, resolves or creates the session, loads the
+        history and saves the user message. Returns ``None`` if there is no
+        such user and raises ``PermissionError`` if the session belongs to
+        another user; otherwise returns a dict with ``user_info``,
+        ``session_id``, ``message_id``, ``summary``, ``history`` and
+        ``unsummarized`` keys, the last being the number of messages before
+        the new one that are not in the summary, counted up to
+        ``count_limit``.
+
+        When the user profile and the session are cached (the latest
+        session of the user for ``session_id`` 0), the user and session
+        lookups are skipped altogether.
+        """
+        user_info = self._users.get(user_id)
+        if session_id:
+            known_session = (
+                user_info is not None
+                and self._sessions.get((user_id, session_id)) is not None
+            )
+        else:
+            active_session_id = self._active_sessions.get(user_id)
+            known_session = (
+                user_info is not None and active_session_id is not None
+            )
+            if known_session:
+                session_id = active_session_id
+
+        stmt = self._prepare_turn_statement(
+            user_id, session_id, text, history_limit, known_session,
+            count_limit
+        )
+        async with self._autocommit_engine.connect() as conn:
+            row = (await conn.execute(stmt)).first()
+            if row is not None and row.session_id is None \
+                    and row.session_user_id is None:
+                # The requested session was created concurrently by another
+                # request, so it is visible now
+                row = (await conn.execute(stmt)).first()
+
+        if row is None:
+            return None
+        if row.session_id is None:
+            raise PermissionError(
+                f"Session {session_id} belongs to another user"
+            )
+
+        if not known_session:
+            user_info = {
+                "name": row.first_name,
+                "age": row.age,
+                "gender": row.gender
+            }
+            self._users.set(user_id, user_info)
+            if row.session_user_id == user_id:
+                self._sessions.set((user_id, row.session_id), True)
+                active_session_id = self._active_sessions.get(
+                    user_id, count=False
+                )
+                if not session_id:
+                    self._active_sessions.set(user_id, row.session_id)
+                elif active_session_id is not None \
+                        and row.session_id > active_session_id:
+                    # A newer session was picked or created
+                    self._active_sessions.set(user_id, row.session_id)
+
+        history = []
+        # Messages saved before token_count was added get their estimate
+        # stored the first time they are loaded
+        estimated = {}
+        for msg in row.history or []:
+            role = "user" if msg["sender"] == "user" else "assistant"
+            tokens = msg["tokens"]
+            if tokens is None:
+                tokens = estimated[msg["id"]] = estimate_tokens(msg["text"])
+            history.append({
+                "role": role,
+                "content": msg["text"],
+                "tokens": tokens
+            })
+        if estimated:
+            await self._save_token_counts(row.session_id, estimated)
+
+        return {
+            "user_info": dict(user_info),
+            "session_id": row.session_id,
+            "message_id": row.message_id,
+            "summary": row.summary,
+            "history": history,
+            "unsummarized": row.unsummarized
+        }
+
+    async def save_messages(self, rows: list) -> list:
+        """
+        Saves many messages with multi-row inserts in one transaction.
+        ``rows`` are dicts of ``Message`` columns; returns their new ids in
+        the same order.
+        """
+        rows = [
+            {**row, "token_count": estimate_tokens(row["message_text"])}
+            for row in rows
+        ]
+        stmt = insert(schemas.Message).returning(
+            schemas.Message.id, sort_by_parameter_order=True
+        )
+        async with self.engine.begin() as conn:
+            return list((await conn.scalars(stmt, rows)).all())
+
+    async def save_ai_requests(self, rows: list):
+        """
+        Saves telemetry of many model calls with a multi-row insert.
+        ``rows`` are dicts of ``AIRequest`` columns.
+        """
+        async with self.engine.begin() as conn:
+            await conn.execute(insert(schemas.AIRequest), rows)
+
+    async def finish_turn(self, session_id: int, text: str,
+                          tokens: int = 0) -> int:
+        """Saves the AI message of a turn in one statement, returns its id."""
+        stmt = insert(schemas.Message).values(
+            session_id=session_id,
+            sender="ai",
+            message_text=text,
+            token_usage=tokens,
+            token_count=estimate_tokens(text)
+        ).returning(schemas.Message.id)
+        async with self._autocommit_engine.connect() as conn:
+            return await conn.scalar(stmt)
+
+    async def get_unsummarized_messages(self, session_id: int,
+                                        keep_recent: int, limit: int) -> dict:
+        """
+        Returns the ``user_id`` and ``summary`` of the session, the number
+        of messages after the summary (``pending``) and up to ``limit``
+        oldest of them (``messages``), leaving out the ``keep_recent``
+        latest ones.
+        """
+        async with self.create_session() as db:
+            session = (await db.execute(
+                select(
+                    schemas.ChatSession.user_id,
+                    schemas.ChatSession.summary,
+                    schemas.ChatSession.summary_message_id,
+                    schemas.ChatSession.started_at
+                ).filter_by(id=session_id)
+            )).first()
+            if session is None:
+                return {
+                    "user_id": None, "summary": None, "pending": 0,
+                    "messages": []
+                }
+
+            after_summary = (
+                schemas.Message.session_id == session_id,
+                schemas.Message.id > (session.summary_message_id or 0),
+                # Prunes the partitions from before the session
+                schemas.Message.created_at >= (session.started_at or _EPOCH)
+            )
+            pending = await db.scalar(
+                select(func.count()).select_from(schemas.Message)
+                .where(*after_summary)
+            )
+            rows = await db.execute(
+                select(
+                    schemas.Message.id,
+                    schemas.Message.sender,
+                    schemas.Message.message_text
+                )
+                .where(*after_summary)
+                .order_by(
+                    schemas.Message.created_at.asc(), schemas.Message.id.asc()
+                )
+                .limit(max(min(pending - keep_recent, limit), 0))
+            )
+
+            messages = []
+            for msg in rows:
+                role = "user" if msg.sender == "user" else "assistant"
+                messages.append({
+                    "id": msg.id, "role": role, "content": msg.message_text
+                })
+            return {
+                "user_id": session.user_id, "summary": session.summary,
+                "pending": pending, "messages": messages
+            }
+
+    async def save_summary(self, session_id: int, summary: str,
+                           message_id: int) -> bool:
+        """
+        Stores the new session summary covering messages up to
+        ``message_id``, unless a newer one has been stored meanwhile.
+        """
+        stmt = update(schemas.ChatSession).where(
+            schemas.ChatSession.id == session_id,
+            or_(
+                schemas.ChatSession.summary_message_id.is_(None),
+                schemas.ChatSession.summary_message_id < message_id
+            )
+        ).values(summary=summary, summary_message_id=message_id)
+        async with self._autocommit_engine.connect() as conn:
+            return (await conn.execute(stmt)).rowcount > 0
+
+    async def get_quota(self, user_id: int, day: datetime) -> dict:
+        """
+        Returns ``subscription_id``, ``plan_name``, ``usage_limit`` and
+        ``used_requests`` of the latest active, unexpired subscription of
+        the user (``None`` if there is none) and ``requests_today`` from the
+        ``day`` usage log.
+        """
+        subscription = select(
+            schemas.Subscription.id.label("subscription_id"),
+            schemas.Subscription.plan_name,
+            schemas.Subscription.usage_limit,
+            schemas.Subscription.used_requests,
+        ).where(
+            schemas.Subscription.user_id == user_id,
+            schemas.Subscription.is_active.is_(True),
+            or_(
+                schemas.Subscription.end_date.is_(None),
+                schemas.Subscription.end_date > func.now()
+            )
+        ).order_by(schemas.Subscription.id.desc()).limit(1).subquery()
+        requests_today = select(schemas.UsageLog.requests_count).where(
+            schemas.UsageLog.user_id == user_id,
+            schemas.UsageLog.date == day
+        ).scalar_subquery()
+        stmt = select(
+            subscription.c.subscription_id,
+            subscription.c.plan_name,
+            subscription.c.usage_limit,
+            func.coalesce(subscription.c.used_requests, 0)
+            .label("used_requests"),
+            func.coalesce(requests_today, 0).label("requests_today"),
+        ).select_from(
+            select(literal(1).label("one")).subquery()
+            .outerjoin(subscription, true())
+        )
+        async with self._autocommit_engine.connect() as conn:
+            return (await conn.execute(stmt)).one()._asdict()
+
+    async def add_usage(self, subscriptions: dict, usage: list):
+        """
+        Adds aggregated usage in one transaction: ``subscriptions`` maps
+        subscription ids to requests to add to ``used_requests``; ``usage``
+        rows (``user_id``, ``date``, ``requests_count``, ``tokens_used``,
+        ``session_count``) are added to the daily ``usage_logs`` rows.
+        """
+        async with self.engine.begin() as conn:
+            if subscriptions:
+                await conn.execute(
+                    update(schemas.Subscription)
+                    .where(
+                        schemas.Subscription.id == bindparam('subscription_id')
+                    )
+                    .values(used_requests=func.coalesce(
+                        schemas.Subscription.used_requests, 0
+                    ) + bindparam('requests')),
+                    [
+                        {"subscription_id": subscription_id,
+                         "requests": requests}
+                        for subscription_id, requests in subscriptions.items()
+                    ]
+                )
+            if usage:
+                stmt = pg_insert(schemas.UsageLog).values(usage)
+                log = schemas.UsageLog.__table__.c
+                await conn.execute(stmt.on_conflict_do_update(
+                    index_elements=[log.user_id, log.date],
+                    set_={
+                        column: func.coalesce(log[column], 0)
+                        + stmt.excluded[column]
+                        for column in (
+                            'requests_count', 'tokens_used', 'session_count'
+                        )
+                    }
+                ))
+
+    async def claim_idempotency_key(self, user_id: int, key: str,
+                                    request_hash: str,
+                                    ttl: float) -> Optional[dict]:
+        """
+        Claims the key for a new request; keys older than ``ttl`` seconds
+        are claimed again. Returns ``None`` if the key is claimed, otherwise
+        ``request_hash``, ``response`` and ``completed_at`` of the request
+        that holds it.
+        """
+        keys = schemas.IdempotencyKey
+        stmt = pg_insert(keys).values(
+            user_id=user_id, key=key, request_hash=request_hash
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[keys.user_id, keys.key],
+            set_={
+                "request_hash": stmt.excluded.request_hash,
+                "response": None,
+                "created_at": func.now(),
+                "completed_at": None,
+            },
+            where=keys.created_at < func.now() - timedelta(seconds=ttl)
+        ).returning(keys.user_id)
+        while True:
+            async with self._autocommit_engine.connect() as conn:
+                if (await conn.execute(stmt)).first() is not None:
+                    return None
+            stored = await self.get_idempotency_key(user_id, key)
+            if stored is not None:
+                return stored
+            # Released in between, claim it again
+
+    async def get_idempotency_key(self, user_id: int,
+                                  key: str) -> Optional[dict]:
+        keys = schemas.IdempotencyKey
+        stmt = select(
+            keys.request_hash, keys.response, keys.completed_at
+        ).where(keys.user_id == user_id, keys.key == key)
+        async with self._autocommit_engine.connect() as conn:
+            row = (await conn.execute(stmt)).first()
+        return None if row is None else row._asdict()
+
+    async def complete_idempotency_key(self, user_id: int, key: str,
+                                       response: dict):
+        keys = schemas.IdempotencyKey
+        stmt = update(keys).where(
+            keys.user_id == user_id, keys.key == key
+        ).values(response=response, completed_at=func.now())
+        async with self._autocommit_engine.connect() as conn:
+            await conn.execute(stmt)
+
+    async def delete_expired_idempotency_keys(self, ttl: float) -> int:
+        """Deletes the keys older than ``ttl`` seconds, returns how many."""
+        keys = schemas.IdempotencyKey
+        stmt = delete(keys).where(
+            keys.created_at < func.now() - timedelta(seconds=ttl)
+        )
+        async with self._autocommit_engine.connect() as conn:
+            return (await conn.execute(stmt)).rowcount
+
+    async def release_idempotency_key(self, user_id: int, key: str):
+        """Frees the key of a failed request, so a retry runs it again."""
+        keys = schemas.IdempotencyKey
+        stmt = delete(keys).where(
+            keys.user_id == user_id, keys.key == key,
+            keys.completed_at.is_(None)
+        )
+        async with self._autocommit_engine.connect() as conn:
+            await conn.execute(stmt)
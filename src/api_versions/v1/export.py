@@ -0,0 +1,272 @@
+"""
+Bulk export of conversations for analytics.
+
+Streams ``messages``, ``chat_sessions``, ``ai_requests`` and ``usage_logs``
+in chunks into zstd-compressed Parquet (or Arrow IPC) files partitioned by
+day::
+
+    <out>/<table>/date=YYYY-MM-DD/<first id>-<last id>.parquet
+
+Runs are incremental: the highest exported id of every table (and its
+date) is kept in ``<out>/_state.json``, and the next run reads only rows
+after it. Rows younger than ``--lag`` seconds are left for the next run,
+so rows of transactions still open are not skipped. Sessions are exported
+once, when they start. ``usage_logs`` rows keep growing during their day,
+so the last exported day and the days after it are rewritten on every run.
+
+Point ``--url`` at a replica to keep the load off the primary::
+
+    python -m src.api_versions.v1.export --out exports \
+        --url postgresql+psycopg2://...
+
+Needs the ``pyarrow`` package.
+"""
+import argparse
+import json
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+
+from sqlalchemy import (
+    Boolean, DateTime, Integer, Text, cast, create_engine, func, select
+)
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.engine import Connection
+
+from . import schemas, version_constants
+
+__all__ = ['TABLES', 'export', 'export_table', 'export_usage', 'main']
+
+logger = logging.getLogger(version_constants.API_NAME)
+
+# Exported table -> the column the files are partitioned by
+TABLES = {
+    'messages': 'created_at',
+    'chat_sessions': 'started_at',
+    'ai_requests': 'created_at',
+    'usage_logs': 'date',
+}
+
+_EXTENSIONS = {'parquet': 'parquet', 'arrow': 'arrow'}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError(
+            "Export needs the pyarrow package: pip install pyarrow"
+        )
+    return pyarrow
+
+
+def _exported(table) -> list:
+    """
+    Columns of the table but the ones Postgres computes, like the search
+    vector.
+    """
+    return [column for column in table.columns if column.computed is None]
+
+
+def _columns(table) -> list:
+    """Exported columns of the table; JSONB ones are exported as JSON text."""
+    return [
+        cast(column, Text).label(column.name)
+        if isinstance(column.type, JSONB) else column
+        for column in _exported(table)
+    ]
+
+
+def _arrow_schema(table):
+    pa = _pyarrow()
+    fields = []
+    for column in _exported(table):
+        if isinstance(column.type, Integer):
+            arrow_type = pa.int64()
+        elif isinstance(column.type, Boolean):
+            arrow_type = pa.bool_()
+        elif isinstance(column.type, DateTime):
+            arrow_type = pa.timestamp('us', tz='UTC')
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column.name, arrow_type))
+    return pa.schema(fields)
+
+
+def _write(rows: list, schema, path: str, file_format: str):
+    """Writes the rows to ``path`` atomically, replacing any older file."""
+    pa = _pyarrow()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.Table.from_pylist(rows, schema=schema)
+    tmp_path = path + '.tmp'
+    if file_format == 'arrow':
+        pa.feather.write_feather(table, tmp_path, compression='zstd')
+    else:
+        pa.parquet.write_table(table, tmp_path, compression='zstd')
+    os.replace(tmp_path, path)
+
+
+def _by_day(rows: Iterable[dict], date_column: str) -> dict:
+    days = defaultdict(list)
+    for row in rows:
+        days[row[date_column].astimezone(timezone.utc).date()].append(row)
+    return days
+
+
+def _load_state(out: str) -> dict:
+    try:
+        with open(os.path.join(out, '_state.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_state(out: str, state: dict):
+    path = os.path.join(out, '_state.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def export_table(conn: Connection, name: str, out: str, state: dict,
+                 file_format: str = 'parquet', chunk_size: int = 50000,
+                 lag: float = 300) -> int:
+    """
+    Exports the rows of an append-only table after its high-water mark in
+    ``state``, ``chunk_size`` rows at a time through a server-side cursor,
+    moving the mark after every chunk. Returns the number of rows.
+    """
+    table = schemas.Base.metadata.tables[name]
+    date_column = TABLES[name]
+    schema = _arrow_schema(table)
+    stmt = select(*_columns(table)).where(
+        table.c.id > state.get(name, 0),
+        table.c[date_column] < func.now() - timedelta(seconds=lag)
+    ).order_by(table.c.id)
+    if f'{name}.{date_column}' in state:
+        # Rows after the mark are at most ``lag`` older than the last one
+        # exported; the bound prunes the partitions before it
+        last = datetime.fromisoformat(state[f'{name}.{date_column}'])
+        since = last - timedelta(seconds=lag)
+        stmt = stmt.where(table.c[date_column] >= since)
+
+    exported = 0
+    result = conn.execute(
+        stmt.execution_options(stream_results=True, yield_per=chunk_size)
+    )
+    for chunk in result.mappings().partitions():
+        for day, rows in _by_day(chunk, date_column).items():
+            path = os.path.join(
+                out, name, f'date={day.isoformat()}',
+                f"{rows[0]['id']}-{rows[-1]['id']}.{_EXTENSIONS[file_format]}"
+            )
+            _write(rows, schema, path, file_format)
+        exported += len(chunk)
+        state[name] = chunk[-1]['id']
+        state[f'{name}.{date_column}'] = chunk[-1][date_column].isoformat()
+        _save_state(out, state)
+        logger.info(f"{name}: {exported} rows exported")
+    return exported
+
+
+def export_usage(conn: Connection, out: str, state: dict,
+                 file_format: str = 'parquet', chunk_size: int = 50000) -> int:
+    """
+    Rewrites the ``usage_logs`` files of the last exported day and of every
+    day after it, one file per day. Returns the number of rows.
+    """
+    table = schemas.UsageLog.__table__
+    schema = _arrow_schema(table)
+    since = datetime.fromisoformat(
+        state.get('usage_logs', '1970-01-01T00:00:00+00:00')
+    )
+    stmt = select(*_columns(table)).where(table.c.date >= since) \
+        .order_by(table.c.date, table.c.id)
+
+    def flush(day, rows):
+        path = os.path.join(
+            out, 'usage_logs', f'date={day.isoformat()}',
+            f'day.{_EXTENSIONS[file_format]}'
+        )
+        _write(rows, schema, path, file_format)
+        state['usage_logs'] = rows[0]['date'].isoformat()
+        _save_state(out, state)
+
+    exported = 0
+    day, rows = None, []
+    result = conn.execute(
+        stmt.execution_options(stream_results=True, yield_per=chunk_size)
+    )
+    for row in result.mappings():
+        row_day = row['date'].astimezone(timezone.utc).date()
+        if rows and row_day != day:
+            flush(day, rows)
+            rows = []
+        day = row_day
+        rows.append(dict(row))
+        exported += 1
+    if rows:
+        flush(day, rows)
+    logger.info(f"usage_logs: {exported} rows exported")
+    return exported
+
+
+def export(out: str, url: Optional[str] = None,
+           tables: Iterable[str] = tuple(TABLES), file_format: str = 'parquet',
+           chunk_size: int = 50000, lag: float = 300) -> dict:
+    """Exports the tables into ``out``; returns the rows exported per table."""
+    _pyarrow()
+    engine = create_engine(url) if url else schemas.get_engine()
+    os.makedirs(out, exist_ok=True)
+    state = _load_state(out)
+    exported = {}
+    try:
+        for name in tables:
+            with engine.connect() as conn:
+                if name == 'usage_logs':
+                    exported[name] = export_usage(
+                        conn, out, state, file_format, chunk_size
+                    )
+                else:
+                    exported[name] = export_table(
+                        conn, name, out, state, file_format, chunk_size, lag
+                    )
+    finally:
+        engine.dispose()
+    return exported
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(
+        description="Export conversations into Parquet or Arrow files "
+                    "partitioned by day."
+    )
+    parser.add_argument('--out', default='exports',
+                        help="output directory, also keeps the state")
+    parser.add_argument('--url',
+                        help="database URL, e.g. of a replica; the "
+                             "configured database by default")
+    parser.add_argument('--tables', nargs='+', choices=list(TABLES),
+                        default=list(TABLES))
+    parser.add_argument('--format', choices=list(_EXTENSIONS),
+                        default='parquet', dest='file_format')
+    parser.add_argument('--chunk-size', type=int, default=50000,
+                        help="rows per fetch and file")
+    parser.add_argument('--lag', type=float, default=300,
+                        help="seconds rows must be old to be exported")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    exported = export(
+        args.out, args.url, args.tables, args.file_format, args.chunk_size,
+        args.lag
+    )
+    print(json.dumps(exported))
+
+
+if __name__ == '__main__':
+    main()
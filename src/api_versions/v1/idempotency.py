@@ -0,0 +1,187 @@
+"""
+Idempotency keys for API version 1.
+
+A request sent with an ``Idempotency-Key`` header runs once per user and
+key: a retry while it is still running waits for the same result, and a
+retry after it is done gets the stored response back, without another
+model call or duplicated messages. Expired keys are deleted every
+``IDEMPOTENCY_CLEANUP_INTERVAL`` seconds.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+
+from . import version_constants
+from ...cache import TTLCache
+
+__all__ = ['IdempotencyStore', 'request_hash']
+
+logger = logging.getLogger(version_constants.API_NAME)
+
+# How often a retry checks on a request running in another process
+_POLL_INTERVAL = 0.25
+
+
+def request_hash(payload: dict) -> str:
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    ).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(
+            self,
+            db,
+            ttl: float = version_constants.IDEMPOTENCY_TTL,
+            wait: float = version_constants.IDEMPOTENCY_WAIT,
+            cache_ttl: float = version_constants.CACHE_TTL,
+            cache_max_size: int = version_constants.CACHE_MAX_SIZE,
+            cleanup_interval: float = (
+                version_constants.IDEMPOTENCY_CLEANUP_INTERVAL
+            )
+    ):
+        """
+        Keys are kept for ``ttl`` seconds in the ``idempotency_keys`` table,
+        so retries are deduplicated across worker processes and restarts;
+        once started, older keys are deleted every ``cleanup_interval``
+        seconds. Requests running in this process are shared through
+        futures, and recent responses are cached for ``cache_ttl`` seconds;
+        a retry of a request running in another process polls the table
+        for up to ``wait`` seconds.
+        """
+        self._db = db
+        self.ttl = ttl
+        self.wait = wait
+        self.cleanup_interval = cleanup_interval
+        self._running: Dict[Tuple[int, str], asyncio.Future] = {}
+        # (user_id, key) -> (request_hash, response)
+        self._done = TTLCache(cache_max_size, cache_ttl)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._work())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _work(self):
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            try:
+                deleted = await self._db.delete_expired_idempotency_keys(
+                    self.ttl
+                )
+            except Exception as e:
+                logger.error(
+                    f"Failed to delete expired idempotency keys: {e}",
+                    exc_info=True
+                )
+            else:
+                if deleted:
+                    logger.info(f"Deleted {deleted} expired idempotency keys")
+
+    @staticmethod
+    def _check_hash(stored: str, current: str):
+        if stored != current:
+            raise HTTPException(
+                status_code=422,
+                detail="Idempotency-Key was already used for another request"
+            )
+
+    @staticmethod
+    def _failed() -> HTTPException:
+        return HTTPException(
+            status_code=409,
+            detail="A request with this Idempotency-Key failed, retry it"
+        )
+
+    async def run(self, user_id: int, key: str, payload: dict,
+                  handler: Callable[[], Awaitable[dict]]) -> dict:
+        """
+        Returns the response of ``handler()`` for the first request with the
+        key, and the same response for its retries. A failed request frees
+        the key, so it can be retried.
+        """
+        current_hash = request_hash(payload)
+        done = self._done.get((user_id, key))
+        if done is not None:
+            self._check_hash(done[0], current_hash)
+            return done[1]
+
+        running = self._running.get((user_id, key))
+        if running is not None:
+            stored_hash, response = await asyncio.shield(running)
+            self._check_hash(stored_hash, current_hash)
+            return response
+
+        future = asyncio.get_running_loop().create_future()
+        self._running[(user_id, key)] = future
+        try:
+            result = await self._run(user_id, key, current_hash, handler)
+        except Exception as e:
+            future.set_exception(e)
+            # Only retries attached to it have to handle the error
+            future.exception()
+            raise
+        except BaseException:
+            # Cancelled, retries attached to it are not
+            future.set_exception(self._failed())
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            self._done.set((user_id, key), result)
+            self._check_hash(result[0], current_hash)
+            return result[1]
+        finally:
+            del self._running[(user_id, key)]
+
+    async def _run(self, user_id: int, key: str, current_hash: str,
+                   handler) -> tuple:
+        stored = await self._db.claim_idempotency_key(
+            user_id, key, current_hash, self.ttl
+        )
+        if stored is not None:
+            return await self._wait_stored(user_id, key, stored)
+
+        try:
+            response = await handler()
+        except BaseException:
+            await asyncio.shield(
+                self._db.release_idempotency_key(user_id, key)
+            )
+            raise
+        try:
+            await self._db.complete_idempotency_key(user_id, key, response)
+        except Exception as e:
+            # The answer is there, only later retries may run it again
+            logger.error(
+                f"Failed to store idempotent response: {e}", exc_info=True
+            )
+        return current_hash, response
+
+    async def _wait_stored(self, user_id: int, key: str,
+                           stored: dict) -> tuple:
+        """Waits for the request that holds the key in another process."""
+        deadline = asyncio.get_running_loop().time() + self.wait
+        while stored is not None and stored["completed_at"] is None:
+            if asyncio.get_running_loop().time() >= deadline:
+                raise HTTPException(
+                    status_code=409,
+                    detail="A request with this Idempotency-Key is still "
+                           "running"
+                )
+            await asyncio.sleep(_POLL_INTERVAL)
+            stored = await self._db.get_idempotency_key(user_id, key)
+        if stored is None:
+            # It failed and freed the key
+            raise self._failed()
+        return stored["request_hash"], stored["response"]
@@ -0,0 +1,233 @@
+"""
+Long-term memory of a user across chat sessions.
+
+Every message the user writes (and the summaries of their sessions) is
+embedded locally with the hashing trick: the words of the text and their
+character trigrams are hashed into ``EMBEDDING_DIM`` signed buckets, so
+different forms of one word ("сон", "сна", "сном") land close to each
+other without any model or network call. A turn recalls the past snippets
+closest to the new message from the other sessions of the user, and they
+are added to the prompt.
+
+The vectors of a user are kept in memory as one ``float32`` matrix of at
+most ``MEMORY_MAX_ITEMS`` rows (1 KB each), the oldest overwritten first,
+and a query is a single matrix-vector product. A new summary of a session
+replaces its older one in the index. Indexes of at most
+``MEMORY_CACHE_USERS`` users are kept, each for ``MEMORY_TTL`` seconds;
+an evicted one is rebuilt from the database on the next turn of the user.
+"""
+import asyncio
+import logging
+import re
+import zlib
+from typing import Optional
+
+import numpy as np
+
+from . import version_constants
+from ...cache import TTLCache
+
+__all__ = ['EMBEDDING_DIM', 'MemoryIndex', 'MemoryStore', 'embed']
+
+logger = logging.getLogger(version_constants.API_NAME)
+
+EMBEDDING_DIM = 256
+
+# Snippets longer than that are cut in the prompt
+_SNIPPET_CHARS = 300
+
+_WORD = re.compile(r'\w+')
+
+
+def _features(text: str) -> list:
+    features = []
+    for word in _WORD.findall(text.lower()):
+        features.append(word)
+        if len(word) > 3:
+            marked = f'<{word}>'
+            features.extend(marked[i:i + 3] for i in range(len(marked) - 2))
+    return features
+
+
+def embed(text: str) -> np.ndarray:
+    """
+    Unit ``float32`` vector of the text; texts sharing words or parts of
+    words have a high dot product. Hashes with crc32, so vectors are the
+    same in every process.
+    """
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    features = _features(text)
+    if not features:
+        return vector
+    hashes = np.fromiter(
+        (zlib.crc32(feature.encode()) for feature in features),
+        dtype=np.uint32, count=len(features)
+    )
+    signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+    np.add.at(vector, hashes % EMBEDDING_DIM, signs)
+    # Damps features repeated many times in a long text
+    vector = np.sign(vector) * np.log1p(np.abs(vector))
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class MemoryIndex:
+    def __init__(self, max_items: int = version_constants.MEMORY_MAX_ITEMS):
+        """
+        Vectors of up to ``max_items`` snippets of one user with the
+        session each is from; past that the oldest is overwritten.
+        """
+        self.max_items = max_items
+        self._vectors = np.zeros(
+            (min(max_items, 64), EMBEDDING_DIM), dtype=np.float32
+        )
+        self._sessions = np.zeros(len(self._vectors), dtype=np.int64)
+        self._texts: list = [None] * len(self._vectors)
+        # Session -> the row of its summary and the summary
+        self._summaries: dict = {}
+        self._size = 0
+        self._next = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, session_id: int, text: str, vector: np.ndarray = None,
+            summary: bool = False):
+        """
+        Adds a snippet of the session; a ``summary`` overwrites the earlier
+        summary of the session if that is still in the index.
+        """
+        if vector is None:
+            vector = embed(text)
+        if not vector.any():
+            return
+        row, old = self._summaries.get(session_id, (None, None))
+        if not summary or row is None or self._texts[row] is not old:
+            full = self._next == len(self._vectors)
+            if full and len(self._vectors) < self.max_items:
+                capacity = min(self.max_items, 2 * len(self._vectors))
+                self._vectors = np.resize(
+                    self._vectors, (capacity, EMBEDDING_DIM)
+                )
+                self._sessions = np.resize(self._sessions, capacity)
+                self._texts.extend([None] * (capacity - len(self._texts)))
+            if self._next == len(self._vectors):
+                self._next = 0
+            row = self._next
+            self._next += 1
+            self._size = max(self._size, self._next)
+        self._vectors[row] = vector
+        self._sessions[row] = session_id
+        self._texts[row] = text
+        if summary:
+            self._summaries[session_id] = row, text
+
+    def search(self, vector: np.ndarray, k: int, min_score: float = 0,
+               exclude_session: Optional[int] = None) -> list:
+        """
+        Texts of up to ``k`` snippets with the highest dot product with
+        ``vector`` that is at least ``min_score``, best first, leaving out
+        the ``exclude_session`` ones.
+        """
+        if not self._size or k <= 0:
+            return []
+        scores = self._vectors[:self._size] @ vector
+        if exclude_session is not None:
+            scores[self._sessions[:self._size] == exclude_session] = -np.inf
+        if k < self._size:
+            top = np.argpartition(scores, -k)[-k:]
+        else:
+            top = np.arange(self._size)
+        top = top[np.argsort(scores[top])[::-1]]
+        # A message repeated in several sessions is recalled once
+        return list(dict.fromkeys(
+            self._texts[i] for i in top if scores[i] >= min_score
+        ))
+
+
+class MemoryStore:
+    def __init__(
+            self,
+            db,
+            top_k: int = version_constants.MEMORY_TOP_K,
+            min_score: float = version_constants.MEMORY_MIN_SCORE,
+            max_items: int = version_constants.MEMORY_MAX_ITEMS,
+            cache_users: int = version_constants.MEMORY_CACHE_USERS,
+            ttl: float = version_constants.MEMORY_TTL
+    ):
+        """
+        Indexes of the users loaded from ``db`` on first use and kept
+        up to date by ``recall``, which returns up to ``top_k`` past
+        snippets scoring at least ``min_score``; 0 turns memory off.
+        """
+        self._db = db
+        self.top_k = top_k
+        self.min_score = min_score
+        self.max_items = max_items
+        self._indexes = TTLCache(maxsize=cache_users, ttl=ttl)
+        self._loading: dict = {}
+
+    def _build(self, items: list) -> MemoryIndex:
+        index = MemoryIndex(self.max_items)
+        for item in items:
+            index.add(
+                item["session_id"], item["text"],
+                summary=item.get("summary", False)
+            )
+        return index
+
+    async def _load(self, user_id: int) -> MemoryIndex:
+        loading = self._loading.get(user_id)
+        if loading is None:
+            loading = asyncio.ensure_future(self._read(user_id))
+            self._loading[user_id] = loading
+        return await asyncio.shield(loading)
+
+    async def _read(self, user_id: int) -> MemoryIndex:
+        try:
+            items = await self._db.get_memory_items(user_id, self.max_items)
+            # Embedding hundreds of texts takes a while, off the loop
+            index = await asyncio.to_thread(self._build, items)
+            self._indexes.set(user_id, index)
+            return index
+        finally:
+            self._loading.pop(user_id, None)
+
+    async def recall(self, user_id: int, session_id: int, text: str) -> list:
+        """
+        Past snippets of the user closest to the saved message ``text``
+        from sessions other than ``session_id``, best first, and adds the
+        message to the index. Failures are logged, and no snippets are
+        returned.
+        """
+        if self.top_k <= 0:
+            return []
+        vector = embed(text)
+        index = self._indexes.get(user_id)
+        if index is not None:
+            index.add(session_id, text, vector)
+        else:
+            # The index read from the database has the message already
+            try:
+                index = await self._load(user_id)
+            except Exception as e:
+                logger.error(
+                    f"Failed to load the memory of user {user_id}: {e}",
+                    exc_info=True
+                )
+                return []
+        snippets = index.search(
+            vector, self.top_k, self.min_score, exclude_session=session_id
+        )
+        return [snippet[:_SNIPPET_CHARS] for snippet in snippets]
+
+    def add_summary(self, user_id: int, session_id: int, summary: str):
+        """
+        Indexes a new summary of the session in place of its older one.
+        An index that is not loaded reads the summary from the database.
+        """
+        if self.top_k <= 0:
+            return
+        index = self._indexes.get(user_id, count=False)
+        if index is not None:
+            index.add(session_id, summary, summary=True)
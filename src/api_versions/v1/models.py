@@ -16,6 +16,19 @@ class UserCreateRequest(BaseModel):
     name: str = Field(..., description="First name of the user")
     gender: Optional[str] = Field(None, description="Gender of the user")
     age: Optional[int] = Field(None, description="Age of the user")
+    external_id: Optional[str] = Field(
+        None, max_length=255,
+        description="Stable client-side id of the user; registering the same "
+                    "id again returns the same user"
+    )
+    telegram_id: Optional[int] = Field(
+        None, description="Telegram id of the user; used as the key if "
+                          "there is no external_id"
+    )
+
+
+class UsersBulkRequest(BaseModel):
+    users: list[UserCreateRequest] = Field(..., min_length=1, max_length=1000)
 
 class UserResponse(BaseModel):
     id: int
@@ -25,6 +38,7 @@ class UserResponse(BaseModel):
     gender: Optional[str] = None
     age: Optional[int] = None
     telegram_id: Optional[int] = None
+    external_id: Optional[str] = None
     created_at: datetime
 
     class Config:
@@ -44,6 +58,7 @@ class Error(BaseModel):
 
 class MessageResponse(BaseModel):
     id: int
+    session_id: Optional[int] = None
     sender: str
     message_text: str
     created_at: datetime
@@ -53,4 +68,33 @@ class MessageResponse(BaseModel):
 
 class HistoryResponse(BaseModel):
     session_id: int
-    messages: list[MessageResponse]
\ No newline at end of file
+    messages: list[MessageResponse]
+    next_cursor: Optional[str] = Field(
+        None,
+        description="Pass as ``after`` for the next page, if there is one"
+    )
+    prev_cursor: Optional[str] = Field(
+        None,
+        description="Pass as ``before`` for the previous page, if there is one"
+    )
+
+
+class SearchResult(BaseModel):
+    id: int
+    session_id: int
+    sender: str
+    created_at: datetime
+    rank: float = Field(
+        ..., description="Relevance of the message to the query"
+    )
+    snippet: str = Field(
+        ..., description="Fragments with the matched words in <b> tags"
+    )
+
+
+class SearchResponse(BaseModel):
+    results: list[SearchResult]
+    next_cursor: Optional[str] = Field(
+        None,
+        description="Pass as ``after`` for the next page, if there is one"
+    )
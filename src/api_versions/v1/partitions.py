@@ -0,0 +1,547 @@
+"""
+Monthly range partitions of ``messages`` and ``ai_requests``.
+
+Both tables are partitioned by ``created_at``: a partition per calendar
+month (UTC) named like ``messages_p2025_01``, created
+``PARTITION_MONTHS_AHEAD`` months in advance on start and by
+``PartitionMaintainer``, and a default partition catching anything outside
+of them. Old partitions are archived to compressed files and dropped by
+the retention job; tables created before partitioning are converted by
+``migrate``, and the full-text search column of ``messages`` is added to
+an existing database by ``migrate_search``. ``PartitionMaintainer`` also
+runs the retention job when ``PARTITION_RETENTION_MONTHS`` is above 0.
+Each of them can be run by hand::
+
+    python -m src.api_versions.v1.partitions migrate
+    python -m src.api_versions.v1.partitions migrate-search
+    python -m src.api_versions.v1.partitions archive --retention-months 12
+
+Archiving needs the ``pyarrow`` package.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.schema import CreateColumn
+
+from . import export, schemas, version_constants
+
+__all__ = [
+    'PARTITIONED_TABLES',
+    'PartitionMaintainer',
+    'archive_expired',
+    'ensure_partitions',
+    'main',
+    'migrate',
+    'migrate_search',
+]
+
+logger = logging.getLogger(version_constants.API_NAME)
+
+PARTITIONED_TABLES = ('messages', 'ai_requests')
+
+# Key of the advisory lock serializing ensure_partitions
+_LOCK_KEY = 0x7061_7274
+# Key of the advisory lock letting one archive_expired run at a time
+_ARCHIVE_LOCK_KEY = 0x6172_6368
+
+_BOUND = re.compile(r"FROM \((MINVALUE|'[^']+')\) TO \((MAXVALUE|'[^']+')\)")
+
+
+def _month(moment: datetime, months: int = 0) -> datetime:
+    """Start of the month ``months`` after the one of ``moment``, in UTC."""
+    moment = moment.astimezone(timezone.utc)
+    index = moment.year * 12 + moment.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def _parse_bound(value: str) -> Optional[datetime]:
+    if value in ('MINVALUE', 'MAXVALUE'):
+        return None
+    return datetime.fromisoformat(value.strip("'"))
+
+
+def _is_partitioned(conn: Connection, table: str) -> bool:
+    return bool(conn.scalar(text(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:table)"
+    ), {"table": table}))
+
+
+def _partitions(conn: Connection, table: str) -> list:
+    """
+    ``(name, lower, upper)`` of the range partitions, ``None`` for
+    MINVALUE/MAXVALUE.
+    """
+    rows = conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+        "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:table)"
+    ), {"table": table})
+    partitions = []
+    for name, bound in rows:
+        match = _BOUND.search(bound)
+        if match:
+            lower, upper = map(_parse_bound, match.groups())
+            partitions.append((name, lower, upper))
+    return partitions
+
+
+def _overlaps(partitions: list, lower: datetime, upper: datetime) -> bool:
+    return any(
+        (start is None or start < upper) and (end is None or end > lower)
+        for _, start, end in partitions
+    )
+
+
+def _create_partition(conn: Connection, table: str, name: str,
+                      lower: datetime, upper: datetime):
+    """
+    Creates the partition of ``[lower, upper)``. Rows of that range in the
+    default partition (written while the partition was missing) would make
+    Postgres refuse it, so the default partition is detached and the rows
+    are moved into the new partition first.
+    """
+    quote = conn.dialect.identifier_preparer.quote
+    default = f'{table}_default'
+    bounds = f"FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')"
+    in_range = "created_at >= :lower AND created_at < :upper"
+    params = {"lower": lower, "upper": upper}
+    stranded = conn.scalar(text(
+        f"SELECT count(*) FROM {quote(default)} WHERE {in_range}"
+    ), params)
+    if not stranded:
+        conn.execute(text(
+            f"CREATE TABLE {quote(name)} PARTITION OF {quote(table)} "
+            f"FOR VALUES {bounds}"
+        ))
+        return
+
+    logger.warning(
+        f"Moving {stranded} rows of {name} out of {default}, "
+        f"{table} is locked meanwhile"
+    )
+    columns = ', '.join(
+        quote(column.name)
+        for column in export._exported(schemas.Base.metadata.tables[table])
+    )
+    conn.execute(text(
+        f"ALTER TABLE {quote(table)} DETACH PARTITION {quote(default)}"
+    ))
+    conn.execute(text(
+        f"CREATE TABLE {quote(name)} PARTITION OF {quote(table)} "
+        f"FOR VALUES {bounds}"
+    ))
+    conn.execute(text(
+        f"INSERT INTO {quote(name)} ({columns}) "
+        f"SELECT {columns} FROM {quote(default)} WHERE {in_range}"
+    ), params)
+    conn.execute(text(
+        f"DELETE FROM {quote(default)} WHERE {in_range}"
+    ), params)
+    conn.execute(text(
+        f"ALTER TABLE {quote(table)} ATTACH PARTITION {quote(default)} DEFAULT"
+    ))
+
+
+def ensure_partitions(
+        conn: Connection,
+        months_ahead: int = version_constants.PARTITION_MONTHS_AHEAD,
+        now: Optional[datetime] = None
+) -> list:
+    """
+    Creates the default partition and the monthly partitions from the
+    current month to ``months_ahead`` months ahead that are missing.
+    Tables that are not partitioned yet are left alone. Runs under a
+    transaction-level advisory lock, so the workers starting together
+    create each partition once. Returns the names of the partitions
+    created.
+    """
+    now = now or datetime.now(timezone.utc)
+    quote = conn.dialect.identifier_preparer.quote
+    conn.execute(
+        text("SELECT pg_advisory_xact_lock(:key)"), {"key": _LOCK_KEY}
+    )
+    created = []
+    for table in PARTITIONED_TABLES:
+        if not _is_partitioned(conn, table):
+            logger.warning(
+                f"Table {table} is not partitioned, see partitions.migrate"
+            )
+            continue
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {quote(table + '_default')} "
+            f"PARTITION OF {quote(table)} DEFAULT"
+        ))
+        partitions = _partitions(conn, table)
+        for months in range(months_ahead + 1):
+            lower, upper = _month(now, months), _month(now, months + 1)
+            if _overlaps(partitions, lower, upper):
+                continue
+            name = f'{table}_p{lower:%Y_%m}'
+            _create_partition(conn, table, name, lower, upper)
+            partitions.append((name, lower, upper))
+            created.append(name)
+    return created
+
+
+def migrate(conn: Connection) -> list:
+    """
+    Converts ``messages`` and ``ai_requests`` created before partitioning:
+    the old table becomes the partition of everything up to the end of the
+    month of its latest row, so no rows are copied. Locks the tables and
+    checks every row once; run it in a maintenance window. Returns the
+    tables converted.
+    """
+    quote = conn.dialect.identifier_preparer.quote
+    converted = []
+    for table in PARTITIONED_TABLES:
+        exists = conn.scalar(
+            text("SELECT to_regclass(:table)"), {"table": table}
+        ) is not None
+        if not exists or _is_partitioned(conn, table):
+            continue
+        legacy = f'{table}_legacy'
+        # Foreign keys to the table (the one from ai_requests to messages),
+        # the id of a partitioned table is not unique by itself
+        for constraint, owner in conn.execute(text(
+            "SELECT conname, conrelid::regclass::text FROM pg_constraint "
+            "WHERE contype = 'f' AND confrelid = to_regclass(:table)"
+        ), {"table": table}).all():
+            conn.execute(text(
+                f"ALTER TABLE {quote(owner)} "
+                f"DROP CONSTRAINT {quote(constraint)}"
+            ))
+
+        conn.execute(text(
+            f"ALTER TABLE {quote(table)} RENAME TO {quote(legacy)}"
+        ))
+        for index in conn.scalars(text(
+            "SELECT indexname FROM pg_indexes WHERE tablename = :table"
+        ), {"table": legacy}).all():
+            renamed = index[:56] + '_legacy'
+            conn.execute(text(
+                f"ALTER INDEX {quote(index)} RENAME TO {quote(renamed)}"
+            ))
+        conn.execute(text(
+            f"ALTER SEQUENCE IF EXISTS {quote(table + '_id_seq')} "
+            f"RENAME TO {quote(legacy + '_id_seq')}"
+        ))
+        schemas.Base.metadata.tables[table].create(conn)
+
+        last_id, last_created_at = conn.execute(text(
+            f"SELECT max(id), max(created_at) FROM {quote(legacy)}"
+        )).one()
+        conn.execute(text(
+            "SELECT setval(pg_get_serial_sequence(:table, 'id'), :id, :called)"
+        ), {"table": table, "id": last_id or 1, "called": last_id is not None})
+        conn.execute(text(
+            f"UPDATE {quote(legacy)} SET created_at = 'epoch' "
+            f"WHERE created_at IS NULL"
+        ))
+        conn.execute(text(
+            f"ALTER TABLE {quote(legacy)} ALTER COLUMN created_at SET NOT NULL"
+        ))
+        # The primary key of the parent on (id, created_at) replaces it
+        for constraint in conn.scalars(text(
+            "SELECT conname FROM pg_constraint "
+            "WHERE contype = 'p' AND conrelid = to_regclass(:table)"
+        ), {"table": legacy}).all():
+            conn.execute(text(
+                f"ALTER TABLE {quote(legacy)} "
+                f"DROP CONSTRAINT {quote(constraint)}"
+            ))
+        # A partition has every column of the parent, the search vector too
+        existing = {c['name'] for c in inspect(conn).get_columns(legacy)}
+        for column in schemas.Base.metadata.tables[table].columns:
+            if column.name not in existing:
+                column_ddl = CreateColumn(column).compile(dialect=conn.dialect)
+                conn.execute(text(
+                    f"ALTER TABLE {quote(legacy)} ADD COLUMN {column_ddl}"
+                ))
+        if last_created_at is None:
+            upper = _month(datetime.now(timezone.utc))
+        else:
+            upper = _month(last_created_at, 1)
+        conn.execute(text(
+            f"ALTER TABLE {quote(table)} ATTACH PARTITION {quote(legacy)} "
+            f"FOR VALUES FROM (MINVALUE) TO ('{upper.isoformat()}')"
+        ))
+        converted.append(table)
+    return converted
+
+
+def _children(conn: Connection, table: str) -> list:
+    """Names of every partition of the table, the default one too."""
+    return conn.scalars(text(
+        "SELECT inhrelid::regclass::text FROM pg_inherits "
+        "WHERE inhparent = to_regclass(:table) ORDER BY 1"
+    ), {"table": table}).all()
+
+
+def migrate_search(conn: Connection) -> list:
+    """
+    Adds ``messages.search_vector`` and its GIN index to a database created
+    before the message search. Adding the column rewrites the table under
+    an exclusive lock, once; the index is then built with ``CREATE INDEX
+    CONCURRENTLY`` one partition at a time, so writes go on, and attached
+    to an index of the parent. ``conn`` must be in autocommit mode. Safe
+    to run again after a failure. Returns the indexes built.
+    """
+    quote = conn.dialect.identifier_preparer.quote
+    table = schemas.Message.__table__
+    column = table.c.search_vector
+    index = next(
+        i for i in table.indexes
+        if i.info.get('migration') == 'migrate-search'
+    )
+    existing = {c['name'] for c in inspect(conn).get_columns(table.name)}
+    if column.name not in existing:
+        logger.info(f"Adding {column}, this rewrites the table")
+        conn.execute(text(
+            f"ALTER TABLE {quote(table.name)} ADD COLUMN "
+            f"{CreateColumn(column).compile(dialect=conn.dialect)}"
+        ))
+
+    partitioned = _is_partitioned(conn, table.name)
+    targets = _children(conn, table.name) if partitioned else [table.name]
+    if partitioned:
+        # Invalid until every partition has its index attached; partitions
+        # created from now on get theirs from it
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS {quote(index.name)} "
+            f"ON ONLY {quote(table.name)} USING gin (search_vector)"
+        ))
+    # Tables of the partition indexes attached already
+    attached = set(conn.scalars(text(
+        "SELECT x.indrelid::regclass::text FROM pg_inherits i "
+        "JOIN pg_index x ON x.indexrelid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:index)"
+    ), {"index": index.name}).all())
+    built = []
+    for target in targets:
+        if target in attached:
+            continue
+        name = f'{target}_search_vector_idx' if partitioned else index.name
+        # An index left invalid by an interrupted build is built again
+        if conn.scalar(text(
+            "SELECT NOT indisvalid FROM pg_index "
+            "WHERE indexrelid = to_regclass(:index)"
+        ), {"index": name}):
+            conn.execute(text(f"DROP INDEX CONCURRENTLY {quote(name)}"))
+        conn.execute(text(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {quote(name)} "
+            f"ON {quote(target)} USING gin (search_vector)"
+        ))
+        if partitioned:
+            conn.execute(text(
+                f"ALTER INDEX {quote(index.name)} "
+                f"ATTACH PARTITION {quote(name)}"
+            ))
+        logger.info(f"Index {name} built")
+        built.append(name)
+    return built
+
+
+def archive_expired(
+        conn: Connection,
+        retention_months: int,
+        archive_dir: str = version_constants.PARTITION_ARCHIVE_DIR,
+        file_format: str = 'parquet',
+        chunk_size: int = 50000,
+        now: Optional[datetime] = None
+) -> list:
+    """
+    Writes every partition that ends more than ``retention_months`` months
+    ago into ``<archive_dir>/<table>/<partition>/`` files, then detaches and
+    drops it. A partition is committed one at a time, and only after its
+    files are written. Returns the names of the partitions archived; does
+    nothing while another worker or the command is archiving.
+    """
+    cutoff = _month(now or datetime.now(timezone.utc), -retention_months)
+    locked = conn.scalar(
+        text("SELECT pg_try_advisory_lock(:key)"), {"key": _ARCHIVE_LOCK_KEY}
+    )
+    if not locked:
+        logger.info("Partitions are being archived elsewhere")
+        return []
+    try:
+        return _archive_expired(
+            conn, cutoff, archive_dir, file_format, chunk_size
+        )
+    finally:
+        conn.rollback()
+        conn.execute(
+            text("SELECT pg_advisory_unlock(:key)"),
+            {"key": _ARCHIVE_LOCK_KEY}
+        )
+        conn.commit()
+
+
+def _archive_expired(conn: Connection, cutoff: datetime, archive_dir: str,
+                     file_format: str, chunk_size: int) -> list:
+    quote = conn.dialect.identifier_preparer.quote
+    archived = []
+    for table in PARTITIONED_TABLES:
+        if not _is_partitioned(conn, table):
+            continue
+        columns = schemas.Base.metadata.tables[table]
+        schema = export._arrow_schema(columns)
+        select_list = ', '.join(
+            quote(column.name) for column in export._exported(columns)
+        )
+        partitions = sorted(
+            _partitions(conn, table), key=lambda p: p[2] or cutoff
+        )
+        for name, _, upper in partitions:
+            if upper is None or upper > cutoff:
+                continue
+            result = conn.execute(
+                text(f"SELECT {select_list} FROM {quote(name)} ORDER BY id")
+                .execution_options(stream_results=True, yield_per=chunk_size)
+            )
+            rows = 0
+            for chunk in result.mappings().partitions():
+                chunk = [
+                    {
+                        key: json.dumps(value, ensure_ascii=False)
+                        if isinstance(value, (dict, list)) else value
+                        for key, value in row.items()
+                    }
+                    for row in chunk
+                ]
+                extension = export._EXTENSIONS[file_format]
+                path = os.path.join(
+                    archive_dir, table, name,
+                    f"{chunk[0]['id']}-{chunk[-1]['id']}.{extension}"
+                )
+                export._write(chunk, schema, path, file_format)
+                rows += len(chunk)
+            conn.execute(text(
+                f"ALTER TABLE {quote(table)} DETACH PARTITION {quote(name)}"
+            ))
+            conn.execute(text(f"DROP TABLE {quote(name)}"))
+            conn.commit()
+            logger.info(
+                f"Partition {name} ({rows} rows) archived to {archive_dir}"
+            )
+            archived.append(name)
+    return archived
+
+
+class PartitionMaintainer:
+    def __init__(self, db,
+                 interval: float = version_constants.PARTITION_CHECK_INTERVAL,
+                 retention_months: int = (
+                     version_constants.PARTITION_RETENTION_MONTHS
+                 )):
+        """
+        Creates the partitions ahead every ``interval`` seconds and, when
+        ``retention_months`` is above 0, archives the expired ones.
+        """
+        self._db = db
+        self.interval = interval
+        self.retention_months = retention_months
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._work())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _work(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self._db.ensure_partitions()
+            except Exception as e:
+                logger.error(
+                    f"Failed to create partitions: {e}", exc_info=True
+                )
+            if self.retention_months <= 0:
+                continue
+            try:
+                await self._db.archive_partitions(self.retention_months)
+            except Exception as e:
+                logger.error(
+                    f"Failed to archive partitions: {e}", exc_info=True
+                )
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(
+        description="Maintain the monthly partitions of messages and "
+                    "ai_requests."
+    )
+    parser.add_argument(
+        '--url', help="database URL; the configured database by default"
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('ensure', help="create the partitions ahead")
+    commands.add_parser(
+        'migrate', help="partition tables created before partitioning"
+    )
+    commands.add_parser(
+        'migrate-search', help="add the message search column and index"
+    )
+    archive = commands.add_parser(
+        'archive', help="archive and drop old partitions"
+    )
+    archive.add_argument(
+        '--retention-months', type=int,
+        default=version_constants.PARTITION_RETENTION_MONTHS,
+        help="months of partitions to keep"
+    )
+    archive.add_argument(
+        '--archive-dir', default=version_constants.PARTITION_ARCHIVE_DIR
+    )
+    archive.add_argument(
+        '--format', choices=list(export._EXTENSIONS), default='parquet',
+        dest='file_format'
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    if args.command == 'archive' and args.retention_months <= 0:
+        parser.error(
+            "archive needs --retention-months "
+            "(or PARTITION_RETENTION_MONTHS) above 0"
+        )
+    engine = create_engine(args.url) if args.url else schemas.get_engine()
+    try:
+        if args.command == 'archive':
+            export._pyarrow()
+            with engine.connect() as conn:
+                print(archive_expired(
+                    conn, args.retention_months, args.archive_dir,
+                    args.file_format
+                ))
+        elif args.command == 'migrate-search':
+            # CREATE INDEX CONCURRENTLY cannot run in a transaction
+            autocommit = engine.execution_options(
+                isolation_level='AUTOCOMMIT'
+            )
+            with autocommit.connect() as conn:
+                print(migrate_search(conn))
+        else:
+            with engine.begin() as conn:
+                if args.command == 'migrate':
+                    print(migrate(conn))
+                print(ensure_partitions(conn))
+    finally:
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""
+Subscription quotas for API version 1.
+
+Quota checks and usage accounting run against in-process counters; the
+counters are written to ``subscriptions`` and ``usage_logs`` by a
+background task in aggregated batches, so a chat turn costs no extra
+database writes. With several worker processes each one counts its own
+requests, so a limit may be overshot by what the other workers have not
+flushed yet.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Optional
+
+from . import version_constants
+from ...cache import TTLCache
+
+__all__ = ['QuotaExceeded', 'QuotaStore']
+
+logger = logging.getLogger(version_constants.API_NAME)
+
+
+class QuotaExceeded(Exception):
+    """The user has used up the requests of their plan."""
+
+
+class QuotaStore:
+    def __init__(
+            self,
+            db,
+            default_limit: int = version_constants.QUOTA_DEFAULT_LIMIT,
+            flush_interval: float = version_constants.QUOTA_FLUSH_INTERVAL,
+            cache_ttl: float = version_constants.CACHE_TTL,
+            cache_max_size: int = version_constants.CACHE_MAX_SIZE
+    ):
+        """
+        Users with an active subscription get its ``usage_limit`` requests;
+        users without one get ``default_limit`` requests a day (0 means
+        unlimited). Quotas are read from the database at most once per
+        ``cache_ttl`` seconds per user, and counters are flushed every
+        ``flush_interval`` seconds.
+        """
+        self._db = db
+        self.default_limit = default_limit
+        self.flush_interval = flush_interval
+        # user_id -> {"subscription_id", "plan", "limit", "used", "day"}
+        self._quotas = TTLCache(cache_max_size, cache_ttl)
+        # Not yet written counters: subscription_id -> requests and
+        # (user_id, day) -> [requests, tokens, sessions]
+        self._requests = defaultdict(int)
+        self._usage = defaultdict(lambda: [0, 0, 0])
+        # Counters being written right now
+        self._flushing_requests = {}
+        self._flushing_usage = {}
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _today() -> datetime:
+        return datetime.now(timezone.utc).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        self._task = asyncio.create_task(self._work())
+
+    async def stop(self):
+        """Stops the flush task and writes everything still counted."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        await self.flush()
+
+    def _unflushed(self, user_id: int, subscription_id: Optional[int],
+                   day: datetime) -> int:
+        if subscription_id is not None:
+            return (
+                self._requests.get(subscription_id, 0)
+                + self._flushing_requests.get(subscription_id, 0)
+            )
+        key = (user_id, day)
+        usage = self._usage[key][0] if key in self._usage else 0
+        if key in self._flushing_usage:
+            usage += self._flushing_usage[key][0]
+        return usage
+
+    async def _quota(self, user_id: int, day: datetime) -> dict:
+        quota = self._quotas.get(user_id)
+        if quota is None:
+            row = await self._db.get_quota(user_id, day)
+            subscription_id = row["subscription_id"]
+            if subscription_id is None:
+                limit, used = self.default_limit, row["requests_today"]
+            else:
+                limit, used = row["usage_limit"], row["used_requests"]
+            quota = {
+                "subscription_id": subscription_id,
+                "plan": row["plan_name"],
+                "limit": limit,
+                "used": used + self._unflushed(user_id, subscription_id, day),
+                "day": day,
+            }
+            self._quotas.set(user_id, quota)
+        elif quota["day"] != day:
+            quota["day"] = day
+            if quota["subscription_id"] is None:
+                quota["used"] = 0
+        return quota
+
+    async def plan(self, user_id: int) -> Optional[str]:
+        """Plan name of the active subscription of the user, if any."""
+        return (await self._quota(user_id, self._today()))["plan"]
+
+    async def reserve(self, user_id: int) -> dict:
+        """
+        Counts one request of the user, or raises ``QuotaExceeded`` if the
+        plan has no requests left. Returns the quota to ``release`` the
+        request with if it is not served after all.
+        """
+        day = self._today()
+        quota = await self._quota(user_id, day)
+        # No awaits from here on, so the check and the increment are atomic
+        if quota["limit"] and quota["used"] >= quota["limit"]:
+            raise QuotaExceeded(
+                f"Request limit of {quota['limit']} is reached"
+            )
+
+        quota["used"] += 1
+        if quota["subscription_id"] is not None:
+            self._requests[quota["subscription_id"]] += 1
+        self._usage[(user_id, day)][0] += 1
+        return quota
+
+    def release(self, user_id: int, quota: dict):
+        """Gives back a reserved request that was not served."""
+        quota["used"] -= 1
+        if quota["subscription_id"] is not None:
+            self._requests[quota["subscription_id"]] -= 1
+        self._usage[(user_id, quota["day"])][0] -= 1
+
+    def record(self, user_id: int, tokens: int = 0, sessions: int = 0):
+        """Counts tokens used and sessions started by the user."""
+        usage = self._usage[(user_id, self._today())]
+        usage[1] += tokens or 0
+        usage[2] += sessions
+
+    async def flush(self):
+        """Writes the counted usage in one transaction."""
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self):
+        if not self._requests and not self._usage:
+            return
+        self._flushing_requests = self._requests
+        self._requests = defaultdict(int)
+        self._flushing_usage = self._usage
+        self._usage = defaultdict(lambda: [0, 0, 0])
+        try:
+            await self._db.add_usage(
+                {
+                    subscription_id: requests
+                    for subscription_id, requests
+                    in self._flushing_requests.items()
+                    if requests
+                },
+                [
+                    {
+                        "user_id": user_id,
+                        "date": day,
+                        "requests_count": requests,
+                        "tokens_used": tokens,
+                        "session_count": sessions,
+                    }
+                    for (user_id, day), (requests, tokens, sessions)
+                    in self._flushing_usage.items()
+                    if requests or tokens or sessions
+                ]
+            )
+        except Exception as e:
+            logger.error(f"Failed to flush usage: {e}", exc_info=True)
+            # Counted again with the next flush
+            for subscription_id, requests in self._flushing_requests.items():
+                self._requests[subscription_id] += requests
+            for key, counters in self._flushing_usage.items():
+                usage = self._usage[key]
+                for i, value in enumerate(counters):
+                    usage[i] += value
+        finally:
+            self._flushing_requests = {}
+            self._flushing_usage = {}
+
+    async def _work(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            # A flush already started is finished even if the task is stopped
+            await asyncio.shield(self.flush())
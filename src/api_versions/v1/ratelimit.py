@@ -0,0 +1,215 @@
+"""
+Token bucket rate limiting for API version 1.
+
+Every user has a bucket of ``burst`` requests refilled at ``rate`` requests
+per second (both depend on the subscription plan), and all users share one
+global bucket. Buckets live in process (``LocalBackend``) or in Redis
+(``RedisBackend``), so limits also hold across worker processes.
+"""
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from . import version_constants
+from ...cache import TTLCache
+
+__all__ = [
+    'LocalBackend',
+    'RateLimited',
+    'RateLimiter',
+    'RedisBackend',
+    'create_backend',
+    'parse_plans',
+]
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: float):
+        """Too many requests; ``retry_after`` is the wait in seconds."""
+        super().__init__(f"Rate limit exceeded, retry in {retry_after:.1f} s")
+        self.retry_after = retry_after
+
+
+def parse_plans(plans: str) -> Dict[str, Tuple[float, int]]:
+    """Parses ``"free=0.5/5,premium=5/50"`` into ``{plan: (rate, burst)}``."""
+    limits = {}
+    for entry in filter(None, (part.strip() for part in plans.split(','))):
+        plan, limit = entry.split('=')
+        rate, burst = limit.split('/')
+        limits[plan.strip()] = (float(rate), int(burst))
+    return limits
+
+
+class LocalBackend:
+    def __init__(self, maxsize: int = 100000):
+        """
+        Buckets of this process only. A bucket is forgotten once it would
+        have refilled anyway, so idle users take no memory.
+        """
+        # key -> (tokens, monotonic time of the last update)
+        self._buckets = TTLCache(maxsize=maxsize)
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        """
+        Takes a token from the bucket. Returns 0 if there was one, otherwise
+        the seconds until there will be one.
+        """
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (burst, now), count=False)
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+        else:
+            wait = (1 - tokens) / rate
+        self._buckets.set(key, (tokens, now), ttl=burst / rate)
+        return wait
+
+    async def give_back(self, key: str, rate: float, burst: int):
+        """Puts back a token taken from the bucket."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (burst, now), count=False)
+        tokens = min(burst, tokens + (now - updated) * rate + 1)
+        self._buckets.set(key, (tokens, now), ttl=burst / rate)
+
+    async def aclose(self):
+        pass
+
+
+# Same algorithm as LocalBackend, atomic in Redis; uses the Redis clock so
+# that all workers agree on the time
+_TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens),
+           'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+return tostring(wait)
+"""
+
+_GIVE_BACK_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate + 1)
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens),
+           'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+"""
+
+
+class RedisBackend:
+    def __init__(self, url: str = version_constants.RATE_LIMIT_REDIS_URL,
+                 prefix: str = 'ratelimit:'):
+        """
+        Buckets shared by every worker through Redis, one round trip per
+        bucket. Needs the ``redis`` package.
+        """
+        try:
+            import redis.asyncio
+        except ImportError:
+            raise RuntimeError(
+                "RedisBackend needs the redis package: pip install redis"
+            )
+        self.prefix = prefix
+        self._redis = redis.asyncio.from_url(url)
+        self._take = self._redis.register_script(_TAKE_SCRIPT)
+        self._give_back = self._redis.register_script(_GIVE_BACK_SCRIPT)
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        wait = await self._take(keys=[self.prefix + key], args=[rate, burst])
+        return float(wait)
+
+    async def give_back(self, key: str, rate: float, burst: int):
+        await self._give_back(keys=[self.prefix + key], args=[rate, burst])
+
+    async def aclose(self):
+        await self._redis.aclose()
+
+
+def create_backend(name: str = version_constants.RATE_LIMIT_BACKEND):
+    """Creates the ``local`` or ``redis`` backend."""
+    if name == 'local':
+        return LocalBackend()
+    if name == 'redis':
+        return RedisBackend()
+    raise ValueError(f"Unknown rate limit backend: {name}")
+
+
+class RateLimiter:
+    def __init__(
+            self,
+            plan_getter: Callable[[int], Awaitable[Optional[str]]],
+            backend=None,
+            rate: float = version_constants.RATE_LIMIT_RATE,
+            burst: int = version_constants.RATE_LIMIT_BURST,
+            plans: str = version_constants.RATE_LIMIT_PLANS,
+            global_rate: float = version_constants.RATE_LIMIT_GLOBAL_RATE,
+            global_burst: int = version_constants.RATE_LIMIT_GLOBAL_BURST,
+            bucket: str = 'user'
+    ):
+        """
+        ``plan_getter(user_id)`` returns the plan name of the user (or
+        ``None``); plans listed in ``plans`` get their own rate and burst,
+        others get ``rate`` and ``burst``. A rate of 0 turns the limit off.
+        The buckets of the users are named ``<bucket>:<user_id>``, so
+        limiters with different ``bucket`` names count apart. The backend
+        is created by ``create_backend`` on first use.
+        """
+        self._plan_getter = plan_getter
+        self._backend = backend
+        self.rate = rate
+        self.burst = burst
+        self.plans = parse_plans(plans)
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.bucket = bucket
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = create_backend()
+        return self._backend
+
+    async def check(self, user_id: int):
+        """
+        Takes a token from the bucket of the user and from the global one;
+        raises ``RateLimited`` if either is empty. A rejected request uses
+        up neither: the token of the user is given back if the global
+        bucket is empty.
+        """
+        # Without plan limits the plan is not looked up
+        plan = await self._plan_getter(user_id) if self.plans else None
+        rate, burst = self.plans.get(plan, (self.rate, self.burst))
+        key = f'{self.bucket}:{user_id}'
+        if rate > 0:
+            wait = await self.backend.take(key, rate, burst)
+            if wait:
+                raise RateLimited(wait)
+        if self.global_rate > 0:
+            wait = await self.backend.take(
+                'global', self.global_rate, self.global_burst
+            )
+            if wait:
+                if rate > 0:
+                    await self.backend.give_back(key, rate, burst)
+                raise RateLimited(wait)
+
+    async def aclose(self):
+        if self._backend is not None:
+            await self._backend.aclose()
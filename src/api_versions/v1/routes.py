@@ -1,19 +1,117 @@
 """
 Routes for API version 1.
 """
+import asyncio
+import base64
+import json
 import logging
+import math
+import time
+from contextlib import AsyncExitStack, aclosing, asynccontextmanager
+from datetime import datetime
 from typing import Optional
 
-from fastapi import APIRouter, Response, status, HTTPException
+from fastapi import (
+    APIRouter,
+    Header,
+    HTTPException,
+    Query,
+    Response,
+    WebSocket,
+    WebSocketDisconnect,
+    status,
+)
+from fastapi.responses import StreamingResponse
 from . import crud, models, version_constants
-from src.ai_api.deepseek import DeepSeekAPI
+from .idempotency import IdempotencyStore
+from .memory import MemoryStore
+from .partitions import PartitionMaintainer
+from .quotas import QuotaExceeded, QuotaStore
+from .ratelimit import RateLimited, RateLimiter
+from .scheduler import AICallScheduler, Overloaded
+from .summarizer import SessionSummarizer
+from .writers import MessageWriter, TelemetryWriter
+from src import metrics, tracing
+from src.ai_api import (
+    AIProvider,
+    APIError,
+    CircuitOpen,
+    DeadlineExceeded,
+    create_resilient_provider,
+)
+from src.ai_api.context import estimate_tokens
 
 main_router = APIRouter()
 
-db = crud.DatabaseManager()
-ai_client = DeepSeekAPI()
+db = crud.AsyncDatabaseManager()
+_ai_client: Optional[AIProvider] = None
+
+
+def get_ai_client() -> AIProvider:
+    """
+    The AI provider selected by ``AI_PROVIDER`` with deadlines, retries and
+    a circuit breaker, created on first use, so importing the app does not
+    need any provider credentials.
+    """
+    global _ai_client
+    if _ai_client is None:
+        _ai_client = create_resilient_provider()
+    return _ai_client
+
+
+ai_scheduler = AICallScheduler()
+memory = MemoryStore(db)
+summarizer = SessionSummarizer(
+    db, get_ai_client, scheduler=ai_scheduler, on_summary=memory.add_summary
+)
+message_writer = MessageWriter(db)
+telemetry = TelemetryWriter(db)
+quotas = QuotaStore(db)
+rate_limiter = RateLimiter(quotas.plan)
+# History reads page through long sessions, so they count apart from chat
+history_rate_limiter = RateLimiter(
+    quotas.plan,
+    rate=version_constants.RATE_LIMIT_HISTORY_RATE,
+    burst=version_constants.RATE_LIMIT_HISTORY_BURST,
+    plans='',
+    global_rate=0,
+    bucket='history'
+)
+idempotency = IdempotencyStore(db)
+partition_maintainer = PartitionMaintainer(db)
 logger = logging.getLogger('uvicorn.error')
 
+
+async def startup():
+    """Runs once when the application starts."""
+    get_ai_client()
+    await db.init()
+    summarizer.start()
+    if version_constants.MESSAGE_WRITE_BEHIND:
+        message_writer.start()
+    if version_constants.AI_TELEMETRY:
+        telemetry.start()
+    if version_constants.QUOTA_ENABLED:
+        quotas.start()
+    partition_maintainer.start()
+    idempotency.start()
+
+
+async def shutdown():
+    """Runs once when the application stops."""
+    await partition_maintainer.stop()
+    await idempotency.stop()
+    await summarizer.stop()
+    await message_writer.stop()
+    await telemetry.stop()
+    await quotas.stop()
+    await rate_limiter.aclose()
+    await history_rate_limiter.aclose()
+    if _ai_client is not None:
+        await _ai_client.aclose()
+    await db.dispose()
+
+
 @main_router.get('', include_in_schema=False)
 async def root():
     return {'message': f'NeuroMentor API {version_constants.API_VERSION} active'}
@@ -26,10 +124,12 @@ async def register_user(
         user_data: models.UserCreateRequest
 ):
     try:
-        new_user = db.create_user_from_front(
+        new_user = await db.create_user_from_front(
             name=user_data.name,
             gender=user_data.gender,
-            age=user_data.age
+            age=user_data.age,
+            external_id=user_data.external_id,
+            telegram_id=user_data.telegram_id
         )
         return new_user
     except Exception as e:
@@ -38,68 +138,583 @@ async def register_user(
         return models.Error(error=str(e))
 
 
-@main_router.post('/chat', response_model=models.AIResponse)
-async def chat_with_ai(req: models.ChatRequest):
+@main_router.post(
+    '/users/bulk', response_model=list[models.UserResponse],
+    responses={500: {'model': models.Error}}
+)
+async def register_users_bulk(
+        response: Response,
+        users_data: models.UsersBulkRequest
+):
+    """
+    Registers a batch of users (e.g. an import from Telegram or Android) in
+    a few statements. Users are returned in the request order; users with a
+    known ``external_id``/``telegram_id`` are returned, not duplicated.
+    """
     try:
-        user = db.get_user(req.user_id)
-        if not user:
+        return await db.upsert_users([
+            {
+                "first_name": user_data.name,
+                "gender": user_data.gender,
+                "age": user_data.age,
+                "external_id": user_data.external_id,
+                "telegram_id": user_data.telegram_id,
+            }
+            for user_data in users_data.users
+        ])
+    except Exception as e:
+        logger.error(f"Error creating users: {e}", exc_info=True)
+        response.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+        return models.Error(error=str(e))
+
+
+async def _rate_limit(user_id: int, limiter: RateLimiter = rate_limiter):
+    """Answers 429 if the user or everyone together sends too much."""
+    if not version_constants.RATE_LIMIT_ENABLED:
+        return
+    try:
+        await limiter.check(user_id)
+    except RateLimited as e:
+        raise HTTPException(
+            status_code=429, detail=str(e),
+            headers={"Retry-After": str(math.ceil(e.retry_after))}
+        )
+
+
+async def _prepare_turn(req: models.ChatRequest) -> dict:
+    """
+    Reserves a request of the user quota, resolves the chat session for
+    the request, loads its summary and history and saves the user message.
+    Returns the ``db.prepare_turn`` dict with the reserved ``quota`` and the
+    ``memories`` of earlier sessions added. Runs once the model call is
+    admitted (see ``_ai_slot``), so a shed request leaves nothing behind.
+    """
+    quota = None
+    if quotas.running:
+        try:
+            quota = await quotas.reserve(req.user_id)
+        except QuotaExceeded as e:
+            raise HTTPException(status_code=402, detail=str(e))
+
+    try:
+        # The previous AI answer may still be in the write-behind buffer
+        await message_writer.wait_user(req.user_id)
+
+        try:
+            turn = await db.prepare_turn(
+                req.user_id, req.session_id, req.message,
+                history_limit=version_constants.AI_HISTORY_MAX_MESSAGES,
+                # The history may be shorter than the summarization threshold
+                count_limit=summarizer.every + summarizer.keep_recent
+            )
+        except PermissionError as e:
+            raise HTTPException(status_code=403, detail=str(e))
+        if not turn:
             raise HTTPException(status_code=404, detail="User not found")
+    except BaseException:
+        if quota is not None:
+            quotas.release(req.user_id, quota)
+        raise
 
-        current_session_id = req.session_id
+    turn["quota"] = quota
+    turn["memories"] = await memory.recall(
+        req.user_id, turn["session_id"], req.message
+    )
+    if quota is not None and not turn["history"] and turn["summary"] is None:
+        # First message of the session
+        quotas.record(req.user_id, sessions=1)
+    return turn
 
-        if not current_session_id or current_session_id == 0:
-            current_session_id = db.get_user_last_session(req.user_id)
 
-            if not current_session_id:
-                current_session_id = db.create_new_session(req.user_id)
+async def _finish_turn(req: models.ChatRequest, turn: dict, text: str,
+                       tokens: int):
+    """
+    Saves the AI message (through the write-behind buffer if it is on) and
+    queues the session for summarization. Returns the AI message id, or a
+    future of it if the message is buffered.
+    """
+    if message_writer.running:
+        message_id = await message_writer.submit_message(
+            req.user_id, turn["session_id"], "ai", text, tokens
+        )
+    else:
+        message_id = await db.finish_turn(turn["session_id"], text, tokens)
+    # The unsummarized messages plus the user and AI messages of this turn
+    summarizer.notify(turn["session_id"], turn["unsummarized"] + 2)
+    return message_id
+
+
+@asynccontextmanager
+async def _ai_slot(req: models.ChatRequest):
+    """
+    Holds a place in the model call scheduler, queued by the user plan.
+    Taken before the turn is prepared: answers 503 if the call is not
+    admitted, before any quota is reserved or message saved.
+    """
+    priority = 0
+    # The plan only orders the queue, so it is not looked up for a call
+    # that goes at once
+    if ai_scheduler.full and ai_scheduler.priorities:
+        priority = ai_scheduler.priority(await quotas.plan(req.user_id))
+    try:
+        await ai_scheduler.acquire(priority)
+    except Overloaded as e:
+        raise HTTPException(
+            status_code=503, detail=str(e),
+            headers={"Retry-After": str(math.ceil(e.retry_after))}
+        )
+    try:
+        yield
+    finally:
+        ai_scheduler.release()
+
+
+def _record_ai_call(message_id, ai_client: AIProvider, turn: dict,
+                    req: models.ChatRequest, seconds: float,
+                    response: dict = None, error: Exception = None):
+    """
+    Records one model call of the turn in telemetry, metrics, spans and the
+    quota usage; the request reserved for a failed call is given back.
+    """
+    tracing.record_span("ai", seconds)
+    if turn["quota"] is not None:
+        if error is None:
+            quotas.record(req.user_id, tokens=response["tokens"])
         else:
-            db.get_or_create_session(current_session_id, req.user_id)
+            quotas.release(req.user_id, turn["quota"])
+    telemetry.record(
+        message_id, ai_client, turn, req.message, round(seconds * 1000),
+        response=response, error=error
+    )
+    metrics.observe_ai_call(
+        ai_client.name, seconds,
+        tokens=response["tokens"] if response else None, error=error
+    )
 
-        history = db.get_session_history(current_session_id, limit=10)
 
-        db.save_message(current_session_id, sender="user", text=req.message)
+def _http_error(e: Exception) -> HTTPException:
+    """
+    504 if the model did not answer in time, 503 if it is down or
+    overloaded, 500 otherwise.
+    """
+    if isinstance(e, DeadlineExceeded):
+        return HTTPException(status_code=504, detail=str(e))
+    if isinstance(e, APIError) and e.transient:
+        retry_after = e.retry_after if isinstance(e, CircuitOpen) else 1
+        return HTTPException(
+            status_code=503, detail=str(e),
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+    return HTTPException(status_code=500, detail=str(e))
 
-        user_info = {
-            "name": user.first_name,
-            "age": user.age,
-            "gender": user.gender
-        }
 
-        ai_data = await ai_client.get_chat_response(user_info, history, req.message)
-        ai_text = ai_data["text"]
-        tokens = ai_data["tokens"]
+@main_router.post('/chat', response_model=models.AIResponse)
+async def chat_with_ai(
+        req: models.ChatRequest,
+        idempotency_key: Optional[str] = Header(None, max_length=255)
+):
+    """
+    With an ``Idempotency-Key`` header, retries of the request get the
+    answer of the first one instead of another model call.
+    """
+    if idempotency_key is None:
+        return await _chat(req)
+    return await idempotency.run(
+        req.user_id, idempotency_key, req.model_dump(), lambda: _chat(req)
+    )
 
-        db.save_message(current_session_id, sender="ai", text=ai_text, tokens=tokens)
 
-        print(f"\n[AI LOG] User: {user.first_name} | Msg: {req.message}")
-        print(f"[AI LOG] Response: {ai_text}\n")
+async def _chat(req: models.ChatRequest) -> dict:
+    with metrics.CHATS_IN_FLIGHT.track_inprogress():
+        try:
+            await _rate_limit(req.user_id)
+            ai_client = get_ai_client()
+            async with _ai_slot(req):
+                turn = await _prepare_turn(req)
+                started = time.perf_counter()
+                try:
+                    ai_data = await ai_client.get_chat_response(
+                        turn["user_info"], turn["history"], req.message,
+                        turn["summary"], turn["memories"]
+                    )
+                except Exception as e:
+                    _record_ai_call(
+                        turn["message_id"], ai_client, turn, req,
+                        time.perf_counter() - started, error=e
+                    )
+                    raise
+                seconds = time.perf_counter() - started
+            ai_text = ai_data["text"]
+            tokens = ai_data["tokens"]
 
-        return {"answer": ai_text, "session_id": current_session_id}
+            message_id = await _finish_turn(req, turn, ai_text, tokens)
+            _record_ai_call(
+                message_id, ai_client, turn, req, seconds, response=ai_data
+            )
+            logger.debug(
+                f"Answered user {req.user_id} in session "
+                f"{turn['session_id']}: {tokens} tokens in {seconds:.2f}s"
+            )
 
-    except Exception as e:
-        logger.error(f"Chat error: {e}", exc_info=True)
-        if isinstance(e, HTTPException):
-            raise e
+            return {"answer": ai_text, "session_id": turn["session_id"]}
+
+        except Exception as e:
+            logger.error(f"Chat error: {e}", exc_info=True)
+            if isinstance(e, HTTPException):
+                raise e
+            raise _http_error(e)
+
+
+async def _stream_turn(req: models.ChatRequest, turn: dict):
+    """
+    Forwards model deltas as ``("delta", {...})`` events and saves the AI
+    message once the stream is over, finishing with a ``("done", {...})``
+    event that carries the token usage. The caller holds the ``_ai_slot``
+    and closes the generator (``aclosing``): if the client goes away, the
+    part of the answer it got is saved, with an estimated usage, and the
+    request reserved in the quota is given back.
+    """
+    with metrics.CHATS_IN_FLIGHT.track_inprogress():
+        parts = []
+        tokens = 0
+        ai_client = get_ai_client()
+        started = time.perf_counter()
+        stream = ai_client.stream_chat_response(
+            turn["user_info"], turn["history"], req.message, turn["summary"],
+            turn["memories"]
+        )
+
+        async def finish(complete: bool):
+            nonlocal tokens
+            text = "".join(parts)
+            if not complete:
+                await stream.aclose()
+                if turn["quota"] is not None:
+                    quotas.release(req.user_id, turn["quota"])
+                if not text:
+                    return
+                # The usage comes with the last chunk only
+                prompt = ai_client.build_messages(
+                    turn["user_info"], turn["history"], req.message,
+                    turn["summary"], turn["memories"]
+                )
+                tokens = estimate_tokens(text) + sum(
+                    estimate_tokens(message["content"]) for message in prompt
+                )
+            seconds = time.perf_counter() - started
+            message_id = await _finish_turn(req, turn, text, tokens)
+            _record_ai_call(
+                message_id, ai_client, turn, req, seconds,
+                response={"text": text, "tokens": tokens}
+            )
+
+        try:
+            async for chunk in stream:
+                if chunk["tokens"] is not None:
+                    tokens = chunk["tokens"]
+                if chunk["text"]:
+                    parts.append(chunk["text"])
+                    yield "delta", {"text": chunk["text"]}
+        except Exception as e:
+            _record_ai_call(
+                turn["message_id"], ai_client, turn, req,
+                time.perf_counter() - started, error=e
+            )
+            raise
+        except BaseException:
+            # Closed or cancelled: the client went away
+            await asyncio.shield(finish(complete=False))
+            raise
+        await finish(complete=True)
+        yield "done", {"session_id": turn["session_id"], "tokens": tokens}
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class _TurnStreamingResponse(StreamingResponse):
+    def __init__(self, content, close, **kwargs):
+        """
+        Streams the events of a turn and awaits ``close()`` once the
+        response is over, also if it ended before the body was read.
+        """
+        super().__init__(content, **kwargs)
+        self._close = close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self._close()
+
+
+@main_router.post('/chat/stream', responses={
+    200: {'content': {'text/event-stream': {}}},
+    403: {'model': models.Error},
+    404: {'model': models.Error}
+})
+async def chat_with_ai_stream(req: models.ChatRequest):
+    """
+    Same as ``/chat``, but answers with Server-Sent Events: ``session``
+    first, then a ``delta`` per model token chunk, then ``done`` (or
+    ``error``).
+    """
+    await _rate_limit(req.user_id)
+    # The place is held until the response is over, so a shed request is
+    # answered with a real 503 before any event is sent
+    resources = AsyncExitStack()
+    await resources.enter_async_context(_ai_slot(req))
+    try:
+        turn = await _prepare_turn(req)
+    except BaseException as e:
+        await resources.aclose()
+        if isinstance(e, HTTPException) or not isinstance(e, Exception):
+            raise
+        logger.error(f"Chat stream error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+    async def events():
+        yield _sse("session", {"session_id": turn["session_id"]})
+        try:
+            async with aclosing(_stream_turn(req, turn)) as turn_events:
+                async for event, data in turn_events:
+                    yield _sse(event, data)
+        except Exception as e:
+            logger.error(f"Chat stream error: {e}", exc_info=True)
+            yield _sse("error", {"error": str(e)})
+
+    body = events()
+
+    async def close():
+        await body.aclose()
+        await resources.aclose()
+
+    return _TurnStreamingResponse(
+        body, close,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@main_router.websocket('/chat/ws')
+async def chat_with_ai_ws(websocket: WebSocket):
+    """
+    WebSocket variant of ``/chat/stream``. Every received JSON message is a
+    ``ChatRequest``; the answer is sent back as ``session``, ``delta`` and
+    ``done`` (or ``error``) JSON messages with a ``type`` field.
+    """
+    await websocket.accept()
+    try:
+        while True:
+            payload = await websocket.receive_json()
+            try:
+                req = models.ChatRequest.model_validate(payload)
+                await _rate_limit(req.user_id)
+                async with _ai_slot(req):
+                    turn = await _prepare_turn(req)
+                    await websocket.send_json(
+                        {"type": "session", "session_id": turn["session_id"]}
+                    )
+                    async with aclosing(
+                        _stream_turn(req, turn)
+                    ) as turn_events:
+                        async for event, data in turn_events:
+                            await websocket.send_json(
+                                {"type": event, **data}
+                            )
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                logger.error(f"Chat websocket error: {e}", exc_info=True)
+                error = e.detail if isinstance(e, HTTPException) else str(e)
+                await websocket.send_json({"type": "error", "error": error})
+    except WebSocketDisconnect:
+        pass
+
+
+@main_router.get('/stats/cache', include_in_schema=False)
+async def cache_stats():
+    """Hit/miss counters of the in-process user and session caches."""
+    return db.cache_stats()
+
+
+def _encode_cursor(position: str) -> str:
+    return base64.urlsafe_b64encode(position.encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor: str) -> str:
+    return base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+
+
+def _cursor(message: dict) -> str:
+    """Opaque keyset position of the message: its ``created_at`` and ``id``."""
+    created_at = message["created_at"].isoformat()
+    return _encode_cursor(f'{created_at},{message["id"]}')
+
+
+def _parse_cursor(cursor: Optional[str]) -> Optional[tuple]:
+    if not cursor:
+        return None
+    try:
+        created_at, message_id = _decode_cursor(cursor).rsplit(',', 1)
+        return datetime.fromisoformat(created_at), int(message_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _search_cursor(result: dict) -> str:
+    """
+    Keyset position of a search result: its ``rank``, ``created_at`` and
+    ``id``.
+    """
+    created_at = result["created_at"].isoformat()
+    return _encode_cursor(f'{result["rank"]!r},{created_at},{result["id"]}')
+
+
+def _parse_search_cursor(cursor: Optional[str]) -> Optional[tuple]:
+    if not cursor:
+        return None
+    try:
+        rank, created_at, message_id = _decode_cursor(cursor).split(',')
+        return float(rank), datetime.fromisoformat(created_at), int(message_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def _history_session(user_id: int, session_id: Optional[int],
+                           all_sessions: bool) -> Optional[int]:
+    """
+    Session of the history: ``None`` for all sessions of the user, 0 if the
+    user has no sessions.
+    """
+    if all_sessions:
+        return None
+    if session_id:
+        return session_id
+    return await db.get_user_last_session(user_id) or 0
 
-@main_router.get('/chat/history/{user_id}', response_model=models.HistoryResponse)
-async def get_chat_history(user_id: int, session_id: Optional[int] = None):
+
+@main_router.get(
+    '/chat/history/{user_id}', response_model=models.HistoryResponse
+)
+async def get_chat_history(
+        user_id: int,
+        session_id: Optional[int] = None,
+        all_sessions: bool = False,
+        limit: int = Query(50, ge=1, le=500),
+        after: Optional[str] = None,
+        before: Optional[str] = None
+):
+    """
+    A page of the history of the latest (or ``session_id``) session, or of
+    all sessions of the user, oldest first. Without cursors it is the first
+    page; ``next_cursor`` passed as ``after`` gives the following one and
+    ``prev_cursor`` passed as ``before`` the preceding one.
+    """
+    await _rate_limit(user_id, history_rate_limiter)
+    if after and before:
+        raise HTTPException(
+            status_code=400, detail="Pass either after or before"
+        )
+    after_position = _parse_cursor(after)
+    before_position = _parse_cursor(before)
     try:
-        target_session_id = session_id
-        if not target_session_id or target_session_id == 0:
-            target_session_id = db.get_user_last_session(user_id)
+        target_session_id = await _history_session(
+            user_id, session_id, all_sessions
+        )
 
-        if not target_session_id:
+        if target_session_id == 0:
             return {"session_id": 0, "messages": []}
 
-        messages = db.get_messages_by_session(target_session_id)
+        messages, has_more = await db.get_history_page(
+            user_id, target_session_id, limit, after_position, before_position
+        )
+        if before_position is None:
+            has_next, has_prev = has_more, after_position is not None
+        else:
+            has_next, has_prev = True, has_more
+        has_next = has_next and bool(messages)
+        has_prev = has_prev and bool(messages)
 
         return {
-            "session_id": target_session_id,
-            "messages": messages
+            "session_id": target_session_id or 0,
+            "messages": messages,
+            "next_cursor": _cursor(messages[-1]) if has_next else None,
+            "prev_cursor": _cursor(messages[0]) if has_prev else None,
         }
 
     except Exception as e:
         logger.error(f"Error fetching history: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail="Internal Server Error")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@main_router.get(
+    '/chat/history/{user_id}/search', response_model=models.SearchResponse
+)
+async def search_chat_history(
+        user_id: int,
+        q: str = Query(..., min_length=1, max_length=500),
+        session_id: Optional[int] = None,
+        limit: int = Query(20, ge=1, le=100),
+        after: Optional[str] = None
+):
+    """
+    Messages of all sessions of the user (or of ``session_id``) matching
+    ``q``, most relevant first. ``q`` takes web search syntax: quoted
+    phrases, ``or`` and ``-word``. ``next_cursor`` passed as ``after``
+    gives the next page.
+    """
+    await _rate_limit(user_id, history_rate_limiter)
+    after_position = _parse_search_cursor(after)
+    try:
+        results, has_more = await db.search_messages(
+            user_id, q, limit, session_id, after_position
+        )
+        return {
+            "results": results,
+            "next_cursor": _search_cursor(results[-1]) if has_more else None,
+        }
+
+    except Exception as e:
+        logger.error(f"Error searching history: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@main_router.get('/chat/history/{user_id}/stream', responses={
+    200: {'content': {'application/x-ndjson': {}}}
+})
+async def stream_chat_history(
+        user_id: int,
+        session_id: Optional[int] = None,
+        all_sessions: bool = False,
+        after: Optional[str] = None
+):
+    """
+    The whole history after the ``after`` cursor as NDJSON, one message per
+    line with its ``cursor``, so an interrupted export continues from the
+    last line received. Rows are read from a server-side cursor, so the
+    history may be of any length.
+    """
+    await _rate_limit(user_id, history_rate_limiter)
+    after_position = _parse_cursor(after)
+    target_session_id = await _history_session(
+        user_id, session_id, all_sessions
+    )
+
+    async def lines():
+        if target_session_id == 0:
+            return
+        try:
+            history = db.stream_history(
+                user_id, target_session_id, after_position
+            )
+            async for message in history:
+                message["cursor"] = _cursor(message)
+                message["created_at"] = message["created_at"].isoformat()
+                yield json.dumps(message, ensure_ascii=False) + "\n"
+        except Exception as e:
+            logger.error(f"History stream error: {e}", exc_info=True)
+            raise
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
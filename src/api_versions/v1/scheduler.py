@@ -0,0 +1,159 @@
+"""
+Admission control of model calls for API version 1.
+
+At most ``max_concurrent`` calls go to the provider at once; the excess
+waits in a priority queue ordered by subscription plan, and is rejected
+right away once the queue is full or after waiting too long.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from . import version_constants
+from ... import metrics, tracing
+
+__all__ = [
+    'BACKGROUND_PRIORITY',
+    'AICallScheduler',
+    'Overloaded',
+    'parse_priorities',
+]
+
+# Priority of background work, after every user request
+BACKGROUND_PRIORITY = 100
+
+
+class Overloaded(Exception):
+    def __init__(self, reason: str, retry_after: float = 1):
+        """
+        The call was not admitted; ``reason`` is ``queue_full`` or
+        ``timeout``.
+        """
+        super().__init__(f"AI is overloaded ({reason}), try again later")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def parse_priorities(priorities: str) -> dict:
+    """Parses ``"free=1,premium=0"`` into ``{plan: priority}``."""
+    entries = filter(None, (part.strip() for part in priorities.split(',')))
+    return {
+        entry.split('=')[0].strip(): int(entry.split('=')[1])
+        for entry in entries
+    }
+
+
+class AICallScheduler:
+    def __init__(
+            self,
+            max_concurrent: int = version_constants.AI_MAX_CONCURRENT_CALLS,
+            max_queue: int = version_constants.AI_QUEUE_SIZE,
+            max_wait: float = version_constants.AI_QUEUE_TIMEOUT,
+            priorities: str = version_constants.AI_PLAN_PRIORITIES
+    ):
+        """
+        Lower priority numbers are served first, in arrival order within a
+        priority. ``priorities`` maps plans to priorities; users without a
+        subscription count as the ``free`` plan, and plans not listed get
+        priority 0. A ``max_concurrent`` of 0 admits every call at once.
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.priorities = parse_priorities(priorities)
+        self._active = 0
+        # (priority, arrival number, future) of waiting calls
+        self._waiters = []
+        self._arrivals = itertools.count()
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def full(self) -> bool:
+        """Whether a call would wait in the queue rather than go at once."""
+        return bool(self.max_concurrent) and (
+            self._active >= self.max_concurrent or bool(self._waiters)
+        )
+
+    def priority(self, plan: Optional[str]) -> int:
+        return self.priorities.get(plan or 'free', 0)
+
+    def _admit(self):
+        self._active += 1
+        metrics.AI_CALLS_ACTIVE.inc()
+
+    async def acquire(self, priority: int = 0):
+        """
+        Waits for a free place; raises ``Overloaded`` if the queue is full
+        or the wait is longer than ``max_wait`` seconds.
+        """
+        if not self.max_concurrent:
+            return
+        if not self.full:
+            self._admit()
+            return
+        if len(self._waiters) >= self.max_queue:
+            metrics.AI_CALLS_SHED.labels('queue_full').inc()
+            raise Overloaded('queue_full')
+
+        started = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._arrivals), future))
+        metrics.AI_QUEUE_DEPTH.inc()
+        try:
+            await asyncio.wait_for(future, self.max_wait)
+        except asyncio.TimeoutError:
+            self._forget(future)
+            metrics.AI_CALLS_SHED.labels('timeout').inc()
+            raise Overloaded('timeout')
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Admitted just before the cancellation, pass it on
+                self.release()
+            else:
+                self._forget(future)
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            metrics.AI_QUEUE_WAIT_SECONDS.observe(seconds)
+            tracing.record_span('ai.queue', seconds)
+
+    def _forget(self, future: asyncio.Future):
+        for i, waiter in enumerate(self._waiters):
+            if waiter[2] is future:
+                self._waiters[i] = self._waiters[-1]
+                self._waiters.pop()
+                heapq.heapify(self._waiters)
+                metrics.AI_QUEUE_DEPTH.dec()
+                return
+
+    def release(self):
+        """Frees the place, handing it to the first waiting call."""
+        if not self.max_concurrent:
+            return
+        self._active -= 1
+        metrics.AI_CALLS_ACTIVE.dec()
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            metrics.AI_QUEUE_DEPTH.dec()
+            if not future.done():
+                self._admit()
+                future.set_result(None)
+                return
+
+    @asynccontextmanager
+    async def slot(self, priority: int = 0):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
@@ -4,20 +4,27 @@ SQLAlchemy schemas for API version 1.
 
 from sqlalchemy import (
     Column,
+    Computed,
     Integer,
     BigInteger,
     String,
     Boolean,
     ForeignKey,
+    Index,
     DateTime,
     Text,
     create_engine,
+    inspect,
+    text,
 )
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy.engine import Engine, URL
-from sqlalchemy.exc import OperationalError
-from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.orm import declarative_base, deferred, relationship
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy.sql import func
+import asyncio
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 
@@ -25,19 +32,20 @@ from . import version_constants
 
 __all__ = [
     'User', 'ChatSession', 'Message', 'AIRequest',
-    'Subscription', 'UsageLog', 'Admin',
-    'get_engine'
+    'Subscription', 'UsageLog', 'Admin', 'IdempotencyKey',
+    'SEARCH_CONFIG', 'get_engine', 'get_async_engine', 'init_models',
+    'search_headline', 'search_query'
 ]
 
 Base = declarative_base()
 
-def get_engine() -> Engine:
-    """Get the engine for the database."""
+
+def _get_url(drivername: str) -> URL:
     if not version_constants.POSTGRES_NAME:
         raise ValueError('POSTGRES_NAME is not set')
 
-    url = URL.create(
-        drivername='postgresql+psycopg2',
+    return URL.create(
+        drivername=drivername,
         host=version_constants.POSTGRES_HOST,
         port=version_constants.POSTGRES_PORT,
         username=version_constants.POSTGRES_USER,
@@ -45,22 +53,32 @@ def get_engine() -> Engine:
         database=version_constants.POSTGRES_NAME
     )
 
+
+def _create_database():
+    """Create the database itself, connecting to the maintenance one."""
+    connection = psycopg2.connect(
+        dbname='postgres',
+        user=version_constants.POSTGRES_USER,
+        password=version_constants.POSTGRES_PASSWORD,
+        host=version_constants.POSTGRES_HOST,
+        port=version_constants.POSTGRES_PORT,
+    )
+    connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    cursor = connection.cursor()
+    cursor.execute(f'CREATE DATABASE {version_constants.POSTGRES_NAME};')
+    cursor.close()
+    connection.close()
+
+
+def get_engine() -> Engine:
+    """Get the engine for the database."""
+    url = _get_url('postgresql+psycopg2')
+
     try:
         engine = create_engine(url, echo=False)
         Base.metadata.create_all(engine)
     except OperationalError:
-        connection = psycopg2.connect(
-            dbname='postgres',
-            user=version_constants.POSTGRES_USER,
-            password=version_constants.POSTGRES_PASSWORD,
-            host=version_constants.POSTGRES_HOST,
-            port=version_constants.POSTGRES_PORT,
-        )
-        connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-        cursor = connection.cursor()
-        cursor.execute(f'CREATE DATABASE {version_constants.POSTGRES_NAME};')
-        cursor.close()
-        connection.close()
+        _create_database()
 
         engine = create_engine(url, echo=False)
         Base.metadata.create_all(engine)
@@ -68,11 +86,66 @@ def get_engine() -> Engine:
     return engine
 
 
+def get_async_engine() -> AsyncEngine:
+    """
+    Get the async engine for the database. Nothing is connected here:
+    the pool opens connections lazily, and tables are created by
+    ``init_models``.
+    """
+    return create_async_engine(
+        _get_url('postgresql+asyncpg'),
+        echo=False,
+        pool_size=version_constants.DB_POOL_SIZE,
+        max_overflow=version_constants.DB_MAX_OVERFLOW,
+        pool_timeout=version_constants.DB_POOL_TIMEOUT,
+        pool_recycle=version_constants.DB_POOL_RECYCLE,
+        pool_pre_ping=version_constants.DB_POOL_PRE_PING,
+    )
+
+
+async def init_models(engine: AsyncEngine):
+    """Create the database (if needed) and all tables."""
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(_create_all)
+    except (DBAPIError, OSError):
+        await asyncio.to_thread(_create_database)
+
+        async with engine.begin() as conn:
+            await conn.run_sync(_create_all)
+
+
+def _create_all(connection):
+    """
+    Create all tables, and columns and indexes added to the models after
+    their tables already existed (``create_all`` skips those). Ones marked
+    with ``info={'migration': ...}`` are too heavy for a start and are
+    left to that migration, see partitions.py.
+    """
+    Base.metadata.create_all(connection)
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        existing = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing and 'migration' not in column.info:
+                column_ddl = CreateColumn(column).compile(
+                    dialect=connection.dialect
+                )
+                connection.exec_driver_sql(
+                    f'ALTER TABLE {table.name} ADD COLUMN {column_ddl}'
+                )
+        for index in table.indexes:
+            if 'migration' not in index.info:
+                index.create(connection, checkfirst=True)
+
+
 class User(Base):
     __tablename__ = 'users'
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     telegram_id = Column(BigInteger, unique=True, nullable=True, index=True)
+    # Client-supplied id
+    external_id = Column(String(255), unique=True, nullable=True, index=True)
     username = Column(String(255), nullable=True)
     first_name = Column(String(255), nullable=True) # Mapping "name" from frontend here
     last_name = Column(String(255), nullable=True)
@@ -97,38 +170,114 @@ class ChatSession(Base):
     started_at = Column(DateTime(timezone=True), server_default=func.now())
     ended_at = Column(DateTime(timezone=True), nullable=True)
     is_active = Column(Boolean, default=True)
+    summary = Column(Text, nullable=True)  # Running summary of older messages
+    # Last message in the summary
+    summary_message_id = Column(Integer, nullable=True)
 
     user = relationship("User", back_populates="sessions")
     messages = relationship("Message", back_populates="session", cascade="all, delete-orphan")
 
 
+# Latest session of a user
+Index(
+    'ix_chat_sessions_user_id_id', ChatSession.user_id, ChatSession.id.desc()
+)
+
+
+# Text search configuration of the message search. Besides Russian words it
+# stems English (ASCII) ones with english_stem, so one index serves both
+SEARCH_CONFIG = 'russian'
+
+
 class Message(Base):
     __tablename__ = 'messages'
+    # Monthly partitions, see partitions.py; the partition key is a part of
+    # the primary key, as Postgres requires
+    __table_args__ = {'postgresql_partition_by': 'RANGE (created_at)'}
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     session_id = Column(Integer, ForeignKey('chat_sessions.id'), nullable=False)
     sender = Column(String(50), nullable=False)  # 'user' or 'ai'
     message_text = Column(Text, nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(
+        DateTime(timezone=True), primary_key=True, server_default=func.now()
+    )
     token_usage = Column(Integer, default=0)
+    # Estimated size of message_text
+    token_count = Column(Integer, nullable=True)
+    # Words of message_text for the full-text search, kept up to date by
+    # Postgres; stored, so searches do not parse the texts again. Adding it
+    # rewrites the table: existing databases get it from the
+    # ``migrate-search`` command of partitions.py
+    search_vector = deferred(Column(
+        TSVECTOR,
+        Computed(
+            f"to_tsvector('{SEARCH_CONFIG}'::regconfig, message_text)",
+            persisted=True
+        ),
+        info={'migration': 'migrate-search'}
+    ))
 
     session = relationship("ChatSession", back_populates="messages")
-    ai_request = relationship("AIRequest", back_populates="message", uselist=False)
+    ai_request = relationship(
+        "AIRequest", primaryjoin="foreign(AIRequest.message_id) == Message.id",
+        back_populates="message", uselist=False, viewonly=True
+    )
+
+
+# Latest messages of a session
+Index(
+    'ix_messages_session_id_created_at',
+    Message.session_id, Message.created_at.desc(), Message.id.desc()
+)
+
+
+def search_query(query: str):
+    """``tsquery`` of a search query in web search syntax."""
+    return func.websearch_to_tsquery(
+        text(f"'{SEARCH_CONFIG}'::regconfig"), query
+    )
+
+
+def search_headline(text_column, tsquery):
+    """
+    Fragments of the column around the words matching ``tsquery``, in
+    ``<b>`` tags.
+    """
+    return func.ts_headline(
+        text(f"'{SEARCH_CONFIG}'::regconfig"), text_column, tsquery,
+        'MaxFragments=2, MinWords=5, MaxWords=20'
+    )
+
+
+# Full-text search over the messages
+Index(
+    'ix_messages_search_vector', Message.search_vector,
+    postgresql_using='gin', info={'migration': 'migrate-search'}
+)
 
 
 class AIRequest(Base):
     __tablename__ = 'ai_requests'
+    # Monthly partitions, like messages
+    __table_args__ = {'postgresql_partition_by': 'RANGE (created_at)'}
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    message_id = Column(Integer, ForeignKey('messages.id'), nullable=False)
+    # No foreign key: the id of a partitioned message is not unique by itself
+    message_id = Column(Integer, nullable=False)
     request_payload = Column(JSONB, nullable=True)
     response_payload = Column(JSONB, nullable=True)
     response_time_ms = Column(Integer, nullable=True)
     status_code = Column(Integer, nullable=True)
     error_message = Column(Text, nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(
+        DateTime(timezone=True), primary_key=True, server_default=func.now()
+    )
 
-    message = relationship("Message", back_populates="ai_request")
+    message = relationship(
+        "Message", primaryjoin="foreign(AIRequest.message_id) == Message.id",
+        back_populates="ai_request", viewonly=True
+    )
 
 
 class Subscription(Base):
@@ -147,6 +296,12 @@ class Subscription(Base):
     user = relationship("User", back_populates="subscriptions")
 
 
+# Latest subscription of a user
+Index(
+    'ix_subscriptions_user_id_id', Subscription.user_id, Subscription.id.desc()
+)
+
+
 class UsageLog(Base):
     __tablename__ = 'usage_logs'
 
@@ -160,6 +315,12 @@ class UsageLog(Base):
     user = relationship("User", back_populates="usage_logs")
 
 
+# One row per user and day (``date`` is the start of the UTC day)
+Index(
+    'ux_usage_logs_user_id_date', UsageLog.user_id, UsageLog.date, unique=True
+)
+
+
 class Admin(Base):
     __tablename__ = 'admins'
 
@@ -168,4 +329,20 @@ class Admin(Base):
     role = Column(String(50), default="moderator")  # owner, admin, moderator
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
-    user = relationship("User", back_populates="admin_profile")
\ No newline at end of file
+    user = relationship("User", back_populates="admin_profile")
+
+
+class IdempotencyKey(Base):
+    __tablename__ = 'idempotency_keys'
+
+    # No foreign key, so keys of unknown users fail with 404 like the request
+    user_id = Column(Integer, primary_key=True)
+    key = Column(String(255), primary_key=True)  # "Idempotency-Key" header
+    request_hash = Column(String(64), nullable=False)
+    response = Column(JSONB, nullable=True)  # Set once the request is done
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    completed_at = Column(DateTime(timezone=True), nullable=True)
+
+
+# Expired keys, deleted by IdempotencyStore
+Index('ix_idempotency_keys_created_at', IdempotencyKey.created_at)
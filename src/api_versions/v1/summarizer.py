@@ -0,0 +1,132 @@
+"""
+Background summarization of chat sessions for API version 1.
+
+Older turns of a session are folded into ``ChatSession.summary`` so the
+prompt stays "system prompt + summary + recent turns" however long the
+session grows. All of it runs in background tasks, off the request path.
+"""
+import asyncio
+import logging
+from contextlib import nullcontext
+from typing import Optional
+
+from . import version_constants
+from .scheduler import BACKGROUND_PRIORITY
+
+__all__ = ['SessionSummarizer']
+
+logger = logging.getLogger(version_constants.API_NAME)
+
+
+class SessionSummarizer:
+    def __init__(
+            self,
+            db,
+            ai_client_getter,
+            every: int = version_constants.SUMMARY_EVERY_MESSAGES,
+            keep_recent: int = version_constants.SUMMARY_KEEP_RECENT,
+            max_batch: int = version_constants.SUMMARY_MAX_BATCH,
+            workers: int = version_constants.SUMMARY_WORKERS,
+            scheduler=None,
+            on_summary=None
+    ):
+        """
+        Folds unsummarized messages of a session into its summary once
+        there are ``every`` of them besides the ``keep_recent`` latest ones,
+        which are always sent to the model as they are. At most
+        ``max_batch`` messages are folded per model call, by the provider
+        ``ai_client_getter()`` returns. With a ``scheduler`` the model calls
+        wait for a place behind every user request. ``on_summary(user_id,
+        session_id, summary)`` is called with every summary stored.
+        """
+        self._db = db
+        self._ai_client_getter = ai_client_getter
+        self.every = every
+        self.keep_recent = keep_recent
+        self.max_batch = max_batch
+        self._workers_count = workers
+        self._scheduler = scheduler
+        self._on_summary = on_summary
+        self._queue: Optional[asyncio.Queue] = None
+        self._queued = set()
+        self._workers = []
+
+    @property
+    def enabled(self) -> bool:
+        return self.every > 0
+
+    def start(self):
+        if not self.enabled:
+            return
+        self._queue = asyncio.Queue()
+        self._workers = [
+            asyncio.create_task(self._work())
+            for _ in range(self._workers_count)
+        ]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+        self._queued.clear()
+
+    def notify(self, session_id: int, unsummarized: int):
+        """
+        Called after a turn is saved. ``unsummarized`` is the number of
+        session messages that are not in the summary yet; the session is
+        queued once it reaches the threshold.
+        """
+        if self._queue is None or session_id in self._queued:
+            return
+        if unsummarized < self.every + self.keep_recent:
+            return
+        self._queued.add(session_id)
+        self._queue.put_nowait(session_id)
+
+    async def _work(self):
+        while True:
+            session_id = await self._queue.get()
+            try:
+                more = await self.summarize(session_id)
+            except Exception as e:
+                more = False
+                logger.error(
+                    f"Summarization of session {session_id} failed: {e}",
+                    exc_info=True
+                )
+            finally:
+                self._queued.discard(session_id)
+                self._queue.task_done()
+            if more:
+                self.notify(session_id, self.every + self.keep_recent)
+
+    async def summarize(self, session_id: int) -> bool:
+        """
+        Folds the oldest unsummarized messages of the session into its
+        summary. Returns ``True`` if enough messages are still left for
+        another pass.
+        """
+        state = await self._db.get_unsummarized_messages(
+            session_id, self.keep_recent, self.max_batch
+        )
+        messages = state["messages"]
+        if len(messages) < self.every:
+            return False
+
+        slot = (
+            nullcontext() if self._scheduler is None
+            else self._scheduler.slot(BACKGROUND_PRIORITY)
+        )
+        async with slot:
+            summary = await self._ai_client_getter().summarize(
+                state["summary"], messages
+            )
+        saved = await self._db.save_summary(
+            session_id, summary, messages[-1]["id"]
+        )
+        if saved and self._on_summary is not None:
+            self._on_summary(state["user_id"], session_id, summary)
+        left = state["pending"] - len(messages)
+        return left >= self.every + self.keep_recent
@@ -3,26 +3,124 @@ Constants for corresponding API version.
 """
 
 from ...constants import (
+    AI_HISTORY_MAX_MESSAGES,
+    AI_MAX_CONCURRENT_CALLS,
+    AI_PLAN_PRIORITIES,
+    AI_QUEUE_SIZE,
+    AI_QUEUE_TIMEOUT,
+    AI_TELEMETRY,
+    AI_TELEMETRY_COMPRESS,
+    AI_TELEMETRY_MAX_CHARS,
+    AI_TELEMETRY_QUEUE_SIZE,
     API_NAME,
+    CACHE_MAX_SIZE,
+    CACHE_TTL,
+    DB_MAX_OVERFLOW,
+    DB_POOL_PRE_PING,
+    DB_POOL_RECYCLE,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    IDEMPOTENCY_CLEANUP_INTERVAL,
+    IDEMPOTENCY_TTL,
+    IDEMPOTENCY_WAIT,
     MAIN_API_ADDRESS,
     MAIN_SITE,
+    MEMORY_CACHE_USERS,
+    MEMORY_MAX_ITEMS,
+    MEMORY_MIN_SCORE,
+    MEMORY_TOP_K,
+    MEMORY_TTL,
+    MESSAGE_BATCH_SIZE,
+    MESSAGE_FLUSH_INTERVAL,
+    MESSAGE_QUEUE_SIZE,
+    MESSAGE_WRITE_BEHIND,
+    PARTITION_ARCHIVE_DIR,
+    PARTITION_CHECK_INTERVAL,
+    PARTITION_MONTHS_AHEAD,
+    PARTITION_RETENTION_MONTHS,
     POSTGRES_HOST,
     POSTGRES_NAME,
     POSTGRES_PASSWORD,
     POSTGRES_PORT,
     POSTGRES_USER,
+    QUOTA_DEFAULT_LIMIT,
+    QUOTA_ENABLED,
+    QUOTA_FLUSH_INTERVAL,
+    RATE_LIMIT_BACKEND,
+    RATE_LIMIT_BURST,
+    RATE_LIMIT_ENABLED,
+    RATE_LIMIT_GLOBAL_BURST,
+    RATE_LIMIT_GLOBAL_RATE,
+    RATE_LIMIT_HISTORY_BURST,
+    RATE_LIMIT_HISTORY_RATE,
+    RATE_LIMIT_PLANS,
+    RATE_LIMIT_RATE,
+    RATE_LIMIT_REDIS_URL,
+    SUMMARY_EVERY_MESSAGES,
+    SUMMARY_KEEP_RECENT,
+    SUMMARY_MAX_BATCH,
+    SUMMARY_WORKERS,
 )
 
 __all__ = [
     'API_VERSION',
+    'AI_HISTORY_MAX_MESSAGES',
+    'AI_MAX_CONCURRENT_CALLS',
+    'AI_PLAN_PRIORITIES',
+    'AI_QUEUE_SIZE',
+    'AI_QUEUE_TIMEOUT',
+    'AI_TELEMETRY',
+    'AI_TELEMETRY_COMPRESS',
+    'AI_TELEMETRY_MAX_CHARS',
+    'AI_TELEMETRY_QUEUE_SIZE',
     'API_NAME',
+    'CACHE_MAX_SIZE',
+    'CACHE_TTL',
+    'DB_MAX_OVERFLOW',
+    'DB_POOL_PRE_PING',
+    'DB_POOL_RECYCLE',
+    'DB_POOL_SIZE',
+    'DB_POOL_TIMEOUT',
+    'IDEMPOTENCY_CLEANUP_INTERVAL',
+    'IDEMPOTENCY_TTL',
+    'IDEMPOTENCY_WAIT',
     'MAIN_API_ADDRESS',
     'MAIN_SITE',
+    'MEMORY_CACHE_USERS',
+    'MEMORY_MAX_ITEMS',
+    'MEMORY_MIN_SCORE',
+    'MEMORY_TOP_K',
+    'MEMORY_TTL',
+    'MESSAGE_BATCH_SIZE',
+    'MESSAGE_FLUSH_INTERVAL',
+    'MESSAGE_QUEUE_SIZE',
+    'MESSAGE_WRITE_BEHIND',
+    'PARTITION_ARCHIVE_DIR',
+    'PARTITION_CHECK_INTERVAL',
+    'PARTITION_MONTHS_AHEAD',
+    'PARTITION_RETENTION_MONTHS',
     'POSTGRES_HOST',
     'POSTGRES_NAME',
     'POSTGRES_PASSWORD',
     'POSTGRES_PORT',
     'POSTGRES_USER',
+    'QUOTA_DEFAULT_LIMIT',
+    'QUOTA_ENABLED',
+    'QUOTA_FLUSH_INTERVAL',
+    'RATE_LIMIT_BACKEND',
+    'RATE_LIMIT_BURST',
+    'RATE_LIMIT_ENABLED',
+    'RATE_LIMIT_GLOBAL_BURST',
+    'RATE_LIMIT_GLOBAL_RATE',
+    'RATE_LIMIT_HISTORY_BURST',
+    'RATE_LIMIT_HISTORY_RATE',
+    'RATE_LIMIT_PLANS',
+    'RATE_LIMIT_RATE',
+    'RATE_LIMIT_REDIS_URL',
+    'SUMMARY_EVERY_MESSAGES',
+    'SUMMARY_KEEP_RECENT',
+    'SUMMARY_MAX_BATCH',
+    'SUMMARY_WORKERS',
 ]
 
 API_VERSION = 1
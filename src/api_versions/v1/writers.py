@@ -0,0 +1,297 @@
+"""
+Write-behind buffers for API version 1.
+
+Rows are queued in process and written in batches by one background task,
+either when a batch is full or when the flush interval is over, so a burst
+of writes costs one statement and one commit instead of one per row.
+"""
+import asyncio
+import base64
+import json
+import logging
+import zlib
+from typing import Any, Awaitable, Callable, Optional, Union
+
+from . import version_constants
+
+__all__ = ['BatchWriter', 'MessageWriter', 'TelemetryWriter']
+
+logger = logging.getLogger(version_constants.API_NAME)
+
+
+class BatchWriter:
+    def __init__(
+            self,
+            flush: Callable[[list], Awaitable[list]],
+            batch_size: int = 100,
+            flush_interval: float = 0.05,
+            max_queue: int = 10000,
+            name: str = 'batch writer'
+    ):
+        """
+        ``flush`` writes a list of queued items and returns one result per
+        item, in the same order. Items are flushed in the order they were
+        submitted.
+        """
+        self._flush = flush
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.name = name
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._work())
+
+    async def stop(self):
+        """Flushes everything still queued and stops the writer."""
+        if not self.running:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        self._queue = None
+
+    async def submit(self, item) -> asyncio.Future:
+        """
+        Queues ``item`` (waiting while the queue is full) and returns a
+        future with its flush result.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return future
+
+    def submit_nowait(self, item) -> asyncio.Future:
+        """
+        Same as ``submit``, but raises ``asyncio.QueueFull`` instead of
+        waiting for a free place in the queue.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, future))
+        return future
+
+    async def _work(self):
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = asyncio.get_running_loop().time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - asyncio.get_running_loop().time()
+                try:
+                    entry = (
+                        self._queue.get_nowait() if timeout <= 0
+                        else await asyncio.wait_for(self._queue.get(), timeout)
+                    )
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+                if entry is None:
+                    stopping = True
+                    break
+                batch.append(entry)
+            await self._write(batch)
+
+    async def _write(self, batch: list):
+        try:
+            results = await self._flush([item for item, _ in batch])
+        except Exception as e:
+            logger.error(
+                f"{self.name} failed to flush {len(batch)} items: {e}",
+                exc_info=True
+            )
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+                    # Already logged above, even if nobody awaits it
+                    future.exception()
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+class MessageWriter(BatchWriter):
+    def __init__(
+            self,
+            db,
+            batch_size: int = version_constants.MESSAGE_BATCH_SIZE,
+            flush_interval: float = version_constants.MESSAGE_FLUSH_INTERVAL,
+            max_queue: int = version_constants.MESSAGE_QUEUE_SIZE
+    ):
+        """
+        Write-behind buffer for chat messages, flushed with multi-row
+        inserts. Messages are written in submit order, and ``wait_user``
+        lets the next turn of a user start only after the previous one is
+        written, so the history order stays the order of the turns.
+        """
+        super().__init__(
+            db.save_messages, batch_size, flush_interval, max_queue,
+            name='Message writer'
+        )
+        self._pending_by_user = {}
+
+    async def submit_message(self, user_id: int, session_id: int,
+                             sender: str, text: str,
+                             tokens: int = 0) -> asyncio.Future:
+        """Queues a message; the returned future resolves to its id."""
+        future = await self.submit({
+            "session_id": session_id,
+            "sender": sender,
+            "message_text": text,
+            "token_usage": tokens,
+        })
+        pending = self._pending_by_user.setdefault(user_id, set())
+        pending.add(future)
+        future.add_done_callback(lambda f: self._forget(user_id, f))
+        return future
+
+    def _forget(self, user_id: int, future: asyncio.Future):
+        pending = self._pending_by_user.get(user_id)
+        if pending is None:
+            return
+        pending.discard(future)
+        if not pending:
+            del self._pending_by_user[user_id]
+
+    async def wait_user(self, user_id: int):
+        """Waits until every queued message of the user is written."""
+        pending = self._pending_by_user.get(user_id)
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+def _truncate(value: Any, max_chars: int) -> Any:
+    """Cuts every string in ``value`` down to ``max_chars`` characters."""
+    if isinstance(value, str):
+        if len(value) > max_chars:
+            return value[:max_chars] + f"... [{len(value) - max_chars} more]"
+        return value
+    if isinstance(value, dict):
+        return {key: _truncate(item, max_chars) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_truncate(item, max_chars) for item in value]
+    return value
+
+
+def _compress(value: Any) -> dict:
+    data = zlib.compress(json.dumps(value, ensure_ascii=False).encode('utf-8'))
+    return {
+        "encoding": "zlib+base64",
+        "data": base64.b64encode(data).decode('ascii')
+    }
+
+
+class TelemetryWriter(BatchWriter):
+    def __init__(
+            self,
+            db,
+            max_chars: int = version_constants.AI_TELEMETRY_MAX_CHARS,
+            compress: bool = version_constants.AI_TELEMETRY_COMPRESS,
+            batch_size: int = version_constants.MESSAGE_BATCH_SIZE,
+            flush_interval: float = version_constants.MESSAGE_FLUSH_INTERVAL,
+            max_queue: int = version_constants.AI_TELEMETRY_QUEUE_SIZE
+    ):
+        """
+        Background writer of ``AIRequest`` rows, one per model call. Recording
+        never waits: the prompt and the payloads are built when the batch is
+        flushed, and calls that find the queue full are counted in
+        ``dropped`` instead of being recorded. Strings in the payloads are cut
+        to ``max_chars`` characters (0 keeps them whole), and with
+        ``compress`` each payload is stored zlib-compressed.
+        """
+        super().__init__(
+            self._save, batch_size, flush_interval, max_queue,
+            name='Telemetry writer'
+        )
+        self.db = db
+        self.max_chars = max_chars
+        self.compress = compress
+        self.dropped = 0
+
+    def record(
+            self,
+            message_id: Union[int, asyncio.Future],
+            ai_client,
+            turn: dict,
+            user_message: str,
+            response_time_ms: int,
+            response: dict = None,
+            error: Exception = None
+    ):
+        """
+        Queues the telemetry of one model call of a ``prepare_turn`` turn.
+        ``message_id`` is the AI message the call produced (or a future of
+        its id from the message writer), or the user message if it failed.
+        """
+        if not self.running:
+            return
+        try:
+            self.submit_nowait({
+                "message_id": message_id,
+                "ai_client": ai_client,
+                "turn": turn,
+                "user_message": user_message,
+                "response_time_ms": response_time_ms,
+                "response": response,
+                "error": error,
+            })
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def _payload(self, value: Any) -> Any:
+        if self.max_chars:
+            value = _truncate(value, self.max_chars)
+        return _compress(value) if self.compress else value
+
+    def _row(self, item: dict, message_id: int) -> dict:
+        ai_client, turn, error = item["ai_client"], item["turn"], item["error"]
+        request = {
+            "provider": ai_client.name,
+            "model": getattr(ai_client, "model", None),
+            "messages": ai_client.build_messages(
+                turn["user_info"], turn["history"], item["user_message"],
+                turn["summary"], turn.get("memories")
+            ),
+        }
+        if error is None:
+            status_code = 200
+        else:
+            status_code = getattr(error, "status_code", None) or 500
+        return {
+            "message_id": message_id,
+            "request_payload": self._payload(request),
+            "response_payload": (
+                None if item["response"] is None
+                else self._payload(item["response"])
+            ),
+            "response_time_ms": item["response_time_ms"],
+            "status_code": status_code,
+            "error_message": None if error is None else str(error),
+        }
+
+    async def _save(self, items: list) -> list:
+        rows = []
+        for item in items:
+            message_id = item["message_id"]
+            if isinstance(message_id, asyncio.Future):
+                try:
+                    message_id = await message_id
+                except Exception:
+                    # The message was not written, nothing to attach it to
+                    continue
+            rows.append(self._row(item, message_id))
+        if rows:
+            await self.db.save_ai_requests(rows)
+        return [None] * len(items)
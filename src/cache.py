@@ -0,0 +1,73 @@
+"""
+This module contains a small in-process cache with TTL and LRU eviction.
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable
+
+__all__ = ['TTLCache']
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, maxsize: int = 10000, ttl: float = 60):
+        """
+        Keeps at most ``maxsize`` entries, each for at most ``ttl`` seconds;
+        the least recently used entry is evicted first. Not thread-safe, it is
+        meant to be used from one event loop.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: OrderedDict = OrderedDict()
+
+    def __repr__(self):
+        return (f'TTLCache(maxsize={self.maxsize}, ttl={self.ttl}, '
+                f'size={len(self)})')
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key: Hashable):
+        return self.get(key, _MISSING, count=False) is not _MISSING
+
+    def get(self, key: Hashable, default: Any = None, count: bool = True):
+        entry = self._data.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                if count:
+                    self.hits += 1
+                return value
+            del self._data[key]
+        if count:
+            self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: float = None):
+        self._data[key] = (
+            time.monotonic() + (self.ttl if ttl is None else ttl), value
+        )
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'size': len(self),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
@@ -63,6 +63,112 @@ class MainConfigurator:
             'postgres_user': os.getenv('POSTGRES_USER', 'postgres'),
             'postgres_password': os.getenv('POSTGRES_PASSWORD', 'postgres'),
             'postgres_name': os.getenv('POSTGRES_NAME', 'postgres'),
+            'ai_max_connections': int(os.getenv('AI_MAX_CONNECTIONS', '200')),
+            'ai_max_keepalive_connections':
+                int(os.getenv('AI_MAX_KEEPALIVE_CONNECTIONS', '50')),
+            'ai_keepalive_expiry':
+                float(os.getenv('AI_KEEPALIVE_EXPIRY', '30')),
+            'ai_timeout': float(os.getenv('AI_TIMEOUT', '60')),
+            'ai_connect_timeout': float(os.getenv('AI_CONNECT_TIMEOUT', '5')),
+            'db_pool_size': int(os.getenv('DB_POOL_SIZE', '10')),
+            'db_max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '20')),
+            'db_pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', '30')),
+            'db_pool_recycle': int(os.getenv('DB_POOL_RECYCLE', '1800')),
+            'db_pool_pre_ping': bool(int(os.getenv('DB_POOL_PRE_PING', '1'))),
+            'ai_context_token_budget':
+                int(os.getenv('AI_CONTEXT_TOKEN_BUDGET', '3000')),
+            'ai_history_max_messages':
+                int(os.getenv('AI_HISTORY_MAX_MESSAGES', '50')),
+            'summary_every_messages':
+                int(os.getenv('SUMMARY_EVERY_MESSAGES', '10')),
+            'summary_keep_recent': int(os.getenv('SUMMARY_KEEP_RECENT', '10')),
+            'summary_max_batch': int(os.getenv('SUMMARY_MAX_BATCH', '40')),
+            'summary_workers': int(os.getenv('SUMMARY_WORKERS', '2')),
+            'message_write_behind':
+                bool(int(os.getenv('MESSAGE_WRITE_BEHIND', '0'))),
+            'message_batch_size': int(os.getenv('MESSAGE_BATCH_SIZE', '100')),
+            'message_flush_interval':
+                float(os.getenv('MESSAGE_FLUSH_INTERVAL', '0.05')),
+            'message_queue_size':
+                int(os.getenv('MESSAGE_QUEUE_SIZE', '10000')),
+            'cache_max_size': int(os.getenv('CACHE_MAX_SIZE', '10000')),
+            'cache_ttl': float(os.getenv('CACHE_TTL', '60')),
+            'ai_provider': os.getenv('AI_PROVIDER', 'deepseek'),
+            'ai_model': os.getenv('AI_MODEL', ''),
+            'ai_base_url': os.getenv('AI_BASE_URL', ''),
+            'ai_api_key': os.getenv('AI_API_KEY', ''),
+            'ai_stub_latency': float(os.getenv('AI_STUB_LATENCY', '0.5')),
+            'ai_stub_token_delay':
+                float(os.getenv('AI_STUB_TOKEN_DELAY', '0.01')),
+            'ai_stub_tokens': int(os.getenv('AI_STUB_TOKENS', '50')),
+            'ai_stub_error_rate': float(os.getenv('AI_STUB_ERROR_RATE', '0')),
+            'ai_stub_seed': int(os.getenv('AI_STUB_SEED', '0')),
+            'ai_telemetry': bool(int(os.getenv('AI_TELEMETRY', '1'))),
+            'ai_telemetry_max_chars':
+                int(os.getenv('AI_TELEMETRY_MAX_CHARS', '4000')),
+            'ai_telemetry_compress':
+                bool(int(os.getenv('AI_TELEMETRY_COMPRESS', '0'))),
+            'ai_telemetry_queue_size':
+                int(os.getenv('AI_TELEMETRY_QUEUE_SIZE', '10000')),
+            'server_timing': bool(int(os.getenv('SERVER_TIMING', '1'))),
+            'trace_log': bool(int(os.getenv('TRACE_LOG', '0'))),
+            'profile_header': bool(int(os.getenv('PROFILE_HEADER', '0'))),
+            'profile_sample_rate':
+                float(os.getenv('PROFILE_SAMPLE_RATE', '0')),
+            'profile_interval': float(os.getenv('PROFILE_INTERVAL', '0.005')),
+            'profile_slow_ms': float(os.getenv('PROFILE_SLOW_MS', '1000')),
+            'profile_dir': os.getenv('PROFILE_DIR', 'profiles'),
+            'quota_enabled': bool(int(os.getenv('QUOTA_ENABLED', '1'))),
+            'quota_default_limit': int(os.getenv('QUOTA_DEFAULT_LIMIT', '0')),
+            'quota_flush_interval':
+                float(os.getenv('QUOTA_FLUSH_INTERVAL', '5')),
+            'rate_limit_enabled':
+                bool(int(os.getenv('RATE_LIMIT_ENABLED', '1'))),
+            'rate_limit_rate': float(os.getenv('RATE_LIMIT_RATE', '1')),
+            'rate_limit_burst': int(os.getenv('RATE_LIMIT_BURST', '10')),
+            'rate_limit_plans': os.getenv('RATE_LIMIT_PLANS', ''),
+            'rate_limit_global_rate':
+                float(os.getenv('RATE_LIMIT_GLOBAL_RATE', '200')),
+            'rate_limit_global_burst':
+                int(os.getenv('RATE_LIMIT_GLOBAL_BURST', '400')),
+            'rate_limit_history_rate':
+                float(os.getenv('RATE_LIMIT_HISTORY_RATE', '5')),
+            'rate_limit_history_burst':
+                int(os.getenv('RATE_LIMIT_HISTORY_BURST', '50')),
+            'rate_limit_backend': os.getenv('RATE_LIMIT_BACKEND', 'local'),
+            'rate_limit_redis_url':
+                os.getenv('RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0'),
+            'ai_max_concurrent_calls':
+                int(os.getenv('AI_MAX_CONCURRENT_CALLS', '50')),
+            'ai_queue_size': int(os.getenv('AI_QUEUE_SIZE', '200')),
+            'ai_queue_timeout': float(os.getenv('AI_QUEUE_TIMEOUT', '10')),
+            'ai_plan_priorities': os.getenv('AI_PLAN_PRIORITIES', 'free=1'),
+            'idempotency_ttl': float(os.getenv('IDEMPOTENCY_TTL', '86400')),
+            'idempotency_wait': float(os.getenv('IDEMPOTENCY_WAIT', '90')),
+            'idempotency_cleanup_interval':
+                float(os.getenv('IDEMPOTENCY_CLEANUP_INTERVAL', '3600')),
+            'ai_deadline': float(os.getenv('AI_DEADLINE', '30')),
+            'ai_retries': int(os.getenv('AI_RETRIES', '2')),
+            'ai_retry_delay': float(os.getenv('AI_RETRY_DELAY', '0.25')),
+            'ai_retry_max_delay': float(os.getenv('AI_RETRY_MAX_DELAY', '2')),
+            'ai_hedge_percentile':
+                float(os.getenv('AI_HEDGE_PERCENTILE', '0')),
+            'ai_breaker_failures': int(os.getenv('AI_BREAKER_FAILURES', '5')),
+            'ai_breaker_reset': float(os.getenv('AI_BREAKER_RESET', '30')),
+            'ai_fallback_provider': os.getenv('AI_FALLBACK_PROVIDER', ''),
+            'partition_months_ahead':
+                int(os.getenv('PARTITION_MONTHS_AHEAD', '3')),
+            'partition_check_interval':
+                float(os.getenv('PARTITION_CHECK_INTERVAL', '3600')),
+            'partition_retention_months':
+                int(os.getenv('PARTITION_RETENTION_MONTHS', '0')),
+            'partition_archive_dir':
+                os.getenv('PARTITION_ARCHIVE_DIR', 'archive'),
+            'memory_top_k': int(os.getenv('MEMORY_TOP_K', '3')),
+            'memory_min_score': float(os.getenv('MEMORY_MIN_SCORE', '0.15')),
+            'memory_max_items': int(os.getenv('MEMORY_MAX_ITEMS', '500')),
+            'memory_cache_users': int(os.getenv('MEMORY_CACHE_USERS', '500')),
+            'memory_ttl': float(os.getenv('MEMORY_TTL', '600')),
         }
         if not self.cfg['main_api_address'].startswith('/'):
             self.cfg['main_api_address'] = f'/{self.cfg["main_api_address"]}'
@@ -177,3 +283,319 @@ class MainConfigurator:
     @property
     def postgres_name(self):
         return self.config['postgres_name']
+
+    @property
+    def ai_max_connections(self):
+        return self.config['ai_max_connections']
+
+    @property
+    def ai_max_keepalive_connections(self):
+        return self.config['ai_max_keepalive_connections']
+
+    @property
+    def ai_keepalive_expiry(self):
+        return self.config['ai_keepalive_expiry']
+
+    @property
+    def ai_timeout(self):
+        return self.config['ai_timeout']
+
+    @property
+    def ai_connect_timeout(self):
+        return self.config['ai_connect_timeout']
+
+    @property
+    def db_pool_size(self):
+        return self.config['db_pool_size']
+
+    @property
+    def db_max_overflow(self):
+        return self.config['db_max_overflow']
+
+    @property
+    def db_pool_timeout(self):
+        return self.config['db_pool_timeout']
+
+    @property
+    def db_pool_recycle(self):
+        return self.config['db_pool_recycle']
+
+    @property
+    def db_pool_pre_ping(self):
+        return self.config['db_pool_pre_ping']
+
+    @property
+    def ai_context_token_budget(self):
+        return self.config['ai_context_token_budget']
+
+    @property
+    def ai_history_max_messages(self):
+        return self.config['ai_history_max_messages']
+
+    @property
+    def summary_every_messages(self):
+        return self.config['summary_every_messages']
+
+    @property
+    def summary_keep_recent(self):
+        return self.config['summary_keep_recent']
+
+    @property
+    def summary_max_batch(self):
+        return self.config['summary_max_batch']
+
+    @property
+    def summary_workers(self):
+        return self.config['summary_workers']
+
+    @property
+    def message_write_behind(self):
+        return self.config['message_write_behind']
+
+    @property
+    def message_batch_size(self):
+        return self.config['message_batch_size']
+
+    @property
+    def message_flush_interval(self):
+        return self.config['message_flush_interval']
+
+    @property
+    def message_queue_size(self):
+        return self.config['message_queue_size']
+
+    @property
+    def cache_max_size(self):
+        return self.config['cache_max_size']
+
+    @property
+    def cache_ttl(self):
+        return self.config['cache_ttl']
+
+    @property
+    def ai_provider(self):
+        return self.config['ai_provider']
+
+    @property
+    def ai_model(self):
+        return self.config['ai_model']
+
+    @property
+    def ai_base_url(self):
+        return self.config['ai_base_url']
+
+    @property
+    def ai_api_key(self):
+        return self.config['ai_api_key']
+
+    @property
+    def ai_stub_latency(self):
+        return self.config['ai_stub_latency']
+
+    @property
+    def ai_stub_token_delay(self):
+        return self.config['ai_stub_token_delay']
+
+    @property
+    def ai_stub_tokens(self):
+        return self.config['ai_stub_tokens']
+
+    @property
+    def ai_stub_error_rate(self):
+        return self.config['ai_stub_error_rate']
+
+    @property
+    def ai_stub_seed(self):
+        return self.config['ai_stub_seed']
+
+    @property
+    def ai_telemetry(self):
+        return self.config['ai_telemetry']
+
+    @property
+    def ai_telemetry_max_chars(self):
+        return self.config['ai_telemetry_max_chars']
+
+    @property
+    def ai_telemetry_compress(self):
+        return self.config['ai_telemetry_compress']
+
+    @property
+    def ai_telemetry_queue_size(self):
+        return self.config['ai_telemetry_queue_size']
+
+    @property
+    def server_timing(self):
+        return self.config['server_timing']
+
+    @property
+    def trace_log(self):
+        return self.config['trace_log']
+
+    @property
+    def profile_header(self):
+        return self.config['profile_header']
+
+    @property
+    def profile_sample_rate(self):
+        return self.config['profile_sample_rate']
+
+    @property
+    def profile_interval(self):
+        return self.config['profile_interval']
+
+    @property
+    def profile_slow_ms(self):
+        return self.config['profile_slow_ms']
+
+    @property
+    def profile_dir(self):
+        return self.config['profile_dir']
+
+    @property
+    def quota_enabled(self):
+        return self.config['quota_enabled']
+
+    @property
+    def quota_default_limit(self):
+        return self.config['quota_default_limit']
+
+    @property
+    def quota_flush_interval(self):
+        return self.config['quota_flush_interval']
+
+    @property
+    def rate_limit_enabled(self):
+        return self.config['rate_limit_enabled']
+
+    @property
+    def rate_limit_rate(self):
+        return self.config['rate_limit_rate']
+
+    @property
+    def rate_limit_burst(self):
+        return self.config['rate_limit_burst']
+
+    @property
+    def rate_limit_plans(self):
+        return self.config['rate_limit_plans']
+
+    @property
+    def rate_limit_global_rate(self):
+        return self.config['rate_limit_global_rate']
+
+    @property
+    def rate_limit_global_burst(self):
+        return self.config['rate_limit_global_burst']
+
+    @property
+    def rate_limit_history_rate(self):
+        return self.config['rate_limit_history_rate']
+
+    @property
+    def rate_limit_history_burst(self):
+        return self.config['rate_limit_history_burst']
+
+    @property
+    def rate_limit_backend(self):
+        return self.config['rate_limit_backend']
+
+    @property
+    def rate_limit_redis_url(self):
+        return self.config['rate_limit_redis_url']
+
+    @property
+    def ai_max_concurrent_calls(self):
+        return self.config['ai_max_concurrent_calls']
+
+    @property
+    def ai_queue_size(self):
+        return self.config['ai_queue_size']
+
+    @property
+    def ai_queue_timeout(self):
+        return self.config['ai_queue_timeout']
+
+    @property
+    def ai_plan_priorities(self):
+        return self.config['ai_plan_priorities']
+
+    @property
+    def idempotency_ttl(self):
+        return self.config['idempotency_ttl']
+
+    @property
+    def idempotency_wait(self):
+        return self.config['idempotency_wait']
+
+    @property
+    def idempotency_cleanup_interval(self):
+        return self.config['idempotency_cleanup_interval']
+
+    @property
+    def ai_deadline(self):
+        return self.config['ai_deadline']
+
+    @property
+    def ai_retries(self):
+        return self.config['ai_retries']
+
+    @property
+    def ai_retry_delay(self):
+        return self.config['ai_retry_delay']
+
+    @property
+    def ai_retry_max_delay(self):
+        return self.config['ai_retry_max_delay']
+
+    @property
+    def ai_hedge_percentile(self):
+        return self.config['ai_hedge_percentile']
+
+    @property
+    def ai_breaker_failures(self):
+        return self.config['ai_breaker_failures']
+
+    @property
+    def ai_breaker_reset(self):
+        return self.config['ai_breaker_reset']
+
+    @property
+    def ai_fallback_provider(self):
+        return self.config['ai_fallback_provider']
+
+    @property
+    def partition_months_ahead(self):
+        return self.config['partition_months_ahead']
+
+    @property
+    def partition_check_interval(self):
+        return self.config['partition_check_interval']
+
+    @property
+    def partition_retention_months(self):
+        return self.config['partition_retention_months']
+
+    @property
+    def partition_archive_dir(self):
+        return self.config['partition_archive_dir']
+
+    @property
+    def memory_top_k(self):
+        return self.config['memory_top_k']
+
+    @property
+    def memory_min_score(self):
+        return self.config['memory_min_score']
+
+    @property
+    def memory_max_items(self):
+        return self.config['memory_max_items']
+
+    @property
+    def memory_cache_users(self):
+        return self.config['memory_cache_users']
+
+    @property
+    def memory_ttl(self):
+        return self.config['memory_ttl']
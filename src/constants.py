@@ -5,14 +5,93 @@ Base constants for all API version.
 from .configurator import MainConfigurator
 
 __all__ = [
+    'AI_API_KEY',
+    'AI_BASE_URL',
+    'AI_BREAKER_FAILURES',
+    'AI_BREAKER_RESET',
+    'AI_CONNECT_TIMEOUT',
+    'AI_CONTEXT_TOKEN_BUDGET',
+    'AI_DEADLINE',
+    'AI_FALLBACK_PROVIDER',
+    'AI_HEDGE_PERCENTILE',
+    'AI_HISTORY_MAX_MESSAGES',
+    'AI_KEEPALIVE_EXPIRY',
+    'AI_MAX_CONCURRENT_CALLS',
+    'AI_MAX_CONNECTIONS',
+    'AI_MAX_KEEPALIVE_CONNECTIONS',
+    'AI_MODEL',
+    'AI_PLAN_PRIORITIES',
+    'AI_PROVIDER',
+    'AI_QUEUE_SIZE',
+    'AI_QUEUE_TIMEOUT',
+    'AI_RETRIES',
+    'AI_RETRY_DELAY',
+    'AI_RETRY_MAX_DELAY',
+    'AI_STUB_ERROR_RATE',
+    'AI_STUB_LATENCY',
+    'AI_STUB_SEED',
+    'AI_STUB_TOKENS',
+    'AI_STUB_TOKEN_DELAY',
+    'AI_TELEMETRY',
+    'AI_TELEMETRY_COMPRESS',
+    'AI_TELEMETRY_MAX_CHARS',
+    'AI_TELEMETRY_QUEUE_SIZE',
+    'AI_TIMEOUT',
     'API_NAME',
+    'CACHE_MAX_SIZE',
+    'CACHE_TTL',
+    'DB_MAX_OVERFLOW',
+    'DB_POOL_PRE_PING',
+    'DB_POOL_RECYCLE',
+    'DB_POOL_SIZE',
+    'DB_POOL_TIMEOUT',
+    'IDEMPOTENCY_CLEANUP_INTERVAL',
+    'IDEMPOTENCY_TTL',
+    'IDEMPOTENCY_WAIT',
     'MAIN_API_ADDRESS',
     'MAIN_SITE',
+    'MEMORY_CACHE_USERS',
+    'MEMORY_MAX_ITEMS',
+    'MEMORY_MIN_SCORE',
+    'MEMORY_TOP_K',
+    'MEMORY_TTL',
+    'MESSAGE_BATCH_SIZE',
+    'MESSAGE_FLUSH_INTERVAL',
+    'MESSAGE_QUEUE_SIZE',
+    'MESSAGE_WRITE_BEHIND',
+    'PARTITION_ARCHIVE_DIR',
+    'PARTITION_CHECK_INTERVAL',
+    'PARTITION_MONTHS_AHEAD',
+    'PARTITION_RETENTION_MONTHS',
     'POSTGRES_HOST',
     'POSTGRES_NAME',
     'POSTGRES_PASSWORD',
     'POSTGRES_PORT',
     'POSTGRES_USER',
+    'PROFILE_DIR',
+    'PROFILE_HEADER',
+    'PROFILE_INTERVAL',
+    'PROFILE_SAMPLE_RATE',
+    'PROFILE_SLOW_MS',
+    'QUOTA_DEFAULT_LIMIT',
+    'QUOTA_ENABLED',
+    'QUOTA_FLUSH_INTERVAL',
+    'RATE_LIMIT_BACKEND',
+    'RATE_LIMIT_BURST',
+    'RATE_LIMIT_ENABLED',
+    'RATE_LIMIT_GLOBAL_BURST',
+    'RATE_LIMIT_GLOBAL_RATE',
+    'RATE_LIMIT_HISTORY_BURST',
+    'RATE_LIMIT_HISTORY_RATE',
+    'RATE_LIMIT_PLANS',
+    'RATE_LIMIT_RATE',
+    'RATE_LIMIT_REDIS_URL',
+    'SERVER_TIMING',
+    'SUMMARY_EVERY_MESSAGES',
+    'SUMMARY_KEEP_RECENT',
+    'SUMMARY_MAX_BATCH',
+    'SUMMARY_WORKERS',
+    'TRACE_LOG',
 ]
 
 config = MainConfigurator()
@@ -26,3 +105,98 @@ POSTGRES_NAME = config.postgres_name
 POSTGRES_PASSWORD = config.postgres_password
 POSTGRES_PORT = config.postgres_port
 POSTGRES_USER = config.postgres_user
+
+AI_MAX_CONNECTIONS = config.ai_max_connections
+AI_MAX_KEEPALIVE_CONNECTIONS = config.ai_max_keepalive_connections
+AI_KEEPALIVE_EXPIRY = config.ai_keepalive_expiry
+AI_TIMEOUT = config.ai_timeout
+AI_CONNECT_TIMEOUT = config.ai_connect_timeout
+
+DB_POOL_SIZE = config.db_pool_size
+DB_MAX_OVERFLOW = config.db_max_overflow
+DB_POOL_TIMEOUT = config.db_pool_timeout
+DB_POOL_RECYCLE = config.db_pool_recycle
+DB_POOL_PRE_PING = config.db_pool_pre_ping
+
+AI_CONTEXT_TOKEN_BUDGET = config.ai_context_token_budget
+AI_HISTORY_MAX_MESSAGES = config.ai_history_max_messages
+
+SUMMARY_EVERY_MESSAGES = config.summary_every_messages
+SUMMARY_KEEP_RECENT = config.summary_keep_recent
+SUMMARY_MAX_BATCH = config.summary_max_batch
+SUMMARY_WORKERS = config.summary_workers
+
+MESSAGE_WRITE_BEHIND = config.message_write_behind
+MESSAGE_BATCH_SIZE = config.message_batch_size
+MESSAGE_FLUSH_INTERVAL = config.message_flush_interval
+MESSAGE_QUEUE_SIZE = config.message_queue_size
+
+CACHE_MAX_SIZE = config.cache_max_size
+CACHE_TTL = config.cache_ttl
+
+AI_PROVIDER = config.ai_provider
+AI_MODEL = config.ai_model
+AI_BASE_URL = config.ai_base_url
+AI_API_KEY = config.ai_api_key
+AI_STUB_LATENCY = config.ai_stub_latency
+AI_STUB_TOKEN_DELAY = config.ai_stub_token_delay
+AI_STUB_TOKENS = config.ai_stub_tokens
+AI_STUB_ERROR_RATE = config.ai_stub_error_rate
+AI_STUB_SEED = config.ai_stub_seed
+
+AI_TELEMETRY = config.ai_telemetry
+AI_TELEMETRY_MAX_CHARS = config.ai_telemetry_max_chars
+AI_TELEMETRY_COMPRESS = config.ai_telemetry_compress
+AI_TELEMETRY_QUEUE_SIZE = config.ai_telemetry_queue_size
+
+SERVER_TIMING = config.server_timing
+TRACE_LOG = config.trace_log
+PROFILE_HEADER = config.profile_header
+PROFILE_SAMPLE_RATE = config.profile_sample_rate
+PROFILE_INTERVAL = config.profile_interval
+PROFILE_SLOW_MS = config.profile_slow_ms
+PROFILE_DIR = config.profile_dir
+
+QUOTA_ENABLED = config.quota_enabled
+QUOTA_DEFAULT_LIMIT = config.quota_default_limit
+QUOTA_FLUSH_INTERVAL = config.quota_flush_interval
+
+RATE_LIMIT_ENABLED = config.rate_limit_enabled
+RATE_LIMIT_RATE = config.rate_limit_rate
+RATE_LIMIT_BURST = config.rate_limit_burst
+RATE_LIMIT_PLANS = config.rate_limit_plans
+RATE_LIMIT_GLOBAL_RATE = config.rate_limit_global_rate
+RATE_LIMIT_GLOBAL_BURST = config.rate_limit_global_burst
+RATE_LIMIT_HISTORY_RATE = config.rate_limit_history_rate
+RATE_LIMIT_HISTORY_BURST = config.rate_limit_history_burst
+RATE_LIMIT_BACKEND = config.rate_limit_backend
+RATE_LIMIT_REDIS_URL = config.rate_limit_redis_url
+
+AI_MAX_CONCURRENT_CALLS = config.ai_max_concurrent_calls
+AI_QUEUE_SIZE = config.ai_queue_size
+AI_QUEUE_TIMEOUT = config.ai_queue_timeout
+AI_PLAN_PRIORITIES = config.ai_plan_priorities
+
+IDEMPOTENCY_TTL = config.idempotency_ttl
+IDEMPOTENCY_CLEANUP_INTERVAL = config.idempotency_cleanup_interval
+IDEMPOTENCY_WAIT = config.idempotency_wait
+
+AI_DEADLINE = config.ai_deadline
+AI_RETRIES = config.ai_retries
+AI_RETRY_DELAY = config.ai_retry_delay
+AI_RETRY_MAX_DELAY = config.ai_retry_max_delay
+AI_HEDGE_PERCENTILE = config.ai_hedge_percentile
+AI_BREAKER_FAILURES = config.ai_breaker_failures
+AI_BREAKER_RESET = config.ai_breaker_reset
+AI_FALLBACK_PROVIDER = config.ai_fallback_provider
+
+PARTITION_MONTHS_AHEAD = config.partition_months_ahead
+PARTITION_CHECK_INTERVAL = config.partition_check_interval
+PARTITION_RETENTION_MONTHS = config.partition_retention_months
+PARTITION_ARCHIVE_DIR = config.partition_archive_dir
+
+MEMORY_TOP_K = config.memory_top_k
+MEMORY_MIN_SCORE = config.memory_min_score
+MEMORY_MAX_ITEMS = config.memory_max_items
+MEMORY_CACHE_USERS = config.memory_cache_users
+MEMORY_TTL = config.memory_ttl
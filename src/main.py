@@ -3,7 +3,9 @@ Main starting point for the API
 """
 
 # Main imports
-from fastapi import FastAPI, Request
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request, Response
 from fastapi.openapi.docs import (
     get_redoc_html,
     get_swagger_ui_html,
@@ -14,12 +16,25 @@ from fastapi.staticfiles import StaticFiles
 # Imports from project
 from . import API_LATEST, API_VERSIONS
 from .constants import config
+from .metrics import CONTENT_TYPE_LATEST, MetricsMiddleware, render
+from .tracing import TimingMiddleware
 
 # Main app constants
 DESCRIPTION = (f'This is the {config.api_name} API.\n\n'
                f'You can check the docs at {config.main_api_address}/docs '
                f'and {config.main_api_address}/redoc.{config.main_site}')
 
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """Starts and stops shared resources of every API version"""
+    for api_version in API_VERSIONS:
+        await api_version.startup()
+    yield
+    for api_version in API_VERSIONS:
+        await api_version.shutdown()
+
+
 # App (API) init
 app = FastAPI(
     title=f'{config.api_name} API',
@@ -28,6 +43,7 @@ app = FastAPI(
     openapi_url=f'{config.main_api_address}/openapi.json',
     docs_url=None,
     redoc_url=None,
+    lifespan=lifespan,
     swagger_ui_oauth2_redirect_url=f'{config.main_api_address}'
                                    f'/docs/oauth2-redirect'
 )
@@ -37,6 +53,10 @@ app.mount(
     app=StaticFiles(directory=config.static_dir),
     name='static'
 )
+# Request latency histograms for "/metrics"
+app.add_middleware(MetricsMiddleware)
+# "Server-Timing" header, trace records and profiling of slow requests
+app.add_middleware(TimingMiddleware)
 
 
 # Base route
@@ -47,6 +67,12 @@ async def root(request: Request):
             f'Check {request.url}{config.main_api_address[1:]} for more info.'}
 
 
+# Prometheus metrics of this process (or of all workers, see "metrics")
+@app.get('/metrics', include_in_schema=False)
+async def metrics():
+    return Response(render(), media_type=CONTENT_TYPE_LATEST)
+
+
 # Swagger route reconfig for using local files
 @app.get(app.swagger_ui_oauth2_redirect_url, include_in_schema=False)
 async def custom_oauth2():
@@ -0,0 +1,242 @@
+"""
+This module contains the Prometheus metrics of the API and the middleware
+measuring request latency.
+
+With several worker processes set the ``PROMETHEUS_MULTIPROC_DIR``
+environment variable to an empty directory shared by the workers (and
+clean it on every deploy): each worker then writes its samples there, and
+``/metrics`` of any worker reports all of them.
+"""
+import functools
+import inspect
+import os
+import time
+from typing import Callable
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+
+from .constants import config
+from .tracing import record_span
+
+__all__ = [
+    'AI_BREAKER_OPEN',
+    'AI_CALLS_ACTIVE',
+    'AI_CALLS_SHED',
+    'AI_CALL_ATTEMPTS',
+    'AI_CALL_ERRORS',
+    'AI_CALL_SECONDS',
+    'AI_CALL_TOKENS',
+    'AI_QUEUE_DEPTH',
+    'AI_QUEUE_WAIT_SECONDS',
+    'CHATS_IN_FLIGHT',
+    'CONTENT_TYPE_LATEST',
+    'DB_POOL_CHECKED_OUT',
+    'DB_POOL_MAX',
+    'DB_QUERY_SECONDS',
+    'REQUEST_SECONDS',
+    'MetricsMiddleware',
+    'instrument_db',
+    'observe_ai_call',
+    'observe_pool',
+    'render',
+]
+
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds',
+    'Time to send the whole response, per route and API version',
+    ['method', 'route', 'api_version', 'status'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+)
+AI_CALL_SECONDS = Histogram(
+    'ai_call_duration_seconds',
+    'Duration of model calls',
+    ['provider', 'outcome'],
+    buckets=(.1, .25, .5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+)
+AI_CALL_TOKENS = Histogram(
+    'ai_call_tokens',
+    'Tokens used per successful model call',
+    ['provider'],
+    buckets=(100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+)
+AI_CALL_ERRORS = Counter(
+    'ai_call_errors',
+    'Failed model calls',
+    ['provider', 'status']
+)
+AI_CALL_ATTEMPTS = Counter(
+    'ai_call_extra_attempts',
+    'Model requests beyond the first one of a call, by kind: retry, hedge '
+    'or fallback',
+    ['provider', 'kind']
+)
+AI_BREAKER_OPEN = Gauge(
+    'ai_breaker_open',
+    'Whether the circuit breaker of the provider is open',
+    ['provider'],
+    multiprocess_mode='livemax'
+)
+AI_CALLS_ACTIVE = Gauge(
+    'ai_calls_active',
+    'Model calls admitted by the scheduler and running',
+    multiprocess_mode='livesum'
+)
+AI_QUEUE_DEPTH = Gauge(
+    'ai_queue_depth',
+    'Model calls waiting in the scheduler queue',
+    multiprocess_mode='livesum'
+)
+AI_QUEUE_WAIT_SECONDS = Histogram(
+    'ai_queue_wait_seconds',
+    'Time model calls waited in the scheduler queue',
+    buckets=(.01, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+)
+AI_CALLS_SHED = Counter(
+    'ai_calls_shed',
+    'Model calls rejected by the scheduler',
+    ['reason']
+)
+DB_QUERY_SECONDS = Histogram(
+    'db_method_duration_seconds',
+    'Duration of database manager methods',
+    ['method'],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    'db_pool_checked_out_connections',
+    'Database connections currently in use',
+    multiprocess_mode='livesum'
+)
+DB_POOL_MAX = Gauge(
+    'db_pool_max_connections',
+    'Database connections the pools may open, overflow included',
+    multiprocess_mode='livesum'
+)
+CHATS_IN_FLIGHT = Gauge(
+    'chats_in_flight',
+    'Chat turns being answered right now',
+    multiprocess_mode='livesum'
+)
+
+
+def render() -> bytes:
+    """Renders every metric in the Prometheus text format."""
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+
+def _api_version(path: str) -> str:
+    """``v1`` or ``latest`` for routes of these prefixes, else ``default``."""
+    if not path.startswith(config.main_api_address):
+        return 'default'
+    version = path[len(config.main_api_address):].lstrip('/').split('/')[0]
+    if version == 'latest' or (
+            version.startswith('v') and version[1:].isdigit()):
+        return version
+    return 'default'
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        """
+        ASGI middleware observing ``REQUEST_SECONDS`` for every HTTP request.
+        Routes are labelled by their path template within the API version,
+        so ``/api/v1/chat/history/1`` and ``/api/v1/chat/history/2`` are one
+        ``/chat/history/{user_id}`` series of ``v1``; streamed responses are
+        measured until their last chunk is sent.
+        """
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = getattr(scope.get('route'), 'path', None)
+            if route is None:
+                route = api_version = 'unmatched'
+            else:
+                api_version = _api_version(scope['path'])
+            REQUEST_SECONDS.labels(
+                scope['method'], route, api_version, str(status)
+            ).observe(time.perf_counter() - started)
+
+
+def observe_ai_call(provider: str, seconds: float, tokens: int = None,
+                    error: Exception = None):
+    """Observes one model call; ``error`` is the exception it failed with."""
+    if error is None:
+        AI_CALL_SECONDS.labels(provider, 'ok').observe(seconds)
+        if tokens:
+            AI_CALL_TOKENS.labels(provider).observe(tokens)
+    else:
+        AI_CALL_SECONDS.labels(provider, 'error').observe(seconds)
+        AI_CALL_ERRORS.labels(
+            provider, str(getattr(error, 'status_code', None) or 'none')
+        ).inc()
+
+
+def _timed(name: str, func: Callable) -> Callable:
+    histogram = DB_QUERY_SECONDS.labels(f'{name}.{func.__name__}')
+    span_name = f'db.{func.__name__}'
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - started
+            histogram.observe(seconds)
+            record_span(span_name, seconds)
+    return wrapper
+
+
+def instrument_db(cls: type) -> type:
+    """
+    Class decorator timing every public coroutine method of a database
+    manager in ``DB_QUERY_SECONDS``, labelled ``<class>.<method>``, and as a
+    ``db.<method>`` span of the request.
+    """
+    for name, func in list(vars(cls).items()):
+        if name.startswith('_') or not inspect.iscoroutinefunction(func):
+            continue
+        setattr(cls, name, _timed(cls.__name__, func))
+    return cls
+
+
+def observe_pool(pool: Pool, max_connections: int):
+    """
+    Counts connections of ``pool`` in ``DB_POOL_CHECKED_OUT`` on every
+    checkout and checkin, instead of reading the pool at scrape time, so it
+    also works with several worker processes. Saturation is its ratio to
+    ``DB_POOL_MAX``.
+    """
+    DB_POOL_MAX.inc(max_connections)
+    event.listen(pool, 'checkout', lambda *_: DB_POOL_CHECKED_OUT.inc())
+    event.listen(pool, 'checkin', lambda *_: DB_POOL_CHECKED_OUT.dec())
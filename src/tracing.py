@@ -0,0 +1,239 @@
+"""
+This module contains per-request timing spans, the middleware reporting
+them in the ``Server-Timing`` header and an opt-in sampling profiler for
+slow requests.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from .constants import (
+    API_NAME,
+    PROFILE_DIR,
+    PROFILE_HEADER,
+    PROFILE_INTERVAL,
+    PROFILE_SAMPLE_RATE,
+    PROFILE_SLOW_MS,
+    SERVER_TIMING,
+    TRACE_LOG,
+)
+
+__all__ = [
+    'StackSampler',
+    'TimingMiddleware',
+    'record_span',
+    'span',
+]
+
+logger = logging.getLogger(API_NAME)
+
+# Spans of the current request as (name, seconds), None outside of requests
+_spans: ContextVar[Optional[list]] = ContextVar('spans', default=None)
+
+
+def record_span(name: str, seconds: float):
+    """Adds a finished span to the current request, if there is one."""
+    spans = _spans.get()
+    if spans is not None:
+        spans.append((name, seconds))
+
+
+@contextmanager
+def span(name: str):
+    """Times the ``with`` block as a span of the current request."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started)
+
+
+def _server_timing(spans: list, total: float) -> str:
+    """Sums spans of the same name, keeping the order they first ended in."""
+    durations, counts = {}, Counter()
+    for name, seconds in spans:
+        durations[name] = durations.get(name, 0) + seconds
+        counts[name] += 1
+    entries = [
+        f'{name};dur={seconds * 1000:.1f}'
+        + (f';desc="x{counts[name]}"' if counts[name] > 1 else '')
+        for name, seconds in durations.items()
+    ]
+    entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
+
+
+class StackSampler:
+    def __init__(self, task: asyncio.Task, interval: float = PROFILE_INTERVAL):
+        """
+        Samples the stack of one request ``task`` every ``interval``
+        seconds from a separate thread. While the task runs, the sample is
+        the Python stack of the event loop thread; while it waits, it is the
+        chain of coroutines it awaits in. Both are collected as folded
+        stacks, ready for flame graph tools.
+        """
+        self.task = task
+        self.interval = interval
+        self.samples = Counter()
+        self._loop = task.get_loop()
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    @staticmethod
+    def _fold(frames: list) -> str:
+        return ';'.join(
+            f'{os.path.basename(f.f_code.co_filename)}:{f.f_code.co_name}'
+            for f in frames
+        )
+
+    def _sample(self) -> Optional[str]:
+        if asyncio.current_task(self._loop) is self.task:
+            frame = sys._current_frames().get(self._thread_id)
+            frames = []
+            while frame is not None:
+                frames.append(frame)
+                frame = frame.f_back
+            return 'running;' + self._fold(frames[::-1])
+        if self.task.done():
+            return None
+        frames = []
+        awaitable = self.task.get_coro()
+        while awaitable is not None:
+            frame = getattr(awaitable, 'cr_frame', None) \
+                or getattr(awaitable, 'ag_frame', None)
+            if frame is None:
+                break
+            frames.append(frame)
+            awaitable = getattr(awaitable, 'cr_await', None) \
+                or getattr(awaitable, 'ag_await', None)
+        return 'waiting;' + self._fold(frames)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                stack = self._sample()
+            except (RuntimeError, ValueError):
+                # The task switched coroutines while it was being walked
+                continue
+            if stack:
+                self.samples[stack] += 1
+
+    def dump(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class TimingMiddleware:
+    def __init__(
+            self,
+            app,
+            server_timing: bool = SERVER_TIMING,
+            trace_log: bool = TRACE_LOG,
+            profile_header: bool = PROFILE_HEADER,
+            profile_sample_rate: float = PROFILE_SAMPLE_RATE,
+            profile_slow_ms: float = PROFILE_SLOW_MS,
+            profile_dir: str = PROFILE_DIR
+    ):
+        """
+        ASGI middleware collecting the ``span`` timings of every HTTP
+        request. They are sent in the ``Server-Timing`` header (spans that
+        end after the response has started, like those of a stream, are not)
+        and, with ``trace_log``, logged as one JSON record per request.
+
+        A request is profiled with ``StackSampler`` if it has an
+        ``X-Profile: 1`` header and ``profile_header`` is on, or else with
+        ``profile_sample_rate`` probability; profiles of requests slower
+        than ``profile_slow_ms`` are written to ``profile_dir``.
+        """
+        self.app = app
+        self.server_timing = server_timing
+        self.trace_log = trace_log
+        self.profile_header = profile_header
+        self.profile_sample_rate = profile_sample_rate
+        self.profile_slow_ms = profile_slow_ms
+        self.profile_dir = profile_dir
+
+    def _should_profile(self, scope) -> bool:
+        if self.profile_header and (b'x-profile', b'1') in scope['headers']:
+            return True
+        return random.random() < self.profile_sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        spans = []
+        token = _spans.set(spans)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                if self.server_timing:
+                    header = _server_timing(
+                        spans, time.perf_counter() - started
+                    )
+                    message['headers'] = [
+                        *message.get('headers', []),
+                        (b'server-timing', header.encode('latin-1')),
+                    ]
+            await send(message)
+
+        sampler = None
+        if self._should_profile(scope):
+            sampler = StackSampler(asyncio.current_task())
+            sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _spans.reset(token)
+            total = time.perf_counter() - started
+            if sampler is not None:
+                await asyncio.to_thread(sampler.stop)
+                if total * 1000 >= self.profile_slow_ms:
+                    self._dump(scope, sampler, total)
+            if self.trace_log:
+                logger.info(json.dumps({
+                    'trace': scope['path'],
+                    'method': scope['method'],
+                    'status': status,
+                    'total_ms': round(total * 1000, 1),
+                    'spans': [
+                        [name, round(seconds * 1000, 1)]
+                        for name, seconds in spans
+                    ],
+                }))
+
+    def _dump(self, scope, sampler: StackSampler, total: float):
+        name = '{}-{}-{}ms.folded'.format(
+            time.strftime('%Y%m%d-%H%M%S'),
+            scope['path'].strip('/').replace('/', '_') or 'root',
+            round(total * 1000)
+        )
+        path = os.path.join(self.profile_dir, name)
+        sampler.dump(path)
+        logger.warning(
+            f"Slow request {scope['method']} {scope['path']} took "
+            f"{total * 1000:.0f} ms, profile saved to {path}"
+        )
@@ -0,0 +1,28 @@
+import asyncio
+
+import psycopg2
+import pytest
+from sqlalchemy.exc import DBAPIError
+
+from src.api_versions.v1.crud import AsyncDatabaseManager
+
+
+@pytest.fixture
+def postgres():
+    """
+    Runs ``test(db)`` against the configured Postgres with a fresh
+    ``AsyncDatabaseManager``; skips the test if there is no database.
+    """
+    def run(test):
+        async def main():
+            db = AsyncDatabaseManager()
+            try:
+                try:
+                    await db.init()
+                except (OSError, DBAPIError, psycopg2.OperationalError) as e:
+                    pytest.skip(f"Postgres is not available: {e}")
+                return await test(db)
+            finally:
+                await db.dispose()
+        return asyncio.run(main())
+    return run
@@ -0,0 +1,141 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from src.ai_api import (
+    APIError,
+    CircuitOpen,
+    DeadlineExceeded,
+    OpenAICompatibleAPI,
+    ResilientProvider,
+    StubAPI,
+    create_provider,
+)
+from src.ai_api.context import (
+    MESSAGE_OVERHEAD_TOKENS,
+    build_context,
+    estimate_tokens,
+)
+
+user_info = {'name': 'Test', 'age': 30, 'gender': 'male'}
+
+
+def test_estimate_tokens():
+    assert estimate_tokens('') == 0
+    assert estimate_tokens('Hello, world!') > 0
+    assert estimate_tokens('слово ' * 100) > estimate_tokens('слово ' * 10)
+
+
+def test_build_context_keeps_newest_messages():
+    history = [
+        {'role': 'user', 'content': f'message {i}', 'tokens': 10}
+        for i in range(10)
+    ]
+    context = build_context(history, 3 * (10 + MESSAGE_OVERHEAD_TOKENS))
+    assert [msg['content'] for msg in context] == [
+        'message 7', 'message 8', 'message 9'
+    ]
+    assert all('tokens' not in msg for msg in context)
+
+
+def test_create_provider():
+    assert isinstance(create_provider('stub'), StubAPI)
+    with pytest.raises(APIError):
+        create_provider('unknown')
+
+
+def test_only_unreachable_or_failing_providers_are_transient():
+    provider = OpenAICompatibleAPI(api_key='key')
+    request = httpx.Request('POST', 'https://ai.test/v1/chat/completions')
+
+    def status_error(status):
+        response = httpx.Response(status, request=request)
+        return openai.APIStatusError('error', response=response, body=None)
+
+    unreachable = openai.APIConnectionError(request=request)
+    assert provider._error(unreachable).transient
+    assert provider._error(openai.APITimeoutError(request)).transient
+    assert provider._error(status_error(503)).transient
+    assert not provider._error(status_error(400)).transient
+    assert not provider._error(ValueError('bad chunk')).transient
+
+
+def test_stub_provider_is_deterministic():
+    stub = StubAPI(latency=0, token_delay=0, tokens=5)
+    first = asyncio.run(stub.get_chat_response(user_info, [], 'hi'))
+    second = asyncio.run(stub.get_chat_response(user_info, [], 'hi'))
+    assert first == second
+    assert len(first['text'].split()) == 5
+
+
+def test_stub_provider_streams_usage_last():
+    stub = StubAPI(latency=0, token_delay=0, tokens=3)
+
+    async def collect():
+        return [chunk async for chunk in stub.stream_chat_response(
+            user_info, [], 'hi'
+        )]
+
+    chunks = asyncio.run(collect())
+    assert len(chunks) == 4
+    assert all(chunk['tokens'] is None for chunk in chunks[:-1])
+    assert chunks[-1]['tokens'] > 0
+
+
+def test_stub_provider_errors():
+    stub = StubAPI(latency=0, token_delay=0, error_rate=1)
+    with pytest.raises(APIError):
+        asyncio.run(stub.get_chat_response(user_info, [], 'hi'))
+
+
+def test_resilient_provider_retries_and_opens_the_breaker():
+    flaky = StubAPI(latency=0, token_delay=0, error_rate=1)
+    provider = ResilientProvider(
+        flaky, retries=2, retry_delay=0, breaker_failures=3
+    )
+    with pytest.raises(APIError):
+        asyncio.run(provider.get_chat_response(user_info, [], 'hi'))
+    with pytest.raises(CircuitOpen):
+        asyncio.run(provider.get_chat_response(user_info, [], 'hi'))
+
+    fallback = StubAPI(latency=0, token_delay=0)
+    provider.fallback = fallback
+    answer = asyncio.run(provider.get_chat_response(user_info, [], 'hi'))
+    expected = asyncio.run(fallback.get_chat_response(user_info, [], 'hi'))
+    assert answer == expected
+
+
+def test_resilient_provider_deadline_and_hedging():
+    slow = StubAPI(latency=1, token_delay=0)
+    with pytest.raises(DeadlineExceeded):
+        provider = ResilientProvider(slow, deadline=0.05)
+        asyncio.run(provider.get_chat_response(user_info, [], 'hi'))
+
+    provider = ResilientProvider(slow, deadline=0.5, hedge_percentile=50)
+    provider._latencies.extend([0.01] * 20)
+
+    async def hedged():
+        call = asyncio.ensure_future(
+            provider.get_chat_response(user_info, [], 'hi')
+        )
+        await asyncio.sleep(0)
+        # Only the hedge request is fast enough for the deadline
+        slow.latency = 0
+        return await call
+
+    assert asyncio.run(hedged())['text']
+
+
+def test_failed_hedged_call_counts_once():
+    failing = StubAPI(latency=0.05, token_delay=0, error_rate=1)
+    provider = ResilientProvider(
+        failing, retries=0, hedge_percentile=50, breaker_failures=2
+    )
+    provider._latencies.extend([0.01] * 20)
+    with pytest.raises(APIError):
+        asyncio.run(provider.get_chat_response(user_info, [], 'hi'))
+    # The first request and its hedge both failed, for one call
+    assert provider.breaker._failed == 1
+    assert provider.breaker.closed
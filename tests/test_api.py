@@ -1,6 +1,13 @@
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
 
 from src import app
+from src.api_versions.v1.routes import (
+    _cursor, _parse_cursor, _parse_search_cursor, _search_cursor
+)
 from src.configurator import MainConfigurator
 
 config = MainConfigurator()
@@ -80,3 +87,22 @@ def test_openapi_json_redirect():
 #     )
 #     assert response.status_code == 400
 #     assert response.json()['error'] == 'End of weather queries'
+
+
+def test_history_cursor_round_trip():
+    created_at = datetime(2025, 1, 2, 3, 4, 5, 678901, tzinfo=timezone.utc)
+    cursor = _cursor({"created_at": created_at, "id": 42})
+    assert _parse_cursor(cursor) == (created_at, 42)
+    with pytest.raises(HTTPException):
+        _parse_cursor('bad')
+
+
+def test_search_cursor_round_trip():
+    created_at = datetime(2025, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    # A float4 rank widened to a Python float
+    rank = 0.0607927106320858
+    cursor = _search_cursor({"rank": rank, "created_at": created_at, "id": 7})
+    assert _parse_search_cursor(cursor) == (rank, created_at, 7)
+    cursor = _search_cursor({"rank": 1.0, "created_at": created_at, "id": 7})
+    with pytest.raises(HTTPException):
+        _parse_search_cursor(cursor[:-2])
@@ -0,0 +1,189 @@
+import asyncio
+import json
+
+import psycopg2
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import DBAPIError
+
+from src import app
+from src.ai_api import StubAPI
+from src.api_versions.v1 import routes
+from src.configurator import MainConfigurator
+
+address = f'{MainConfigurator().main_api_address}/v1'
+
+stub = StubAPI(latency=0, token_delay=0.005, tokens=20)
+
+
+@pytest.fixture(scope='module')
+def client():
+    """
+    The app started against the configured Postgres with the stub model;
+    skips the tests if there is no database.
+    """
+    ai_client = routes._ai_client
+    routes._ai_client = stub
+    test_client = TestClient(app)
+    try:
+        try:
+            test_client.__enter__()
+        except (OSError, DBAPIError, psycopg2.OperationalError) as e:
+            pytest.skip(f"Postgres is not available: {e}")
+        yield test_client
+        test_client.__exit__(None, None, None)
+    finally:
+        routes._ai_client = ai_client
+
+
+def _user(client) -> int:
+    users = client.portal.call(routes.db.upsert_users, [{"first_name": "a"}])
+    return users[0].id
+
+
+def _ai_messages(client, session_id: int) -> list:
+    history = client.portal.call(
+        routes.db.get_messages_by_session, session_id, 100
+    )
+    return [message for message in history if message.sender == "ai"]
+
+
+def _events(body: str) -> list:
+    events = []
+    for frame in body.strip().split('\n\n'):
+        event, data = frame.split('\n')
+        events.append((
+            event.removeprefix('event: '),
+            json.loads(data.removeprefix('data: '))
+        ))
+    return events
+
+
+def test_sse_frames_come_in_order(client):
+    message = 'Мне тревожно'
+    response = client.post(f'{address}/chat/stream', json={
+        "user_id": _user(client), "session_id": 0, "message": message
+    })
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/event-stream')
+    events = _events(response.text)
+    names = [event for event, _ in events]
+    assert names == ['session'] + ['delta'] * stub.tokens + ['done']
+    text = ''.join(data["text"] for event, data in events if event == 'delta')
+    assert text == ''.join(stub._answer(message))
+    assert events[-1][1]["session_id"] == events[0][1]["session_id"]
+
+
+def test_ai_message_is_saved_once_with_the_usage(client):
+    message = 'Плохо сплю'
+    response = client.post(f'{address}/chat/stream', json={
+        "user_id": _user(client), "session_id": 0, "message": message
+    })
+    events = _events(response.text)
+    done = events[-1][1]
+    ai_message, = _ai_messages(client, done["session_id"])
+    assert ai_message.message_text == ''.join(stub._answer(message))
+    # The count of the last chunk, not an estimate
+    assert ai_message.token_usage == done["tokens"] > 0
+
+
+def test_websocket_answers_every_message(client):
+    user_id = _user(client)
+    turns = []
+    with client.websocket_connect(f'{address}/chat/ws') as websocket:
+        session_id = 0
+        for message in ('Привет', 'Как дела?'):
+            websocket.send_json({
+                "user_id": user_id, "session_id": session_id,
+                "message": message
+            })
+            events = [websocket.receive_json()]
+            while events[-1]["type"] not in ('done', 'error'):
+                events.append(websocket.receive_json())
+            session_id = events[0]["session_id"]
+            turns.append(events)
+        websocket.send_json({"user_id": user_id})
+        error = websocket.receive_json()
+
+    for message, events in zip(('Привет', 'Как дела?'), turns):
+        types = [event["type"] for event in events]
+        assert types == ['session'] + ['delta'] * stub.tokens + ['done']
+        text = ''.join(event.get("text", '') for event in events[1:-1])
+        assert text == ''.join(stub._answer(message))
+    assert turns[0][0]["session_id"] == turns[1][0]["session_id"]
+    assert error["type"] == 'error'
+    assert len(_ai_messages(client, session_id)) == 2
+
+
+def test_disconnect_saves_the_partial_answer(client):
+    user_id = _user(client)
+    message = 'Расскажи подробнее'
+    path = f'{address}/chat/stream'
+    sent = []
+
+    async def stream():
+        body = json.dumps({
+            "user_id": user_id, "session_id": 0, "message": message
+        }).encode()
+        got_delta = asyncio.Event()
+        requested = False
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {
+                    'type': 'http.request', 'body': body, 'more_body': False
+                }
+            # The client goes away after the first delta
+            await got_delta.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(event):
+            if event['type'] == 'http.response.body' and event['body']:
+                sent.append(event['body'].decode())
+                if 'event: delta' in sent[-1]:
+                    got_delta.set()
+
+        await app({
+            'type': 'http', 'asgi': {'version': '3.0'},
+            'http_version': '1.1', 'method': 'POST', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': b'',
+            'root_path': '', 'client': ('testclient', 50000),
+            'server': ('testserver', 80),
+            'headers': [(b'content-type', b'application/json')],
+        }, receive, send)
+
+        session_id = _events(sent[0])[0][1]["session_id"]
+        # The answer is saved in a shielded task
+        for _ in range(100):
+            history = await routes.db.get_messages_by_session(session_id, 100)
+            saved = [message for message in history if message.sender == "ai"]
+            if saved:
+                return saved
+            await asyncio.sleep(0.02)
+        return []
+
+    ai_message, = client.portal.call(stream)
+    answer = ''.join(stub._answer(message))
+    assert not any('event: done' in frame for frame in sent)
+    assert answer.startswith(ai_message.message_text)
+    assert 0 < len(ai_message.message_text) < len(answer)
+    assert ai_message.token_usage > 0
+    # The cut-off answer does not use up a request of the quota
+    quota = routes.quotas._quotas.get(user_id, count=False)
+    assert quota["used"] == 0
+    assert routes.ai_scheduler.active == 0
+
+
+def test_session_of_another_user_is_refused(client):
+    owner, other = _user(client), _user(client)
+    response = client.post(f'{address}/chat/stream', json={
+        "user_id": owner, "session_id": 0, "message": 'Привет'
+    })
+    session_id = _events(response.text)[0][1]["session_id"]
+    response = client.post(f'{address}/chat/stream', json={
+        "user_id": other, "session_id": session_id, "message": 'Привет'
+    })
+    assert response.status_code == 403
+    assert len(_ai_messages(client, session_id)) == 1
@@ -0,0 +1,225 @@
+import random
+import uuid
+
+import pytest
+from sqlalchemy import text
+
+from src.ai_api.context import estimate_tokens
+
+
+def _telegram_id():
+    return random.randrange(10 ** 12, 10 ** 13)
+
+
+def test_upsert_users_repeated_keys(postgres):
+    external_id, telegram_id = str(uuid.uuid4()), _telegram_id()
+
+    async def test(db):
+        return await db.upsert_users([
+            {"first_name": "a", "external_id": external_id},
+            {"first_name": "b", "telegram_id": telegram_id},
+            {"first_name": "c", "external_id": external_id},
+            {"first_name": "d", "telegram_id": telegram_id},
+        ])
+
+    users = postgres(test)
+    assert users[0].id == users[2].id
+    assert users[1].id == users[3].id
+    assert users[0].id != users[1].id
+    assert users[0].first_name == "c"
+
+
+def test_upsert_users_merges_rows_of_one_person(postgres):
+    external_id, telegram_id = str(uuid.uuid4()), _telegram_id()
+
+    async def test(db):
+        return await db.upsert_users([
+            {"first_name": "a", "age": 30, "external_id": external_id,
+             "telegram_id": telegram_id},
+            {"first_name": "b", "age": None, "external_id": external_id},
+            {"first_name": None, "gender": "f", "telegram_id": telegram_id},
+        ])
+
+    users = postgres(test)
+    assert users[0] is users[1] is users[2]
+    assert users[0].telegram_id == telegram_id
+    assert users[0].first_name == "b"
+    assert users[0].age == 30
+    assert users[0].gender == "f"
+
+
+def test_upsert_users_taken_telegram_id(postgres):
+    telegram_id = _telegram_id()
+    new_ids = [str(uuid.uuid4()) for _ in range(3)]
+
+    async def test(db):
+        owner = await db.create_user_from_front(
+            "owner", None, None, telegram_id=telegram_id
+        )
+        users = await db.upsert_users([
+            {"first_name": "x", "external_id": new_ids[0],
+             "telegram_id": telegram_id},
+        ])
+        other_telegram_id = _telegram_id()
+        pair = await db.upsert_users([
+            {"first_name": "y", "external_id": new_ids[1],
+             "telegram_id": other_telegram_id},
+            {"first_name": "z", "external_id": new_ids[2],
+             "telegram_id": other_telegram_id},
+        ])
+        return owner, users, pair, other_telegram_id
+
+    owner, users, pair, other_telegram_id = postgres(test)
+    assert users[0].id != owner.id
+    assert users[0].telegram_id is None
+    assert owner.telegram_id == telegram_id
+    assert pair[0].telegram_id == other_telegram_id
+    assert pair[1].telegram_id is None
+
+
+def test_delete_expired_idempotency_keys(postgres):
+    user_id = random.randrange(10 ** 8, 2 ** 31)
+
+    async def test(db):
+        for key in ('old', 'new'):
+            await db.claim_idempotency_key(user_id, key, 'hash', ttl=60)
+        async with db.engine.begin() as conn:
+            await conn.execute(text(
+                "UPDATE idempotency_keys "
+                "SET created_at = now() - interval '2 hours' "
+                "WHERE user_id = :user_id AND key = 'old'"
+            ), {"user_id": user_id})
+        deleted = await db.delete_expired_idempotency_keys(3600)
+        return (
+            deleted,
+            await db.get_idempotency_key(user_id, 'old'),
+            await db.get_idempotency_key(user_id, 'new'),
+        )
+
+    deleted, old, new = postgres(test)
+    assert deleted >= 1
+    assert old is None
+    assert new is not None
+
+
+def test_prepare_turn_caches_sessions_of_the_user(postgres):
+    async def test(db):
+        user, other = await db.upsert_users(
+            [{"first_name": "a"}, {"first_name": "b"}]
+        )
+        first = (await db.prepare_turn(user.id, 0, "hi"))["session_id"]
+        hits = db._sessions.stats()["hits"]
+        # Picking a session by id keeps the latest one cached
+        await db.prepare_turn(user.id, first, "hi")
+        active = db._active_sessions.get(user.id, count=False)
+        second = await db.create_new_session(user.id)
+        await db.prepare_turn(user.id, second, "hi")
+        await db.prepare_turn(user.id, first, "hi")
+        hits = db._sessions.stats()["hits"] - hits
+        with pytest.raises(PermissionError):
+            await db.prepare_turn(other.id, first, "hi")
+        history = await db.get_session_history(first, 100)
+        return (
+            first, active, hits, (other.id, first) in db._sessions._data,
+            len(history)
+        )
+
+    first, active, hits, cached_for_other, messages = postgres(test)
+    assert active == first
+    assert hits == 2
+    # Neither cached nor written for another user
+    assert not cached_for_other
+    assert messages == 3
+
+
+def test_history_pages_forward_and_back(postgres):
+    async def test(db):
+        user, = await db.upsert_users([{"first_name": "a"}])
+        session_id = await db.create_new_session(user.id)
+        # One transaction, so the messages share created_at and are told
+        # apart by id
+        ids = await db.save_messages([
+            {"session_id": session_id, "sender": "user",
+             "message_text": str(i)}
+            for i in range(5)
+        ])
+        pages = []
+        position = None
+        while True:
+            page, has_more = await db.get_history_page(
+                user.id, session_id, 2, after=position
+            )
+            pages.append(([row["id"] for row in page], has_more))
+            if not has_more:
+                break
+            position = page[-1]["created_at"], page[-1]["id"]
+        last = page[0]["created_at"], page[0]["id"]
+        back, back_more = await db.get_history_page(
+            user.id, session_id, 2, before=last
+        )
+        first = back[0]["created_at"], back[0]["id"]
+        front, front_more = await db.get_history_page(
+            user.id, session_id, 2, before=first
+        )
+        return (
+            ids, pages, [row["id"] for row in back], back_more,
+            [row["id"] for row in front], front_more
+        )
+
+    ids, pages, back, back_more, front, front_more = postgres(test)
+    assert pages == [(ids[:2], True), (ids[2:4], True), (ids[4:], False)]
+    assert (back, back_more) == (ids[2:4], True)
+    assert (front, front_more) == (ids[:2], False)
+
+
+def test_prepare_turn_counts_messages_past_the_history(postgres):
+    async def test(db):
+        user, = await db.upsert_users([{"first_name": "a"}])
+        session_id = await db.create_new_session(user.id)
+        ids = await db.save_messages([
+            {"session_id": session_id, "sender": "user",
+             "message_text": str(i)}
+            for i in range(5)
+        ])
+        first = await db.prepare_turn(
+            user.id, session_id, "hi", history_limit=2, count_limit=10
+        )
+        await db.save_summary(session_id, "summary", ids[2])
+        second = await db.prepare_turn(
+            user.id, session_id, "hi", history_limit=2, count_limit=10
+        )
+        capped = await db.prepare_turn(
+            user.id, session_id, "hi", history_limit=2, count_limit=3
+        )
+        return first, second, capped
+
+    first, second, capped = postgres(test)
+    assert len(first["history"]) == 2
+    assert first["unsummarized"] == 5
+    # Two messages and the one of the first turn are past the summary
+    assert second["unsummarized"] == 3
+    assert capped["unsummarized"] == 3
+
+
+def test_prepare_turn_stores_missing_token_counts(postgres):
+    async def test(db):
+        user, = await db.upsert_users([{"first_name": "a"}])
+        session_id = await db.create_new_session(user.id)
+        # A message saved before token_count was added
+        ids = await db.save_messages([
+            {"session_id": session_id, "sender": "user",
+             "message_text": "старое сообщение"}
+        ])
+        async with db.engine.begin() as conn:
+            await conn.execute(text(
+                "UPDATE messages SET token_count = NULL WHERE id = :id"
+            ), {"id": ids[0]})
+        turn = await db.prepare_turn(user.id, session_id, "hi")
+        async with db.engine.connect() as conn:
+            stored = await conn.scalar(text(
+                "SELECT token_count FROM messages WHERE id = :id"
+            ), {"id": ids[0]})
+        return turn["history"][0]["tokens"], stored
+
+    tokens, stored = postgres(test)
+    assert tokens == stored == estimate_tokens("старое сообщение")
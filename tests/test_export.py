@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta, timezone
+
+import pyarrow as pa
+from sqlalchemy import func, select
+
+from src.api_versions.v1 import export, schemas
+
+
+def test_rows_are_written_by_day(tmp_path):
+    table = schemas.Message.__table__
+    rows = [
+        {"id": i, "session_id": 1, "sender": "user", "message_text": "hi",
+         "created_at": datetime(2025, 1, 1 + i // 2, 12, tzinfo=timezone.utc),
+         "token_usage": 0, "token_count": None}
+        for i in range(4)
+    ]
+    days = export._by_day(rows, 'created_at')
+    assert [len(day_rows) for day_rows in days.values()] == [2, 2]
+
+    path = str(tmp_path / 'messages.parquet')
+    export._write(rows, export._arrow_schema(table), path, 'parquet')
+    written = pa.parquet.read_table(path)
+    assert written.num_rows == 4
+    created_at = written.schema.field('created_at')
+    assert created_at.type == pa.timestamp('us', tz='UTC')
+
+    export._save_state(str(tmp_path), {"messages": 3})
+    assert export._load_state(str(tmp_path)) == {"messages": 3}
+
+
+def test_export_is_incremental_and_lags(postgres, tmp_path):
+    messages = schemas.Message.__table__
+    out = str(tmp_path)
+
+    async def test(db):
+        user, = await db.upsert_users([{"first_name": "a"}])
+        session_id = await db.create_new_session(user.id)
+        async with db.engine.connect() as conn:
+            mark, now = (await conn.execute(
+                select(func.coalesce(func.max(messages.c.id), 0), func.now())
+            )).one()
+        state = {
+            "messages": mark,
+            "messages.created_at": (now - timedelta(hours=1)).isoformat(),
+        }
+        ids = await db.save_messages([
+            {"session_id": session_id, "sender": "user",
+             "message_text": str(age), "created_at": now - age}
+            for age in (timedelta(minutes=50), timedelta(minutes=40),
+                        timedelta(seconds=10))
+        ])
+
+        async def run():
+            async with db.engine.connect() as conn:
+                return await conn.run_sync(
+                    export.export_table, 'messages', out, state, lag=60
+                )
+
+        first = await run()
+        marks = state["messages"], export._load_state(out)["messages"]
+        second = await run()
+        await db.save_messages([
+            {"session_id": session_id, "sender": "user",
+             "message_text": "late", "created_at": now - timedelta(hours=2)}
+        ])
+        third = await run()
+        return ids, first, marks, second, third
+
+    ids, first, marks, second, third = postgres(test)
+    # The youngest row waits for the lag, the late one is under the bound
+    assert first == 2
+    assert marks == (ids[1], ids[1])
+    assert second == 0
+    assert third == 0
+    written = sorted(
+        message_id
+        for path in tmp_path.glob('messages/*/*.parquet')
+        for message_id in pa.parquet.read_table(path).column('id').to_pylist()
+    )
+    assert written == ids[:2]
@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from src.api_versions.v1.idempotency import IdempotencyStore
+
+
+class _Database:
+    def __init__(self):
+        self.keys = {}
+
+    async def claim_idempotency_key(self, user_id, key, request_hash, ttl):
+        if (user_id, key) in self.keys:
+            return self.keys[(user_id, key)]
+        self.keys[(user_id, key)] = {
+            "request_hash": request_hash, "response": None,
+            "completed_at": None
+        }
+
+    async def get_idempotency_key(self, user_id, key):
+        return self.keys.get((user_id, key))
+
+    async def complete_idempotency_key(self, user_id, key, response):
+        self.keys[(user_id, key)].update(response=response, completed_at=1)
+
+    async def release_idempotency_key(self, user_id, key):
+        self.keys.pop((user_id, key), None)
+
+
+def test_retries_share_one_call():
+    calls = []
+
+    async def chat():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"answer": "hi", "session_id": 1}
+
+    async def run():
+        store = IdempotencyStore(_Database())
+        payload = {"user_id": 1, "session_id": 1, "message": "hello"}
+        first, retry = await asyncio.gather(
+            store.run(1, 'key', payload, chat),
+            store.run(1, 'key', payload, chat)
+        )
+        # Another process finished it
+        other = IdempotencyStore(store._db)
+        later = await other.run(1, 'key', payload, chat)
+        with pytest.raises(HTTPException) as e:
+            await other.run(1, 'key', {**payload, "message": "bye"}, chat)
+        return first, retry, later, e.value.status_code
+
+    first, retry, later, status_code = asyncio.run(run())
+    assert first == retry == later == {"answer": "hi", "session_id": 1}
+    assert status_code == 422
+    assert len(calls) == 1
+
+
+def test_failed_request_frees_the_key():
+    async def fail():
+        raise HTTPException(status_code=503)
+
+    async def chat():
+        return {"answer": "hi", "session_id": 1}
+
+    async def run():
+        store = IdempotencyStore(_Database())
+        with pytest.raises(HTTPException):
+            await store.run(1, 'key', {}, fail)
+        return await store.run(1, 'key', {}, chat)
+
+    assert asyncio.run(run()) == {"answer": "hi", "session_id": 1}
@@ -0,0 +1,74 @@
+import asyncio
+
+import numpy as np
+
+from src.api_versions.v1.memory import MemoryIndex, MemoryStore, embed
+
+
+class _Database:
+    def __init__(self, items):
+        self.items = items
+        self.loads = 0
+
+    async def get_memory_items(self, user_id, limit):
+        self.loads += 1
+        return self.items[-limit:]
+
+
+def test_embed_matches_word_forms():
+    query = embed('Я опять плохо сплю, бессонница')
+    related = embed('Бессонница мучает, плохо сплю по ночам')
+    unrelated = embed('Поссорился с начальником на работе')
+    assert abs(np.linalg.norm(query) - 1) < 1e-5
+    assert query @ related > query @ unrelated
+    assert not embed('...').any()
+
+
+def test_index_keeps_the_latest_items():
+    index = MemoryIndex(max_items=100)
+    for i in range(250):
+        index.add(i, f'сообщение номер {i}')
+    assert len(index) == 100
+    found = index.search(embed('сообщение номер 249'), k=1)
+    assert found == ['сообщение номер 249']
+    found = index.search(embed('сообщение номер 5'), k=1)
+    assert found != ['сообщение номер 5']
+
+
+def test_recall_leaves_out_the_current_session():
+    db = _Database([
+        {'session_id': 1, 'text': 'Меня пугают экзамены в университете'},
+        {'session_id': 1, 'text': 'Люблю гулять с собакой'},
+        {'session_id': 2, 'text': 'Экзамены уже через неделю'},
+    ])
+
+    async def run():
+        store = MemoryStore(db, top_k=2, min_score=0.2)
+        first, second = await asyncio.gather(
+            store.recall(7, 2, 'Снова думаю про экзамен'),
+            store.recall(7, 2, 'Снова думаю про экзамен')
+        )
+        await store.recall(7, 3, 'Экзамен сдан!')
+        third = await store.recall(7, 4, 'Как прошел экзамен?')
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    assert first == second == ['Меня пугают экзамены в университете']
+    assert third[0] == 'Экзамен сдан!'
+    assert db.loads == 1
+
+
+def test_new_summary_replaces_the_older_one():
+    db = _Database([{
+        'session_id': 1, 'text': 'Пользователь боится экзаменов',
+        'summary': True
+    }])
+
+    async def run():
+        store = MemoryStore(db, top_k=2, min_score=0.1)
+        await store.recall(7, 2, 'Привет')
+        store.add_summary(7, 1, 'Пользователь боится экзаменов и плохо спит')
+        store.add_summary(8, 1, 'Не загруженный пользователь')
+        return await store.recall(7, 2, 'Снова боюсь экзаменов')
+
+    assert asyncio.run(run()) == ['Пользователь боится экзаменов и плохо спит']
@@ -0,0 +1,123 @@
+import asyncio
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+
+from src.api_versions.v1.partitions import (
+    PARTITIONED_TABLES,
+    PartitionMaintainer,
+    _month,
+    _overlaps,
+    _parse_bound,
+    ensure_partitions,
+    migrate_search,
+)
+
+
+def test_monthly_bounds():
+    moment = datetime(2025, 12, 31, 23, 0, tzinfo=timezone.utc)
+    assert _month(moment) == datetime(2025, 12, 1, tzinfo=timezone.utc)
+    assert _month(moment, 1) == datetime(2026, 1, 1, tzinfo=timezone.utc)
+    assert _month(moment, -12) == datetime(2024, 12, 1, tzinfo=timezone.utc)
+
+
+def test_existing_partitions_are_not_overlapped():
+    legacy = (
+        'messages_legacy', None, _parse_bound("'2026-01-01 03:00:00+03'")
+    )
+    new_year = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    january = (_month(new_year), _month(new_year, 1))
+    december = datetime(2025, 12, 1, tzinfo=timezone.utc)
+    assert _overlaps([legacy], december, january[0])
+    assert not _overlaps([legacy], *january)
+
+
+def test_rows_in_the_default_partition_are_moved(postgres):
+    # A month far ahead, so its rows land in the default partition
+    moment = datetime(2090, 1, 15, tzinfo=timezone.utc)
+
+    async def test(db):
+        async with db.engine.begin() as conn:
+            user_id = await conn.scalar(text(
+                "INSERT INTO users (first_name) VALUES ('partitions') "
+                "RETURNING id"
+            ))
+            session_id = await conn.scalar(text(
+                "INSERT INTO chat_sessions (user_id) VALUES (:user_id) "
+                "RETURNING id"
+            ), {"user_id": user_id})
+            await conn.execute(text(
+                "INSERT INTO messages (session_id, sender, message_text, "
+                "created_at) VALUES (:session_id, 'user', 'hi', :moment)"
+            ), {"session_id": session_id, "moment": moment})
+        try:
+            async with db.engine.begin() as conn:
+                created = await conn.run_sync(ensure_partitions, 0, moment)
+                partition = await conn.scalar(text(
+                    "SELECT tableoid::regclass::text FROM messages "
+                    "WHERE session_id = :session_id"
+                ), {"session_id": session_id})
+                default_attached = await conn.scalar(text(
+                    "SELECT count(*) FROM pg_inherits "
+                    "WHERE inhrelid = 'messages_default'::regclass"
+                ))
+            return created, partition, default_attached
+        finally:
+            async with db.engine.begin() as conn:
+                for table in PARTITIONED_TABLES:
+                    await conn.execute(text(
+                        f"DROP TABLE IF EXISTS {table}_p2090_01"
+                    ))
+                await conn.execute(text(
+                    "DELETE FROM messages WHERE session_id = :session_id"
+                ), {"session_id": session_id})
+                await conn.execute(text(
+                    "DELETE FROM chat_sessions WHERE id = :session_id"
+                ), {"session_id": session_id})
+                await conn.execute(text(
+                    "DELETE FROM users WHERE id = :user_id"
+                ), {"user_id": user_id})
+
+    created, partition, default_attached = postgres(test)
+    assert created == ['messages_p2090_01', 'ai_requests_p2090_01']
+    assert partition == 'messages_p2090_01'
+    assert default_attached == 1
+
+
+def test_migrate_search_is_idempotent(postgres):
+    async def test(db):
+        async with db.engine.connect() as conn:
+            await conn.execution_options(isolation_level='AUTOCOMMIT')
+            await conn.run_sync(migrate_search)
+            assert await conn.run_sync(migrate_search) == []
+            return await conn.scalar(text(
+                "SELECT indisvalid FROM pg_index "
+                "WHERE indexrelid = 'ix_messages_search_vector'::regclass"
+            ))
+
+    assert postgres(test)
+
+
+def test_maintainer_archives_only_with_a_retention():
+    class Database:
+        def __init__(self):
+            self.archived = []
+
+        async def ensure_partitions(self):
+            return []
+
+        async def archive_partitions(self, retention_months):
+            self.archived.append(retention_months)
+            return []
+
+    async def run(retention_months):
+        db = Database()
+        maintainer = PartitionMaintainer(db, 0.01, retention_months)
+        maintainer.start()
+        await asyncio.sleep(0.05)
+        await maintainer.stop()
+        return db.archived
+
+    archived = asyncio.run(run(12))
+    assert archived and set(archived) == {12}
+    assert asyncio.run(run(0)) == []
@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+from src.api_versions.v1.quotas import QuotaExceeded, QuotaStore
+
+
+class _Database:
+    def __init__(self):
+        self.flushed = []
+
+    async def get_quota(self, user_id, day):
+        return {
+            "subscription_id": 5, "plan_name": "free", "usage_limit": 2,
+            "used_requests": 1, "requests_today": 0
+        }
+
+    async def add_usage(self, subscriptions, usage):
+        self.flushed.append((subscriptions, usage))
+
+
+def test_quota_is_enforced_and_flushed_in_one_batch():
+    async def run():
+        db = _Database()
+        quotas = QuotaStore(db, flush_interval=60)
+        quotas.start()
+        quota = await quotas.reserve(1)
+        with pytest.raises(QuotaExceeded):
+            await quotas.reserve(1)
+        quotas.release(1, quota)
+        quota = await quotas.reserve(1)
+        quotas.record(1, tokens=10, sessions=1)
+        await quotas.stop()
+        return db.flushed
+
+    (subscriptions, usage), = asyncio.run(run())
+    assert subscriptions == {5: 1}
+    assert usage[0]["requests_count"] == 1
+    assert usage[0]["tokens_used"] == 10
+    assert usage[0]["session_count"] == 1
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from src.api_versions.v1.ratelimit import (
+    LocalBackend, RateLimited, RateLimiter, parse_plans
+)
+
+
+def test_parse_plans():
+    assert parse_plans('free=0.5/5, premium=5/50') == {
+        'free': (0.5, 5), 'premium': (5.0, 50)
+    }
+    assert parse_plans('') == {}
+
+
+def test_user_and_global_buckets():
+    async def plan(user_id):
+        return 'premium' if user_id == 2 else None
+
+    async def run():
+        backend = LocalBackend()
+        limiter = RateLimiter(
+            plan, backend, rate=0.01, burst=2, plans='premium=0.01/3',
+            global_rate=0.01, global_burst=6
+        )
+        for _ in range(2):
+            await limiter.check(1)
+        with pytest.raises(RateLimited) as e:
+            await limiter.check(1)
+        assert e.value.retry_after > 0
+        for _ in range(3):
+            await limiter.check(2)
+        with pytest.raises(RateLimited):
+            await limiter.check(2)
+        await limiter.check(3)
+        # Global bucket of 6 is empty now
+        with pytest.raises(RateLimited):
+            await limiter.check(4)
+        # and the rejected request did not use up the bucket of the user
+        for _ in range(2):
+            assert await backend.take('user:4', 0.01, 2) == 0
+
+    asyncio.run(run())
+
+
+def test_buckets_of_another_name_count_apart():
+    lookups = []
+
+    async def plan(user_id):
+        lookups.append(user_id)
+
+    async def run():
+        backend = LocalBackend()
+        chat = RateLimiter(plan, backend, rate=0.01, burst=1, global_rate=0)
+        history = RateLimiter(
+            plan, backend, rate=0.01, burst=3, global_rate=0,
+            bucket='history'
+        )
+        await chat.check(1)
+        for _ in range(3):
+            await history.check(1)
+        with pytest.raises(RateLimited):
+            await history.check(1)
+        with pytest.raises(RateLimited):
+            await chat.check(1)
+
+    asyncio.run(run())
+    # Nothing depends on the plan without plan limits
+    assert lookups == []
@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from src.api_versions.v1.scheduler import AICallScheduler, Overloaded
+
+
+def test_scheduler_serves_priorities_in_order_and_sheds_load():
+    async def run():
+        scheduler = AICallScheduler(
+            max_concurrent=1, max_queue=2, max_wait=1, priorities='free=1'
+        )
+        served = []
+
+        async def call(name, priority):
+            async with scheduler.slot(priority):
+                served.append(name)
+                await asyncio.sleep(0.01)
+
+        assert not scheduler.full
+        await scheduler.acquire()
+        assert scheduler.full
+        free = asyncio.create_task(call('free', scheduler.priority(None)))
+        await asyncio.sleep(0)
+        paid = asyncio.create_task(call('paid', scheduler.priority('premium')))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as e:
+            await scheduler.acquire()
+        assert e.value.reason == 'queue_full'
+        scheduler.release()
+        await asyncio.gather(free, paid)
+        assert served == ['paid', 'free']
+        assert scheduler.active == 0 and scheduler.queued == 0
+        assert not scheduler.full
+
+    asyncio.run(run())
+
+
+def test_scheduler_wait_timeout():
+    async def run():
+        scheduler = AICallScheduler(
+            max_concurrent=1, max_queue=10, max_wait=0.01
+        )
+        await scheduler.acquire()
+        with pytest.raises(Overloaded) as e:
+            await scheduler.acquire()
+        assert e.value.reason == 'timeout'
+        assert scheduler.queued == 0
+
+    asyncio.run(run())
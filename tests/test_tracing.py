@@ -0,0 +1,34 @@
+import asyncio
+
+from src.tracing import TimingMiddleware, span
+
+
+async def _app(scope, receive, send):
+    with span('db.query'):
+        await asyncio.sleep(0.01)
+    with span('db.query'):
+        pass
+    await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+    await send({'type': 'http.response.body', 'body': b'ok'})
+
+
+def test_server_timing_header():
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def receive():
+        return {'type': 'http.request'}
+
+    middleware = TimingMiddleware(
+        _app, server_timing=True, profile_sample_rate=0
+    )
+    scope = {'type': 'http', 'method': 'GET', 'path': '/', 'headers': []}
+    asyncio.run(middleware(scope, receive, send))
+
+    header = dict(sent[0]['headers'])[b'server-timing'].decode()
+    query, total = header.split(', ')
+    assert query.startswith('db.query;dur=') and query.endswith(';desc="x2"')
+    assert total.startswith('total;dur=')
+    assert float(query.split(';')[1][4:]) >= 10
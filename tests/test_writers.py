@@ -0,0 +1,57 @@
+import asyncio
+import base64
+import json
+import zlib
+
+from src.ai_api import APIError, StubAPI
+from src.api_versions.v1.writers import TelemetryWriter
+
+
+class _Database:
+    def __init__(self):
+        self.rows = []
+
+    async def save_ai_requests(self, rows):
+        self.rows.extend(rows)
+
+
+TURN = {"user_info": {"name": "Anna"}, "history": [], "summary": None}
+
+
+def test_telemetry_truncates_payloads():
+    async def run():
+        db = _Database()
+        writer = TelemetryWriter(db, max_chars=10, compress=False)
+        writer.start()
+        message_id = asyncio.get_running_loop().create_future()
+        writer.record(message_id, StubAPI(), TURN, 'x' * 100, 5,
+                      response={"text": "answer", "tokens": 3})
+        writer.record(7, StubAPI(), TURN, 'hi', 2,
+                      error=APIError('down', status_code=503))
+        message_id.set_result(42)
+        await writer.stop()
+        return db.rows
+
+    ok, failed = asyncio.run(run())
+    assert ok["message_id"] == 42
+    assert ok["status_code"] == 200
+    prompt = ok["request_payload"]["messages"][-1]["content"]
+    assert prompt.startswith('x' * 10 + '...')
+    assert failed["status_code"] == 503
+    assert failed["error_message"] == 'down'
+    assert failed["response_payload"] is None
+
+
+def test_telemetry_compresses_payloads():
+    async def run():
+        db = _Database()
+        writer = TelemetryWriter(db, max_chars=0, compress=True)
+        writer.start()
+        writer.record(1, StubAPI(), TURN, 'hi', 2,
+                      response={"text": "answer", "tokens": 3})
+        await writer.stop()
+        return db.rows[0]
+
+    row = asyncio.run(run())
+    data = zlib.decompress(base64.b64decode(row["response_payload"]["data"]))
+    assert json.loads(data) == {"text": "answer", "tokens": 3}